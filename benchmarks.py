@@ -23,15 +23,21 @@ Requirements:
 
 Usage:
     $ python benchmarks.py --weights yolov5s.pt --img 640
+    $ python benchmarks.py --decode --img 640  # image decoders, see utils/dataloaders.py decode_image()
+    $ python benchmarks.py --match --batch-size 32  # val.py process_batch() prediction matching
+    $ python benchmarks.py --compile --batch-size 16  # torch.compile() vs eager inference and training steps
 """
 
 import argparse
+import math
 import platform
 import sys
 import time
 from pathlib import Path
 
+import cv2
 import pandas as pd
+import torch
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[0]  # YOLOv5 root directory
@@ -44,8 +50,10 @@ from models.experimental import attempt_load
 from models.yolo import SegmentationModel
 from segment.val import run as val_seg
 from utils import notebook_init
+from utils.dataloaders import DECODERS, IMG_FORMATS, decode_image
 from utils.general import LOGGER, check_yaml, file_size, print_args
-from utils.torch_utils import select_device
+from utils.torch_utils import select_device, smart_compile, time_sync
+from val import process_batch
 from val import run as val_det
 
 
@@ -218,6 +226,135 @@ def test(
     return py
 
 
+def decode(source=ROOT / "data/images", imgsz=640, n=20):
+    """
+    Benchmarks image decoders on `source` images, timing decoding plus resizing to `imgsz` over `n` passes.
+
+    Example:
+        ```python
+        $ python benchmarks.py --decode --img 640
+        ```
+    """
+    files = [str(f) for f in sorted(Path(source).glob("*.*")) if f.suffix[1:].lower() in IMG_FORMATS]
+    assert files, f"No images found in {source}"
+    y = []
+    for decoder in DECODERS:
+        try:
+            dt = []
+            for _ in range(n):
+                t = time.perf_counter()
+                for f in files:
+                    im, (h0, w0) = decode_image(f, imgsz, decoder)
+                    r = imgsz / max(h0, w0)  # same resize as LoadImagesAndLabels.resize_image()
+                    im = cv2.resize(im, (math.ceil(w0 * r), math.ceil(h0 * r)), interpolation=cv2.INTER_AREA)
+                dt.append((time.perf_counter() - t) / len(files))
+            y.append([decoder, round(min(dt) * 1e3, 2), round(sorted(dt)[len(dt) // 2] * 1e3, 2)])
+        except Exception as e:
+            LOGGER.warning(f"WARNING ⚠️ Decoder {decoder} failed: {e}")
+            y.append([decoder, None, None])
+
+    py = pd.DataFrame(y, columns=["Decoder", "Best (ms/im)", "Median (ms/im)"])
+    LOGGER.info(f"\nDecode benchmarks complete for {len(files)} images in {source} at --imgsz {imgsz}")
+    LOGGER.info(str(py))
+    return py
+
+
+def match(batch_size=32, device="", n=20, labels=7, detections=300, nc=80):
+    """
+    Benchmarks val.py process_batch() on synthetic COCO-like images, per image and for whole batches at once.
+
+    Each image has `labels` ground truth boxes and `detections` predictions (max_det) jittered around them.
+
+    Example:
+        ```python
+        $ python benchmarks.py --match --batch-size 32
+        ```
+    """
+    device = select_device(device, batch_size=batch_size)
+    g = torch.Generator().manual_seed(0)
+    iouv = torch.linspace(0.5, 0.95, 10, device=device)
+    batch = []
+    for _ in range(batch_size):
+        xy = torch.rand(labels, 2, generator=g) * 540
+        wh = torch.rand(labels, 2, generator=g) * 100
+        lb = torch.cat((torch.randint(0, nc, (labels, 1), generator=g), xy, xy + wh), 1)  # cls, xyxy
+        k = torch.randint(0, labels, (detections,), generator=g)
+        conf = torch.rand(detections, 1, generator=g).sort(0, descending=True)[0]
+        pred = torch.cat((lb[k, 1:] + torch.randn(detections, 4, generator=g) * 10, conf, lb[k, :1]), 1)
+        batch.append((pred.to(device), lb.to(device)))
+    n_pred = torch.tensor([len(x[0]) for x in batch], device=device)
+    images = torch.arange(batch_size, device=device)
+    args = (
+        torch.cat([x[0] for x in batch]),
+        torch.cat([x[1] for x in batch]),
+        iouv,
+        images.repeat_interleave(n_pred),
+        images.repeat_interleave(torch.tensor([len(x[1]) for x in batch], device=device)),
+    )
+
+    y = []
+    for name, fn in (
+        ("per image", lambda: [process_batch(*x, iouv).cpu() for x in batch]),
+        ("per batch", lambda: process_batch(*args).cpu()),
+    ):
+        fn()  # warmup
+        t = time.perf_counter()
+        for _ in range(n):
+            fn()
+        y.append([name, round((time.perf_counter() - t) / n / batch_size * 1e3, 3)])
+
+    py = pd.DataFrame(y, columns=["Matching", "Time (ms/im)"])
+    LOGGER.info(f"\nprocess_batch() benchmarks complete for {batch_size} images with {detections} detections each")
+    LOGGER.info(str(py))
+    return py
+
+
+def compiled(weights=ROOT / "yolov5s.pt", imgsz=640, batch_size=1, device="", half=False, n=20):
+    """
+    Benchmarks torch.compile() against eager PyTorch for inference and training steps (forward and backward) of
+    `weights`, reporting the first call including compilation and the median of `n` further calls.
+
+    Example:
+        ```python
+        $ python benchmarks.py --compile --weights yolov5s.pt --img 640 --batch-size 16
+        ```
+    """
+    device = select_device(device, batch_size=batch_size)
+    half &= device.type != "cpu"  # half precision only supported on CUDA
+    model = attempt_load(weights, device=device, inplace=True, fuse=False)
+    model.half() if half else model.float()
+    im = torch.zeros(batch_size, 3, imgsz, imgsz, device=device).type_as(next(model.parameters()))
+
+    def step(m, train):
+        """Runs one inference or training step of `m`."""
+        model.train(train)
+        if train:
+            sum(x.float().sum() for x in m(im)).backward()  # Detect outputs
+            model.zero_grad(set_to_none=True)
+        else:
+            with torch.inference_mode():
+                m(im)
+
+    y = []
+    for train in (False, True):
+        for name, m in (("eager", model), ("compile", smart_compile(model))):
+            t = time_sync()
+            step(m, train)
+            first = time_sync() - t
+            dt = []
+            for _ in range(n):
+                t = time_sync()
+                step(m, train)
+                dt.append(time_sync() - t)
+            median = sorted(dt)[n // 2]
+            y.append(["train" if train else "inference", name, round(first, 2), round(median / batch_size * 1e3, 2)])
+
+    py = pd.DataFrame(y, columns=["Step", "Mode", "First call (s)", "Median (ms/im)"])
+    LOGGER.info(f"\ntorch.compile() benchmarks complete for {weights} at --batch-size {batch_size} --imgsz {imgsz}")
+    LOGGER.info(str(py))
+    return py
+
+
 def parse_opt():
     """
     Parses command-line arguments for YOLOv5 model inference configuration.
@@ -233,6 +370,9 @@ def parse_opt():
         pt_only (bool): Test PyTorch only. This is a flag and defaults to False.
         hard_fail (bool | str): Throw an error on benchmark failure. Can be a boolean or a string representing a minimum
             metric floor, e.g., '0.29'. Defaults to False.
+        decode (bool): Benchmark image decoders on data/images only. This is a flag and defaults to False.
+        match (bool): Benchmark val.py prediction matching only. This is a flag and defaults to False.
+        compile (bool): Benchmark torch.compile() against eager PyTorch only. This is a flag and defaults to False.
 
     Returns:
         argparse.Namespace: Parsed command-line arguments encapsulated in an argparse Namespace object.
@@ -251,6 +391,9 @@ def parse_opt():
     parser.add_argument("--test", action="store_true", help="test exports only")
     parser.add_argument("--pt-only", action="store_true", help="test PyTorch only")
     parser.add_argument("--hard-fail", nargs="?", const=True, default=False, help="Exception on error or < min metric")
+    parser.add_argument("--decode", action="store_true", help="benchmark image decoders only")
+    parser.add_argument("--match", action="store_true", help="benchmark val.py prediction matching only")
+    parser.add_argument("--compile", action="store_true", help="benchmark torch.compile() vs eager only")
     opt = parser.parse_args()
     opt.data = check_yaml(opt.data)  # check YAML
     print_args(vars(opt))
@@ -286,7 +429,15 @@ def main(opt):
         $ python benchmarks.py --weights yolov5s.pt --img 640
         ```
     """
-    test(**vars(opt)) if opt.test else run(**vars(opt))
+    opt = vars(opt)
+    if opt.pop("decode"):
+        decode(imgsz=opt["imgsz"])
+    elif opt.pop("match"):
+        match(batch_size=opt["batch_size"], device=opt["device"])
+    elif opt.pop("compile"):
+        compiled(opt["weights"], opt["imgsz"], opt["batch_size"], opt["device"], opt["half"])
+    else:
+        test(**opt) if opt["test"] else run(**opt)
 
 
 if __name__ == "__main__":
@@ -38,6 +38,7 @@ from ultralytics.utils.plotting import Annotator, colors, save_one_box
 from utils import TryExcept
 from utils.dataloaders import exif_transpose, letterbox
 from utils.general import (
+    BACKEND_CACHE_DIR,
     LOGGER,
     ROOT,
     Profile,
@@ -45,6 +46,7 @@ from utils.general import (
     check_suffix,
     check_version,
     colorstr,
+    file_hash,
     increment_path,
     is_jupyter,
     make_divisible,
@@ -54,7 +56,7 @@ from utils.general import (
     xyxy2xywh,
     yaml_load,
 )
-from utils.torch_utils import copy_attr, smart_inference_mode
+from utils.torch_utils import copy_attr, is_compiling, smart_compile, smart_inference_mode
 
 
 def autopad(k, p=None, d=1):
@@ -309,6 +311,8 @@ class SPP(nn.Module):
         tensor.
         """
         x = self.cv1(x)
+        if is_compiling():  # warning filters break the graph
+            return self.cv2(torch.cat([x] + [m(x) for m in self.m], 1))
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")  # suppress torch 1.9.0 max_pool2d() warning
             return self.cv2(torch.cat([x] + [m(x) for m in self.m], 1))
@@ -333,11 +337,17 @@ class SPPF(nn.Module):
     def forward(self, x):
         """Processes input through a series of convolutions and max pooling operations for feature extraction."""
         x = self.cv1(x)
+        if is_compiling():  # warning filters break the graph
+            return self._pool(x)
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")  # suppress torch 1.9.0 max_pool2d() warning
-            y1 = self.m(x)
-            y2 = self.m(y1)
-            return self.cv2(torch.cat((x, y1, y2, self.m(y2)), 1))
+            return self._pool(x)
+
+    def _pool(self, x):
+        """Concatenates `x` with three successive max poolings of it and applies the output convolution."""
+        y1 = self.m(x)
+        y2 = self.m(y1)
+        return self.cv2(torch.cat((x, y1, y2, self.m(y2)), 1))
 
 
 class Focus(nn.Module):
@@ -459,8 +469,19 @@ class Concat(nn.Module):
 class DetectMultiBackend(nn.Module):
     """YOLOv5 MultiBackend class for inference on various backends including PyTorch, ONNX, TensorRT, and more."""
 
-    def __init__(self, weights="yolov5s.pt", device=torch.device("cpu"), dnn=False, data=None, fp16=False, fuse=True):
-        """Initializes DetectMultiBackend with support for various inference backends, including PyTorch and ONNX."""
+    def __init__(
+        self,
+        weights="yolov5s.pt",
+        device=torch.device("cpu"),
+        dnn=False,
+        data=None,
+        fp16=False,
+        fuse=True,
+        torch_compile=False,
+    ):
+        """Initializes DetectMultiBackend with support for various inference backends, including PyTorch and ONNX, and
+        optional torch.compile() for PyTorch models.
+        """
         #   PyTorch:              weights = *.pt
         #   TorchScript:                    *.torchscript
         #   ONNX Runtime:                   *.onnx
@@ -490,6 +511,8 @@ class DetectMultiBackend(nn.Module):
             stride = max(int(model.stride.max()), 32)  # model stride
             names = model.module.names if hasattr(model, "module") else model.names  # get class names
             model.half() if fp16 else model.float()
+            if torch_compile:
+                model = smart_compile(model)  # compiled on first inference, i.e. warmup()
             self.model = model  # explicitly assign for to(), cpu(), cuda(), half()
         elif jit:  # TorchScript
             LOGGER.info(f"Loading {w} for TorchScript inference...")
@@ -509,11 +532,14 @@ class DetectMultiBackend(nn.Module):
         elif onnx:  # ONNX Runtime
             LOGGER.info(f"Loading {w} for ONNX Runtime inference...")
             check_requirements(("onnx", "onnxruntime-gpu" if cuda else "onnxruntime"))
-            import onnxruntime
-
             providers = ["CUDAExecutionProvider", "CPUExecutionProvider"] if cuda else ["CPUExecutionProvider"]
-            session = onnxruntime.InferenceSession(w, providers=providers)
+            onnx_hash = file_hash(path=w)  # model contents, part of every graph cache key
+            session = self._onnx_session(w, providers, onnx_hash)  # exported input shape
+            sessions = {}  # per-shape sessions for models exported with --dynamic
+            input_dims = session.get_inputs()[0].shape  # i.e. [1, 3, 640, 640] or ['batch', 3, 'height', 'width']
+            input_name = session.get_inputs()[0].name
             output_names = [x.name for x in session.get_outputs()]
+            io_bindings = {}  # (shape, device) -> [IOBinding, preallocated outputs]
             meta = session.get_modelmeta().custom_metadata_map  # metadata
             if "stride" in meta:
                 stride, names = int(meta["stride"]), eval(meta["names"])
@@ -523,15 +549,18 @@ class DetectMultiBackend(nn.Module):
             from openvino.runtime import Core, Layout, get_batch
 
             core = Core()
+            core.set_property({"CACHE_DIR": str(BACKEND_CACHE_DIR / "openvino")})  # compiled blob cache
             if not Path(w).is_file():  # if not *.xml
                 w = next(Path(w).glob("*.xml"))  # get *.xml file from *_openvino_model dir
             ov_model = core.read_model(model=w, weights=Path(w).with_suffix(".bin"))
             if ov_model.get_parameters()[0].get_layout().empty:
                 ov_model.get_parameters()[0].set_layout(Layout("NCHW"))
             batch_dim = get_batch(ov_model)
-            if batch_dim.is_static:
-                batch_size = batch_dim.get_length()
-            ov_compiled_model = core.compile_model(ov_model, device_name="AUTO")  # AUTO selects best available device
+            batch_size = batch_dim.get_length() if batch_dim.is_static else None
+            ov_input = ov_model.input(0).get_partial_shape()
+            ov_shape = tuple(ov_input.to_shape()) if ov_input.is_static else None  # exported input shape
+            ov_compiled_models = {}  # per-shape compiled models, compiled on first inference
+            ov_queues = {}  # per-request-shape AsyncInferQueues for batches, created on first use
             stride, names = self._load_metadata(Path(w).with_suffix(".yaml"))  # load metadata
         elif engine:  # TensorRT
             LOGGER.info(f"Loading {w} for TensorRT inference...")
@@ -693,11 +722,13 @@ class DetectMultiBackend(nn.Module):
             self.net.setInput(im)
             y = self.net.forward()
         elif self.onnx:  # ONNX Runtime
-            im = im.cpu().numpy()  # torch to numpy
-            y = self.session.run(self.output_names, {self.session.get_inputs()[0].name: im})
+            y = self._onnx_run(im)
         elif self.xml:  # OpenVINO
             im = im.cpu().numpy()  # FP32
-            y = list(self.ov_compiled_model(im).values())
+            if b > (self.batch_size or 1):  # split over parallel infer requests
+                y = self._ov_async_infer(im)
+            else:
+                y = list(self._ov_shape_model(im.shape)(im).values())
         elif self.engine:  # TensorRT
             if self.dynamic and im.shape != self.bindings["images"].shape:
                 i = self.model.get_binding_index("images")
@@ -762,8 +793,126 @@ class DetectMultiBackend(nn.Module):
         """Converts a NumPy array to a torch tensor, maintaining device compatibility."""
         return torch.from_numpy(x).to(self.device) if isinstance(x, np.ndarray) else x
 
+    def _onnx_shape_session(self, shape):
+        """Returns the ONNX Runtime session specialized for input `shape`, creating it from the graph cache if needed."""
+        shape = tuple(shape)
+        overrides = {d: s for d, s in zip(self.input_dims, shape) if isinstance(d, str)}  # dynamic axes
+        if not overrides:  # static model
+            return self.session
+        if shape not in self.sessions:
+            self.sessions[shape] = self._onnx_session(self.w, self.providers, self.onnx_hash, overrides)
+        return self.sessions[shape]
+
+    def _ov_shape_model(self, shape):
+        """Returns the OpenVINO model compiled for input `shape`, reshaping and compiling (or loading a cached blob)."""
+        shape = tuple(shape)
+        if shape not in self.ov_compiled_models:
+            if shape != self.ov_shape:
+                LOGGER.info(f"Compiling OpenVINO model for input shape {shape}...")
+            self.ov_model.reshape({self.ov_model.input(0).get_any_name(): list(shape)})
+            self.ov_compiled_models[shape] = self.core.compile_model(self.ov_model, device_name="AUTO")  # AUTO device
+        return self.ov_compiled_models[shape]
+
+    def _onnx_run(self, im):
+        """
+        Runs ONNX Runtime inference through a cached IOBinding, handing torch memory to ORT without copies.
+
+        Output buffers are preallocated once per input shape and reused, so returned tensors are overwritten by the next
+        call (as with TensorRT bindings).
+        """
+        session = self._onnx_shape_session(im.shape)
+        cuda = im.is_cuda and session.get_providers()[0] == "CUDAExecutionProvider"
+        im = (im if cuda else im.cpu()).contiguous()
+        dtypes = {torch.float16: np.float16, torch.float32: np.float32}  # torch to numpy element types
+        device = ("cuda", im.device.index or 0) if cuda else ("cpu", 0)  # ORT (device_type, device_id)
+        key = (tuple(im.shape), device)
+        if key not in self.io_bindings:
+            self.io_bindings[key] = [session.io_binding(), None]
+        io, outputs = self.io_bindings[key]
+        io.bind_input(self.input_name, *device, dtypes[im.dtype], tuple(im.shape), im.data_ptr())
+        if cuda:
+            torch.cuda.current_stream(im.device).synchronize()  # input written on torch stream, read on ORT stream
+        if outputs is None:  # first call for this shape, let ORT allocate then preallocate matching torch buffers
+            for name in self.output_names:
+                io.bind_output(name, *device)
+            session.run_with_iobinding(io)
+            outputs = [torch.from_numpy(x.numpy()).to(im.device) for x in io.get_outputs()]
+            for name, x in zip(self.output_names, outputs):
+                io.bind_output(name, *device, dtypes[x.dtype], tuple(x.shape), x.data_ptr())
+            self.io_bindings[key][1] = outputs
+        else:
+            session.run_with_iobinding(io)
+        return [x.to(self.device) for x in outputs]
+
+    def _ov_async_infer(self, im):
+        """
+        Runs a batch as parallel requests on an AsyncInferQueue, each of the static OpenVINO model batch (or one image
+        for dynamic-batch models), zero-padding the last partial request and trimming its outputs.
+
+        Each queue uses a THROUGHPUT-hinted compiled model sized to the device's optimal number of infer requests (one
+        per CPU stream), so all cores are kept busy.
+        """
+        n = self.batch_size or 1  # images per request
+        shape = (n, *im.shape[1:])
+        if shape not in self.ov_queues:
+            from openvino.runtime import AsyncInferQueue
+
+            def callback(request, userdata):
+                """Stores the outputs of the `k` real images of a completed request in its batch slot."""
+                results, i, k = userdata
+                results[i] = [x.data[:k].copy() for x in request.output_tensors]
+
+            self.ov_model.reshape({self.ov_model.input(0).get_any_name(): list(shape)})
+            model = self.core.compile_model(self.ov_model, "AUTO", {"PERFORMANCE_HINT": "THROUGHPUT"})
+            self.ov_queues[shape] = AsyncInferQueue(model, model.get_property("OPTIMAL_NUMBER_OF_INFER_REQUESTS"))
+            self.ov_queues[shape].set_callback(callback)
+            LOGGER.info(f"OpenVINO THROUGHPUT mode with {len(self.ov_queues[shape])} parallel infer requests")
+        queue = self.ov_queues[shape]
+        results = [None] * math.ceil(len(im) / n)
+        for i, j in enumerate(range(0, len(im), n)):
+            x = im[j : j + n]
+            k = len(x)
+            if k < n:  # pad to the compiled request batch
+                x = np.concatenate((x, np.zeros((n - k, *x.shape[1:]), dtype=x.dtype)))
+            queue.start_async({0: x}, (results, i, k))
+        queue.wait_all()
+        return [np.concatenate(x) for x in zip(*results)]
+
+    @staticmethod
+    def _onnx_session(w, providers, model_hash, overrides=None):
+        """
+        Creates an ONNX Runtime session, reusing a persistent hash-keyed cache of optimized graphs.
+
+        The cache key covers the `model_hash` of the model contents, `providers`, dynamic axis `overrides` (i.e.
+        {'batch': 16}), onnxruntime version and host machine, so a cached graph is only reused where it was optimized.
+        """
+        import onnxruntime
+
+        overrides = overrides or {}
+        key = file_hash(model_hash, providers, sorted(overrides.items()), onnxruntime.__version__, platform.machine())
+        f = BACKEND_CACHE_DIR / "onnxruntime" / f"{Path(w).stem}-{key[:16]}.onnx"
+        options = onnxruntime.SessionOptions()
+        for name, size in overrides.items():
+            options.add_free_dimension_override_by_name(name, size)
+        if f.is_file():
+            with contextlib.suppress(Exception):  # fall through and rebuild if the cached graph is unreadable
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL  # pre-optimized
+                return onnxruntime.InferenceSession(str(f), options, providers=providers)
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        f.parent.mkdir(parents=True, exist_ok=True)
+        options.optimized_model_filepath = str(f)
+        try:
+            return onnxruntime.InferenceSession(w, options, providers=providers)
+        except Exception as e:  # i.e. graph contains compiled nodes that can not be serialized
+            LOGGER.warning(f"WARNING ⚠️ ONNX Runtime graph cache disabled for {w}: {e}")
+            f.unlink(missing_ok=True)
+            options.optimized_model_filepath = ""
+            return onnxruntime.InferenceSession(w, options, providers=providers)
+
     def warmup(self, imgsz=(1, 3, 640, 640)):
         """Performs a single inference warmup to initialize model weights, accepting an `imgsz` tuple for image size."""
+        if self.onnx:
+            self._onnx_shape_session(imgsz)  # load or build the optimized graph for this shape
         warmup_types = self.pt, self.jit, self.onnx, self.engine, self.saved_model, self.pb, self.triton
         if any(warmup_types) and (self.device.type != "cpu" or self.triton):
             im = torch.empty(*imgsz, dtype=torch.half if self.fp16 else torch.float, device=self.device)  # input
@@ -56,6 +56,7 @@ from utils.plots import feature_visualization
 from utils.torch_utils import (
     fuse_conv_and_bn,
     initialize_weights,
+    is_compiling,
     model_info,
     profile,
     scale_img,
@@ -98,18 +99,22 @@ class Detect(nn.Module):
             x[i] = x[i].view(bs, self.na, self.no, ny, nx).permute(0, 1, 3, 4, 2).contiguous()
 
             if not self.training:  # inference
-                if self.dynamic or self.grid[i].shape[2:4] != x[i].shape[2:4]:
-                    self.grid[i], self.anchor_grid[i] = self._make_grid(nx, ny, i)
+                if is_compiling():  # grids in graph, cached grids would recompile at every new shape
+                    grid, anchor_grid = self._make_grid(nx, ny, i)
+                else:
+                    if self.dynamic or self.grid[i].shape[2:4] != x[i].shape[2:4]:
+                        self.grid[i], self.anchor_grid[i] = self._make_grid(nx, ny, i)
+                    grid, anchor_grid = self.grid[i], self.anchor_grid[i]
 
                 if isinstance(self, Segment):  # (boxes + masks)
                     xy, wh, conf, mask = x[i].split((2, 2, self.nc + 1, self.no - self.nc - 5), 4)
-                    xy = (xy.sigmoid() * 2 + self.grid[i]) * self.stride[i]  # xy
-                    wh = (wh.sigmoid() * 2) ** 2 * self.anchor_grid[i]  # wh
+                    xy = (xy.sigmoid() * 2 + grid) * self.stride[i]  # xy
+                    wh = (wh.sigmoid() * 2) ** 2 * anchor_grid  # wh
                     y = torch.cat((xy, wh, conf.sigmoid(), mask), 4)
                 else:  # Detect (boxes only)
                     xy, wh, conf = x[i].sigmoid().split((2, 2, self.nc + 1), 4)
-                    xy = (xy * 2 + self.grid[i]) * self.stride[i]  # xy
-                    wh = (wh * 2) ** 2 * self.anchor_grid[i]  # wh
+                    xy = (xy * 2 + grid) * self.stride[i]  # xy
+                    wh = (wh * 2) ** 2 * anchor_grid  # wh
                     y = torch.cat((xy, wh, conf), 4)
                 z.append(y.view(bs, self.na * nx * ny, self.no))
 
@@ -345,7 +345,7 @@ def train(hyp, opt, device, callbacks):
         # dataset.mosaic_border = [b - imgsz, -b]  # height, width borders
 
         mloss = torch.zeros(4, device=device)  # mean losses
-        if RANK != -1:
+        if RANK != -1 and not opt.rect:  # --rect AspectRatioBatchSampler advances the sampler epoch itself
             train_loader.sampler.set_epoch(epoch)
         pbar = enumerate(train_loader)
         LOGGER.info(
@@ -16,13 +16,16 @@ Tutorial:   https://docs.ultralytics.com/yolov5/tutorials/train_custom_data
 
 import argparse
 import math
+import multiprocessing as mp
 import os
 import random
 import subprocess
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 from datetime import datetime, timedelta
+from functools import partial
 from pathlib import Path
 
 try:
@@ -47,10 +50,11 @@ ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 import val as validate  # for end-of-epoch mAP
 from models.experimental import attempt_load
 from models.yolo import Model
+from utils.augmentations import BatchAugmentations
 from utils.autoanchor import check_anchors
 from utils.autobatch import check_train_batch_size
 from utils.callbacks import Callbacks
-from utils.dataloaders import create_dataloader
+from utils.dataloaders import create_dataloader, subset_dataloader
 from utils.downloads import attempt_download, is_url
 from utils.general import (
     LOGGER,
@@ -72,6 +76,7 @@ from utils.general import (
     labels_to_class_weights,
     labels_to_image_weights,
     methods,
+    multi_scale_sizes,
     one_cycle,
     print_args,
     print_mutation,
@@ -84,10 +89,14 @@ from utils.loss import ComputeLoss
 from utils.metrics import fitness
 from utils.plots import plot_evolve
 from utils.torch_utils import (
+    CheckpointWriter,
     EarlyStopping,
     ModelEMA,
+    cpu_snapshot,
     de_parallel,
+    prewarm,
     select_device,
+    smart_compile,
     smart_DDP,
     smart_optimizer,
     smart_resume,
@@ -238,7 +247,7 @@ def train(hyp, opt, device, callbacks):
 
     # Batch size
     if RANK == -1 and batch_size == -1:  # single-GPU only, estimate best batch size
-        batch_size = check_train_batch_size(model, imgsz, amp)
+        batch_size = check_train_batch_size(model, imgsz, amp, mode=opt.autobatch)
         loggers.on_params_update({"batch_size": batch_size})
 
     # Optimizer
@@ -259,7 +268,7 @@ def train(hyp, opt, device, callbacks):
     scheduler = lr_scheduler.LambdaLR(optimizer, lr_lambda=lf)  # plot_lr_scheduler(optimizer, scheduler, epochs)
 
     # EMA
-    ema = ModelEMA(model) if RANK in {-1, 0} else None
+    ema = ModelEMA(model, every=opt.ema_every) if RANK in {-1, 0} else None
 
     # Resume
     best_fitness, start_epoch = 0.0, 0
@@ -282,6 +291,9 @@ def train(hyp, opt, device, callbacks):
         LOGGER.info("Using SyncBatchNorm()")
 
     # Trainloader
+    scales = None  # fixed multi-scale sizes, resized in DataLoader workers
+    if opt.multi_scale and opt.multi_scale_sizes:
+        scales = multi_scale_sizes(imgsz, gs, opt.multi_scale_sizes)
     train_loader, dataset = create_dataloader(
         train_path,
         imgsz,
@@ -299,19 +311,23 @@ def train(hyp, opt, device, callbacks):
         prefix=colorstr("train: "),
         shuffle=True,
         seed=opt.seed,
+        shards=opt.shards,
+        batch_augment=opt.batch_augment,
+        sizes=scales,
     )
     labels = np.concatenate(dataset.labels, 0)
     mlc = int(labels[:, 0].max())  # max label class
     assert mlc < nc, f"Label class {mlc} exceeds nc={nc} in {data}. Possible class labels are 0-{nc - 1}"
+    batch_augment = BatchAugmentations(hyp) if opt.batch_augment else None  # on-device augmentation
 
     # Process 0
     if RANK in {-1, 0}:
-        val_loader = create_dataloader(
-            val_path,
-            imgsz,
-            batch_size // WORLD_SIZE * 2,
-            gs,
-            single_cls,
+        val_loader_args = dict(
+            path=val_path,
+            imgsz=imgsz,
+            batch_size=batch_size // WORLD_SIZE * 2,
+            stride=gs,
+            single_cls=single_cls,
             hyp=hyp,
             cache=None if noval else opt.cache,
             rect=True,
@@ -319,7 +335,9 @@ def train(hyp, opt, device, callbacks):
             workers=workers * 2,
             pad=0.5,
             prefix=colorstr("val: "),
-        )[0]
+        )
+        val_loader = create_dataloader(**val_loader_args)[0]
+        val_subset_loader = subset_dataloader(val_loader, opt.val_subset) if opt.val_subset < 1 else val_loader
 
         if not resume:
             if not opt.noautoanchor:
@@ -355,6 +373,28 @@ def train(hyp, opt, device, callbacks):
     scaler = torch.cuda.amp.GradScaler(enabled=amp)
     stopper, stop = EarlyStopping(patience=opt.patience), False
     compute_loss = ComputeLoss(model)  # init loss class
+    compiled = smart_compile(model) if opt.compile else model  # training forward, shares parameters with model
+    saver = CheckpointWriter()  # background checkpoint saving
+    validator = None
+    if opt.val_async and not noval and RANK in {-1, 0}:  # validate in a background process
+        validator = validate.BackgroundValidator(
+            val_loader_args,
+            opt.val_subset,
+            device,
+            data=data_dict,
+            batch_size=batch_size // WORLD_SIZE * 2,
+            imgsz=imgsz,
+            half=amp,
+            single_cls=single_cls,
+            save_dir=save_dir,
+            plots=False,
+        )
+    train_logs, best_epoch, fi = {}, -1, 0.0  # background validation (train loss, lr) per epoch, best epoch, fitness
+    rungs = halving_epochs(epochs, opt.evolve_halving) if evolve else ()  # --evolve-halving validation epochs
+    if scales and opt.multi_scale_warmup:
+        LOGGER.info(f"{colorstr('multi-scale: ')}pre-warming sizes {scales}")
+        model.train()
+        prewarm(compiled, scales, batch_size // WORLD_SIZE, device, amp)
     callbacks.run("on_train_start")
     LOGGER.info(
         f'Image sizes {imgsz} train, {imgsz} val\n'
@@ -377,17 +417,21 @@ def train(hyp, opt, device, callbacks):
         # dataset.mosaic_border = [b - imgsz, -b]  # height, width borders
 
         mloss = torch.zeros(3, device=device)  # mean losses
-        if RANK != -1:
+        if opt.shards:
+            dataset.set_epoch(epoch)  # shard order
+        elif RANK != -1 and not opt.rect:  # --rect AspectRatioBatchSampler advances the sampler epoch itself
             train_loader.sampler.set_epoch(epoch)
         pbar = enumerate(train_loader)
         LOGGER.info(("\n" + "%11s" * 7) % ("Epoch", "GPU_mem", "box_loss", "obj_loss", "cls_loss", "Instances", "Size"))
         if RANK in {-1, 0}:
             pbar = tqdm(pbar, total=nb, bar_format=TQDM_BAR_FORMAT)  # progress bar
         optimizer.zero_grad()
-        for i, (imgs, targets, paths, _) in pbar:  # batch -------------------------------------------------------------
+        for i, (imgs, targets, paths, shapes) in pbar:  # batch --------------------------------------------------------
             callbacks.run("on_train_batch_start")
             ni = i + nb * epoch  # number integrated batches (since train start)
             imgs = imgs.to(device, non_blocking=True).float() / 255  # uint8 to float32, 0-255 to 0.0-1.0
+            if batch_augment:  # mosaics (shapes None) are already warped
+                imgs, targets = batch_augment(imgs, targets, warp=[x is not None for x in shapes])
 
             # Warmup
             if ni <= nw:
@@ -401,7 +445,7 @@ def train(hyp, opt, device, callbacks):
                         x["momentum"] = np.interp(ni, xi, [hyp["warmup_momentum"], hyp["momentum"]])
 
             # Multi-scale
-            if opt.multi_scale:
+            if opt.multi_scale and not scales:
                 sz = random.randrange(int(imgsz * 0.5), int(imgsz * 1.5) + gs) // gs * gs  # size
                 sf = sz / max(imgs.shape[2:])  # scale factor
                 if sf != 1:
@@ -410,7 +454,7 @@ def train(hyp, opt, device, callbacks):
 
             # Forward
             with torch.cuda.amp.autocast(amp):
-                pred = model(imgs)  # forward
+                pred = compiled(imgs)  # forward
                 loss, loss_items = compute_loss(pred, targets.to(device))  # loss scaled by batch_size
                 if RANK != -1:
                     loss *= WORLD_SIZE  # gradient averaged between devices in DDP mode
@@ -451,30 +495,50 @@ def train(hyp, opt, device, callbacks):
         if RANK in {-1, 0}:
             # mAP
             callbacks.run("on_train_epoch_end", epoch=epoch)
+            ema.flush(model)
             ema.update_attr(model, include=["yaml", "nc", "hyp", "names", "stride", "class_weights"])
             final_epoch = (epoch + 1 == epochs) or stopper.possible_stop
-            if not noval or final_epoch:  # Calculate mAP
-                results, maps, _ = validate.run(
-                    data_dict,
-                    batch_size=batch_size // WORLD_SIZE * 2,
-                    imgsz=imgsz,
-                    half=amp,
-                    model=ema.ema,
-                    single_cls=single_cls,
-                    dataloader=val_loader,
-                    save_dir=save_dir,
-                    plots=False,
-                    callbacks=callbacks,
-                    compute_loss=compute_loss,
-                )
+            # (epoch, train loss, lr, full, results, maps) to update best mAP with, i.e. the previous epoch if validated in
+            # the background during this one
+            evaluated = [(e, *train_logs.pop(e), r, m) for e, r, m in validator.collect()] if validator else []
+            full = final_epoch or opt.val_subset >= 1 or (opt.val_period > 0 and (epoch + 1) % opt.val_period == 0)
+            if not noval or final_epoch or epoch in rungs:  # Calculate mAP
+                if validator and not final_epoch:  # results are available next epoch
+                    validator.submit(epoch, cpu_snapshot(deepcopy(ema.ema)), full)
+                    train_logs[epoch] = list(mloss), lr, full
+                else:
+                    results, maps, _ = validate.run(
+                        data_dict,
+                        batch_size=batch_size // WORLD_SIZE * 2,
+                        imgsz=imgsz,
+                        half=amp,
+                        model=ema.ema,
+                        single_cls=single_cls,
+                        dataloader=val_loader if full else val_subset_loader,
+                        save_dir=save_dir,
+                        plots=False,
+                        callbacks=callbacks,
+                        compute_loss=compute_loss,
+                    )
+            if not validator or final_epoch:
+                evaluated.append((epoch, list(mloss), lr, full, results, maps))
 
             # Update best mAP
-            fi = fitness(np.array(results).reshape(1, -1))  # weighted combination of [P, R, mAP@.5, mAP@.5-.95]
-            stop = stopper(epoch=epoch, fitness=fi)  # early stop check
-            if fi > best_fitness:
-                best_fitness = fi
-            log_vals = list(mloss) + list(results) + lr
-            callbacks.run("on_fit_epoch_end", log_vals, epoch, best_fitness, fi)
+            best_before = best_epoch
+            for e, train_loss, train_lr, full, results, maps in evaluated:
+                fi = fitness(np.array(results).reshape(1, -1))  # weighted combination of [P, R, mAP@.5, mAP@.5-.95]
+                if full:  # --val-subset fitness is not comparable, only full val set results select best.pt and stop
+                    stop = stopper(epoch=e, fitness=fi)  # early stop check
+                    if fi > best_fitness:
+                        best_fitness = fi
+                    if best_fitness == fi:
+                        best_epoch = e
+                log_vals = train_loss + list(results) + train_lr
+                callbacks.run("on_fit_epoch_end", log_vals, e, best_fitness, fi)
+                if e != epoch:
+                    p, r, map50, map = results[:4]
+                    LOGGER.info(f"Epoch {e} validation: P {p:.3g}, R {r:.3g}, mAP50 {map50:.3g}, mAP50-95 {map:.3g}")
+            stop |= callbacks.stop_training  # i.e. stopped by --evolve-halving
 
             # Save model
             if (not nosave) or (final_epoch and not evolve):  # if save
@@ -490,14 +554,21 @@ def train(hyp, opt, device, callbacks):
                     "date": datetime.now().isoformat(),
                 }
 
-                # Save last, best and delete
-                torch.save(ckpt, last)
-                if best_fitness == fi:
-                    torch.save(ckpt, best)
+                # Save last, best and periodic copies of one snapshot in the background
+                files = [last]
+                if best_epoch == epoch:
+                    files.append(best)
                 if opt.save_period > 0 and epoch % opt.save_period == 0:
-                    torch.save(ckpt, w / f"epoch{epoch}.pt")
+                    files.append(w / f"epoch{epoch}.pt")
+                # a new best from background validation is the previous epoch, still held by last.pt
+                promote = [(last, best)] if best_before != best_epoch < epoch else []
+                saver.save(
+                    ckpt,
+                    files,
+                    partial(callbacks.run, "on_model_save", last, epoch, final_epoch, best_fitness, fi),
+                    copies=promote,
+                )
                 del ckpt
-                callbacks.run("on_model_save", last, epoch, final_epoch, best_fitness, fi)
 
         # EarlyStopping
         if RANK != -1:  # if DDP training
@@ -511,6 +582,9 @@ def train(hyp, opt, device, callbacks):
         # end epoch ----------------------------------------------------------------------------------------------------
     # end training -----------------------------------------------------------------------------------------------------
     if RANK in {-1, 0}:
+        if validator:
+            validator.close()
+        saver.wait()
         LOGGER.info(f"\n{epoch - start_epoch + 1} epochs completed in {(time.time() - t0) / 3600:.3f} hours.")
         for f in last, best:
             if f.exists():
@@ -569,12 +643,18 @@ def parse_opt(known=False):
     parser.add_argument("--data", type=str, default=ROOT / "data/coco128.yaml", help="dataset.yaml path")
     parser.add_argument("--hyp", type=str, default=ROOT / "data/hyps/hyp.scratch-low.yaml", help="hyperparameters path")
     parser.add_argument("--epochs", type=int, default=100, help="total training epochs")
-    parser.add_argument("--batch-size", type=int, default=16, help="total batch size for all GPUs, -1 for autobatch")
+    parser.add_argument(
+        "--batch-size", "--batch", type=int, default=16, help="total batch size for all GPUs, -1 for autobatch"
+    )
+    parser.add_argument("--autobatch", choices=["memory", "throughput"], help="--batch-size -1 mode, CPU: throughput")
     parser.add_argument("--imgsz", "--img", "--img-size", type=int, default=640, help="train, val image size (pixels)")
     parser.add_argument("--rect", action="store_true", help="rectangular training")
     parser.add_argument("--resume", nargs="?", const=True, default=False, help="resume most recent training")
     parser.add_argument("--nosave", action="store_true", help="only save final checkpoint")
     parser.add_argument("--noval", action="store_true", help="only validate final epoch")
+    parser.add_argument("--val-async", action="store_true", help="validate in a background process, one epoch behind")
+    parser.add_argument("--val-subset", type=float, default=1.0, help="fraction of val set to validate per epoch")
+    parser.add_argument("--val-period", type=int, default=0, help="full val set every x epochs with --val-subset")
     parser.add_argument("--noautoanchor", action="store_true", help="disable AutoAnchor")
     parser.add_argument("--noplots", action="store_true", help="save no plot files")
     parser.add_argument("--evolve", type=int, nargs="?", const=300, help="evolve hyperparameters for x generations")
@@ -582,14 +662,22 @@ def parse_opt(known=False):
         "--evolve_population", type=str, default=ROOT / "data/hyps", help="location for loading population"
     )
     parser.add_argument("--resume_evolve", type=str, default=None, help="resume evolve from last generation")
+    parser.add_argument("--evolve-workers", type=int, default=1, help="--evolve candidates trained in parallel")
+    parser.add_argument("--evolve-halving", type=int, default=0, help="--evolve successive halving rungs, 0 to disable")
     parser.add_argument("--bucket", type=str, default="", help="gsutil bucket")
     parser.add_argument("--cache", type=str, nargs="?", const="ram", help="image --cache ram/disk")
     parser.add_argument("--image-weights", action="store_true", help="use weighted image selection for training")
+    parser.add_argument("--shards", action="store_true", help="stream training images from packed tar shards")
+    parser.add_argument("--batch-augment", action="store_true", help="augment whole batches on the training device")
     parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
     parser.add_argument("--multi-scale", action="store_true", help="vary img-size +/- 50%%")
+    parser.add_argument("--multi-scale-sizes", type=int, default=0, help="--multi-scale from N fixed sizes, 0 for any")
+    parser.add_argument("--multi-scale-warmup", action="store_true", help="pre-warm multi-scale sizes")
     parser.add_argument("--single-cls", action="store_true", help="train multi-class data as single-class")
+    parser.add_argument("--ema-every", type=int, default=1, help="update EMA every N optimizer steps")
     parser.add_argument("--optimizer", type=str, choices=["SGD", "Adam", "AdamW"], default="SGD", help="optimizer")
     parser.add_argument("--sync-bn", action="store_true", help="use SyncBatchNorm, only available in DDP mode")
+    parser.add_argument("--compile", action="store_true", help="torch.compile() the training forward pass")
     parser.add_argument("--workers", type=int, default=8, help="max dataloader workers (per RANK in DDP mode)")
     parser.add_argument("--project", default=ROOT / "runs/train", help="save to project/name")
     parser.add_argument("--name", default="exp", help="save to project/name")
@@ -796,6 +884,23 @@ def main(opt, callbacks=Callbacks()):
             for initial_value in initial_values:
                 population = [initial_value] + population
 
+        # Parallel candidates, one process per --device GPU or splitting CPU threads
+        pool = None
+        if opt.evolve_workers > 1:
+            evolve_warm_caches(opt, hyp)
+            ctx = mp.get_context("spawn")
+            manager = ctx.Manager()
+            gpus = [d.strip() for d in opt.device.split(",") if d.strip()]
+            gpus = gpus or [str(i) for i in range(torch.cuda.device_count())]  # default all CUDA devices, else CPU
+            devices = manager.Queue()
+            for i in range(opt.evolve_workers):
+                devices.put(gpus[i % len(gpus)] if gpus else "cpu")
+            threads = max(os.cpu_count() // opt.evolve_workers, 1)
+            pool = ProcessPoolExecutor(opt.evolve_workers, ctx, evolve_process_init, (devices, threads))
+        evolve_results = []  # all evolve.csv rows, read once
+        if evolve_csv.exists():
+            evolve_results = np.loadtxt(evolve_csv, ndmin=2, delimiter=",", skiprows=1).tolist()
+
         # Run the genetic algorithm for a fixed number of generations
         list_keys = list(hyp_GA.keys())
         for generation in range(opt.evolve):
@@ -811,13 +916,24 @@ def main(opt, callbacks=Callbacks()):
             # Adaptive elite size
             elite_size = min_elite_size + int((max_elite_size - min_elite_size) * (generation / opt.evolve))
             # Evaluate the fitness of each individual in the population
-            fitness_scores = []
+            hyps = []
             for individual in population:
                 for key, value in zip(hyp_GA.keys(), individual):
                     hyp_GA[key] = value
                 hyp.update(hyp_GA)
-                results = train(hyp.copy(), opt, device, callbacks)
-                callbacks = Callbacks()
+                hyps.append(hyp.copy())
+            rungs = None  # {epoch: [fitness]} of --evolve-halving rungs in this generation
+            if opt.evolve_halving:
+                rungs = {e: (manager.list() if pool else []) for e in halving_epochs(opt.epochs, opt.evolve_halving)}
+                rungs = manager.dict(rungs) if pool else rungs
+            if pool:  # candidates in parallel processes, results in population order
+                candidates = pool.map(partial(evolve_candidate, opt=opt, rungs=rungs), hyps)
+            else:
+                candidates = (
+                    evolve_candidate(h, opt, device, callbacks if i == 0 else None, rungs) for i, h in enumerate(hyps)
+                )
+            fitness_scores = []
+            for h, results in zip(hyps, candidates):
                 # Write mutation results
                 keys = (
                     "metrics/precision",
@@ -828,8 +944,9 @@ def main(opt, callbacks=Callbacks()):
                     "val/obj_loss",
                     "val/cls_loss",
                 )
-                print_mutation(keys, results, hyp.copy(), save_dir, opt.bucket)
+                print_mutation(keys, results, h, save_dir, opt.bucket, data=evolve_results)
                 fitness_scores.append(results[2])
+            callbacks = Callbacks()
 
             # Select the fittest individuals for reproduction using adaptive tournament selection
             selected_indices = []
@@ -873,6 +990,9 @@ def main(opt, callbacks=Callbacks()):
                 next_generation.append(child)
             # Replace the old population with the new generation
             population = next_generation
+        if pool:
+            pool.shutdown()
+            manager.shutdown()
         # Print the best solution found
         best_index = fitness_scores.index(max(fitness_scores))
         best_individual = population[best_index]
@@ -886,6 +1006,73 @@ def main(opt, callbacks=Callbacks()):
         )
 
 
+def halving_epochs(epochs, n):
+    """Returns the 0-indexed epochs after 1/2, 1/4, ... 1/2**n of `epochs` at which --evolve-halving compares candidates."""
+    return sorted({epochs // 2**k - 1 for k in range(1, n + 1) if epochs // 2**k})
+
+
+def evolve_candidate(hyp, opt, device=None, callbacks=None, rungs=None):
+    """
+    Trains one --evolve candidate with `hyp` and returns its results, on the device of its parallel --evolve process if
+    `device` is None.
+
+    `rungs` is a {epoch: [fitness]} store shared by the candidates of a generation. At each rung epoch the candidate
+    records its fitness and stops training if it is below the median of all candidates that reached the rung so far,
+    successive halving with results of the rung epoch.
+    """
+    device = device or torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    callbacks = callbacks or Callbacks()
+    if rungs is not None:
+
+        def halving(log_vals, epoch, best_fitness, fi):
+            """Stops training when fitness `fi` at a rung epoch is in the bottom half of the rung."""
+            if epoch in rungs:
+                fi = fi.item()
+                scores = list(rungs[epoch])
+                rungs[epoch].append(fi)
+                if len(scores) >= 2 and fi < np.median(scores + [fi]):
+                    LOGGER.info(f"{colorstr('evolve: ')}stopping candidate at epoch {epoch}, fitness {fi:.4f} < median")
+                    callbacks.stop_training = True
+
+        callbacks.register_action("on_fit_epoch_end", name="halving", callback=halving)
+    return train(hyp, opt, device, callbacks)
+
+
+def evolve_process_init(devices, threads):
+    """Pins a parallel --evolve process to the next device of `devices` queue and to `threads` CPU threads."""
+    select_device(devices.get())  # sets CUDA_VISIBLE_DEVICES before any CUDA use, so candidates never use DP
+    torch.set_num_threads(threads)
+
+
+def evolve_warm_caches(opt, hyp):
+    """Builds the dataset label caches, and the shared RAM or disk image caches with --cache, once so that parallel
+    --evolve candidates attach to them instead of racing to build their own.
+    """
+    data_dict = check_dataset(opt.data)
+    weights = opt.weights
+    if weights.endswith(".pt"):
+        model = attempt_load(attempt_download(weights), "cpu", fuse=False)
+    else:
+        model = Model(opt.cfg, nc=1)
+    gs = max(int(model.stride.max()), 32)  # same imgsz and dataset arguments as train()
+    imgsz, batch_size = check_img_size(opt.imgsz, gs, floor=gs * 2), max(opt.batch_size, 1)
+    cache = None if opt.cache == "val" else opt.cache
+    args = dict(stride=gs, single_cls=opt.single_cls, hyp=hyp, workers=0)
+    create_dataloader(
+        data_dict["train"],
+        imgsz,
+        batch_size,
+        augment=True,
+        cache=cache,
+        rect=opt.rect,
+        image_weights=opt.image_weights,
+        prefix=colorstr("train: "),
+        shards=opt.shards,
+        **args,
+    )
+    create_dataloader(data_dict["val"], imgsz, batch_size * 2, rect=True, pad=0.5, prefix=colorstr("val: "), **args)
+
+
 def generate_individual(input_ranges, individual_length):
     """
     Generate an individual with random hyperparameters within specified ranges.
@@ -928,25 +1115,49 @@ def run(**kwargs):
         hyp (str, optional): Path to hyperparameters YAML configuration. Defaults to ROOT / 'data/hyps/hyp.scratch-low.yaml'.
         epochs (int, optional): Total number of training epochs. Defaults to 100.
         batch_size (int, optional): Total batch size for all GPUs. Use -1 for automatic batch size determination. Defaults to 16.
+        autobatch (str, optional): Automatic batch size mode, 'memory' to fill a fraction of CUDA memory or 'throughput' to
+            maximize measured images/s within a memory budget, cached per model, image size and device. Defaults to
+            'memory' on CUDA and 'throughput' on CPU.
         imgsz (int, optional): Image size (pixels) for training and validation. Defaults to 640.
         rect (bool, optional): Use rectangular training. Defaults to False.
         resume (bool | str, optional): Resume most recent training with an optional path. Defaults to False.
         nosave (bool, optional): Only save the final checkpoint. Defaults to False.
         noval (bool, optional): Only validate at the final epoch. Defaults to False.
+        val_async (bool, optional): Validate in a background process while training continues; results update best.pt
+            and EarlyStopping one epoch later. Defaults to False.
+        val_subset (float, optional): Fraction of the val set, a fixed random subset, to validate per epoch. Subset
+            results are logged only; best.pt and EarlyStopping are updated from full val set results alone, see
+            `val_period`. Defaults to 1.0.
+        val_period (int, optional): Validate the full val set every x epochs when `val_subset` < 1, the final epoch
+            always. Defaults to 0.
         noautoanchor (bool, optional): Disable AutoAnchor. Defaults to False.
         noplots (bool, optional): Do not save plot files. Defaults to False.
         evolve (int, optional): Evolve hyperparameters for a specified number of generations. Use 300 if provided without a
             value.
         evolve_population (str, optional): Directory for loading population during evolution. Defaults to ROOT / 'data/ hyps'.
         resume_evolve (str, optional): Resume hyperparameter evolution from the last generation. Defaults to None.
+        evolve_workers (int, optional): Number of --evolve candidates trained in parallel processes, one per `device`
+            GPU or sharing the CPU threads. Defaults to 1.
+        evolve_halving (int, optional): Number of successive halving rungs at 1/2, 1/4, ... of `epochs` where --evolve
+            candidates below the median fitness stop early. Defaults to 0.
         bucket (str, optional): gsutil bucket for saving checkpoints. Defaults to an empty string.
         cache (str, optional): Cache image data in 'ram' or 'disk'. Defaults to None.
         image_weights (bool, optional): Use weighted image selection for training. Defaults to False.
+        shards (bool, optional): Stream training images from packed tar shards, packed on first use. Defaults to False.
+        batch_augment (bool, optional): Apply HSV, flip, mixup and non-mosaic perspective augmentation to whole batches
+            on the training device instead of in DataLoader workers. Defaults to False.
         device (str, optional): CUDA device identifier, e.g., '0', '0,1,2,3', or 'cpu'. Defaults to an empty string.
         multi_scale (bool, optional): Use multi-scale training, varying image size by ±50%. Defaults to False.
+        multi_scale_sizes (int, optional): Draw multi-scale sizes from N fixed sizes, resizing batches in DataLoader
+            workers instead of on the training device. 0 draws any stride multiple. Defaults to 0.
+        multi_scale_warmup (bool, optional): Run a training pass at each multi-scale size before training. Defaults to
+            False.
         single_cls (bool, optional): Train with multi-class data as single-class. Defaults to False.
+        ema_every (int, optional): Update the EMA every N optimizer steps with their combined decay. Defaults to 1.
         optimizer (str, optional): Optimizer type, choices are ['SGD', 'Adam', 'AdamW']. Defaults to 'SGD'.
         sync_bn (bool, optional): Use synchronized BatchNorm, only available in DDP mode. Defaults to False.
+        compile (bool, optional): Compile the training forward pass with torch.compile(), validation runs eagerly.
+            Defaults to False.
         workers (int, optional): Maximum dataloader workers per rank in DDP mode. Defaults to 8.
         project (str, optional): Directory for saving training runs. Defaults to ROOT / 'runs/train'.
         name (str, optional): Name for saving the training run. Defaults to 'exp'.
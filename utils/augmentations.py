@@ -7,10 +7,11 @@ import random
 import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
 import torchvision.transforms as T
 import torchvision.transforms.functional as TF
 
-from utils.general import LOGGER, check_version, colorstr, resample_segments, segment2box, xywhn2xyxy
+from utils.general import LOGGER, check_version, colorstr, resample_segments, xywhn2xyxy, xyxy2xywhn
 from utils.metrics import bbox_ioa
 
 IMAGENET_MEAN = 0.485, 0.456, 0.406  # RGB mean
@@ -158,13 +159,33 @@ def random_perspective(
     # torchvision.transforms.RandomAffine(degrees=(-10, 10), translate=(0.1, 0.1), scale=(0.9, 1.1), shear=(-10, 10))
     # targets = [cls, xyxy]
     """Applies random perspective transformation to an image, modifying the image and corresponding labels."""
-    height = im.shape[0] + border[0] * 2  # shape(h,w,c)
-    width = im.shape[1] + border[1] * 2
+    M, s, (height, width) = random_perspective_matrix(
+        im.shape[:2], degrees, translate, scale, shear, perspective, border
+    )
+    if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
+        if perspective:
+            im = cv2.warpPerspective(im, M, dsize=(width, height), borderValue=(114, 114, 114))
+        else:  # affine
+            im = cv2.warpAffine(im, M[:2], dsize=(width, height), borderValue=(114, 114, 114))
+
+    # Visualize
+    # import matplotlib.pyplot as plt
+    # ax = plt.subplots(1, 2, figsize=(12, 6))[1].ravel()
+    # ax[0].imshow(im[:, :, ::-1])  # base
+    # ax[1].imshow(im2[:, :, ::-1])  # warped
+
+    return im, warp_labels(targets, segments, M, s, (height, width), perspective)
+
+
+def random_perspective_matrix(shape, degrees=10, translate=0.1, scale=0.1, shear=10, perspective=0.0, border=(0, 0)):
+    """Samples the random_perspective() transform for an image of `shape` (h, w), returning (M, scale, output hw)."""
+    height = shape[0] + border[0] * 2  # shape(h,w,c)
+    width = shape[1] + border[1] * 2
 
     # Center
     C = np.eye(3)
-    C[0, 2] = -im.shape[1] / 2  # x translation (pixels)
-    C[1, 2] = -im.shape[0] / 2  # y translation (pixels)
+    C[0, 2] = -shape[1] / 2  # x translation (pixels)
+    C[1, 2] = -shape[0] / 2  # y translation (pixels)
 
     # Perspective
     P = np.eye(3)
@@ -191,55 +212,58 @@ def random_perspective(
 
     # Combined rotation matrix
     M = T @ S @ R @ P @ C  # order of operations (right to left) is IMPORTANT
-    if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
-        if perspective:
-            im = cv2.warpPerspective(im, M, dsize=(width, height), borderValue=(114, 114, 114))
-        else:  # affine
-            im = cv2.warpAffine(im, M[:2], dsize=(width, height), borderValue=(114, 114, 114))
+    return M, s, (height, width)
 
-    # Visualize
-    # import matplotlib.pyplot as plt
-    # ax = plt.subplots(1, 2, figsize=(12, 6))[1].ravel()
-    # ax[0].imshow(im[:, :, ::-1])  # base
-    # ax[1].imshow(im2[:, :, ::-1])  # warped
 
-    # Transform label coordinates
+def warp_labels(targets, segments, M, s, shape, perspective=0.0):
+    """Transforms [cls, xyxy] `targets` (or their `segments`) by `M` into an image of `shape` (h, w), dropping boxes
+    that become too small, where `s` is the scale component of `M`.
+    """
     n = len(targets)
-    if n:
-        use_segments = any(x.any() for x in segments) and len(segments) == n
-        new = np.zeros((n, 4))
-        if use_segments:  # warp segments
-            segments = resample_segments(segments)  # upsample
-            for i, segment in enumerate(segments):
-                xy = np.ones((len(segment), 3))
-                xy[:, :2] = segment
-                xy = xy @ M.T  # transform
-                xy = xy[:, :2] / xy[:, 2:3] if perspective else xy[:, :2]  # perspective rescale or affine
-
-                # clip
-                new[i] = segment2box(xy, width, height)
-
-        else:  # warp boxes
-            xy = np.ones((n * 4, 3))
-            xy[:, :2] = targets[:, [1, 2, 3, 4, 1, 4, 3, 2]].reshape(n * 4, 2)  # x1y1, x2y2, x1y2, x2y1
-            xy = xy @ M.T  # transform
-            xy = (xy[:, :2] / xy[:, 2:3] if perspective else xy[:, :2]).reshape(n, 8)  # perspective rescale or affine
-
-            # create new boxes
-            x = xy[:, [0, 2, 4, 6]]
-            y = xy[:, [1, 3, 5, 7]]
-            new = np.concatenate((x.min(1), y.min(1), x.max(1), y.max(1))).reshape(4, n).T
-
-            # clip
-            new[:, [0, 2]] = new[:, [0, 2]].clip(0, width)
-            new[:, [1, 3]] = new[:, [1, 3]].clip(0, height)
-
-        # filter candidates
-        i = box_candidates(box1=targets[:, 1:5].T * s, box2=new.T, area_thr=0.01 if use_segments else 0.10)
-        targets = targets[i]
-        targets[:, 1:5] = new[i]
-
-    return im, targets
+    if not n:
+        return targets
+    height, width = shape
+    use_segments = any(x.any() for x in segments) and len(segments) == n
+    if use_segments:  # warp segments
+        xy = np.ones((n, 1000, 3))
+        xy[..., :2] = np.stack(resample_segments(list(segments), n=1000))  # upsample
+        xy = xy @ M.T  # transform
+        xy = xy[..., :2] / xy[..., 2:3] if perspective else xy[..., :2]  # perspective rescale or affine
+
+        # clip
+        x, y = xy[..., 0], xy[..., 1]
+        inside = (x >= 0) & (y >= 0) & (x <= width) & (y <= height)
+        new = np.stack(
+            (
+                np.where(inside, x, np.inf).min(1),
+                np.where(inside, y, np.inf).min(1),
+                np.where(inside, x, -np.inf).max(1),
+                np.where(inside, y, -np.inf).max(1),
+            ),
+            1,
+        )
+        new[~inside.any(1)] = 0  # segments outside image, see segment2box()
+
+    else:  # warp boxes
+        xy = np.ones((n * 4, 3))
+        xy[:, :2] = targets[:, [1, 2, 3, 4, 1, 4, 3, 2]].reshape(n * 4, 2)  # x1y1, x2y2, x1y2, x2y1
+        xy = xy @ M.T  # transform
+        xy = (xy[:, :2] / xy[:, 2:3] if perspective else xy[:, :2]).reshape(n, 8)  # perspective rescale or affine
+
+        # create new boxes
+        x = xy[:, [0, 2, 4, 6]]
+        y = xy[:, [1, 3, 5, 7]]
+        new = np.concatenate((x.min(1), y.min(1), x.max(1), y.max(1))).reshape(4, n).T
+
+        # clip
+        new[:, [0, 2]] = new[:, [0, 2]].clip(0, width)
+        new[:, [1, 3]] = new[:, [1, 3]].clip(0, height)
+
+    # filter candidates
+    i = box_candidates(box1=targets[:, 1:5].T * s, box2=new.T, area_thr=0.01 if use_segments else 0.10)
+    targets = targets[i]
+    targets[:, 1:5] = new[i]
+    return targets
 
 
 def copy_paste(im, labels, segments, p=0.5):
@@ -320,10 +344,141 @@ def box_candidates(box1, box2, wh_thr=2, ar_thr=100, area_thr=0.1, eps=1e-16):
     """
     w1, h1 = box1[2] - box1[0], box1[3] - box1[1]
     w2, h2 = box2[2] - box2[0], box2[3] - box2[1]
-    ar = np.maximum(w2 / (h2 + eps), h2 / (w2 + eps))  # aspect ratio
+    maximum = torch.maximum if isinstance(w2, torch.Tensor) else np.maximum
+    ar = maximum(w2 / (h2 + eps), h2 / (w2 + eps))  # aspect ratio
     return (w2 > wh_thr) & (h2 > wh_thr) & (w2 * h2 / (w1 * h1 + eps) > area_thr) & (ar < ar_thr)  # candidates
 
 
+class BatchAugmentations:
+    """
+    Applies random_perspective(), augment_hsv(), flips and mixup() to collated training batches on the training device.
+
+    Used with create_dataloader(batch_augment=True), where DataLoader workers only decode, build mosaics (including
+    their perspective warp) and run Albumentations. Every transform samples its parameters per image, as in
+    LoadImagesAndLabels.__getitem__(), and is applied to the whole batch as single tensor ops. Mixup blends mosaics
+    with another image of the same batch instead of loading an extra mosaic.
+    """
+
+    def __init__(self, hyp):
+        """Initializes batch augmentation with hyperparameters `hyp` (degrees, translate, scale, shear, perspective,
+        hsv_h, hsv_s, hsv_v, flipud, fliplr, mixup).
+        """
+        self.hyp = hyp
+
+    def __call__(self, imgs, targets, warp=None):
+        """
+        Augments float RGB `imgs` (b, 3, h, w) in 0-1 and their [image, cls, xywhn] `targets`, returning both.
+
+        `warp` is a per-image bool sequence selecting images for the random perspective and excluding them from mixup
+        (images not yet warped by a mosaic, i.e. shapes is not None), default all.
+        """
+        b = imgs.shape[0]
+        warp = torch.ones(b, dtype=torch.bool) if warp is None else torch.as_tensor(warp, dtype=torch.bool)
+        warp, targets = warp.to(imgs.device), targets.to(imgs.device)
+        if warp.any():
+            imgs, targets = self.perspective(imgs, targets, warp)
+        imgs = self.hsv(imgs)
+        imgs, targets = self.flip(imgs, targets)
+        return self.mixup(imgs, targets, ~warp)
+
+    def perspective(self, imgs, targets, warp):
+        """Warps images selected by `warp` with random_perspective() transforms via one grid_sample() call."""
+        hyp, (b, _, h, w), device = self.hyp, imgs.shape, imgs.device
+        n = int(warp.sum())
+        u = lambda lo, hi: torch.rand(n, device=device, dtype=torch.float64) * (hi - lo) + lo  # noqa: E731
+        M = torch.eye(3, device=device, dtype=torch.float64).repeat(n, 1, 1)
+        C, P, R, S, T = (M.clone() for _ in range(5))  # center, perspective, rotation and scale, shear, translation
+        C[:, 0, 2], C[:, 1, 2] = -w / 2, -h / 2
+        P[:, 2, 0], P[:, 2, 1] = u(-hyp["perspective"], hyp["perspective"]), u(-hyp["perspective"], hyp["perspective"])
+        a, s = u(-hyp["degrees"], hyp["degrees"]) * math.pi / 180, u(1 - hyp["scale"], 1 + hyp["scale"])
+        R[:, 0, 0], R[:, 0, 1], R[:, 1, 0], R[:, 1, 1] = s * a.cos(), s * a.sin(), -s * a.sin(), s * a.cos()
+        S[:, 0, 1] = (u(-hyp["shear"], hyp["shear"]) * math.pi / 180).tan()  # x shear (deg)
+        S[:, 1, 0] = (u(-hyp["shear"], hyp["shear"]) * math.pi / 180).tan()  # y shear (deg)
+        T[:, 0, 2] = u(0.5 - hyp["translate"], 0.5 + hyp["translate"]) * w  # x translation (pixels)
+        T[:, 1, 2] = u(0.5 - hyp["translate"], 0.5 + hyp["translate"]) * h  # y translation (pixels)
+        M = T @ S @ R @ P @ C  # order of operations (right to left) is IMPORTANT
+
+        # Images, sampling source pixels for each output pixel through M^-1
+        y, x = torch.meshgrid(torch.arange(h, device=device), torch.arange(w, device=device), indexing="ij")
+        xy = torch.stack((x, y, torch.ones_like(x)), -1).view(1, -1, 3).float() @ M.inverse().transpose(1, 2).float()
+        xy = xy[..., :2] / xy[..., 2:]  # perspective rescale
+        grid = ((xy * 2 + 1) / xy.new_tensor([w, h]) - 1).view(n, h, w, 2).to(imgs.dtype)  # normalized -1 to 1
+        g = 114 / 255  # border value
+        imgs = imgs.clone()
+        imgs[warp] = F.grid_sample(imgs[warp] - g, grid, mode="bilinear", align_corners=False) + g
+
+        # Labels, warping box corners as in random_perspective()
+        j = torch.full((b,), -1, device=device, dtype=torch.long)
+        j[warp] = torch.arange(n, device=device)
+        k = j[targets[:, 0].long()]  # warp index per target, -1 if not warped
+        t = targets[k >= 0]
+        if len(t):
+            box = xywhn2xyxy(t[:, 2:6].double(), w, h)
+            xy = torch.ones(len(t), 4, 3, device=device, dtype=torch.float64)
+            xy[..., :2] = box[:, [0, 1, 2, 3, 0, 3, 2, 1]].view(-1, 4, 2)  # x1y1, x2y2, x1y2, x2y1
+            xy = xy @ M[k[k >= 0]].transpose(1, 2)  # transform
+            xy = xy[..., :2] / xy[..., 2:]  # perspective rescale or affine
+            new = torch.cat((xy.min(1)[0], xy.max(1)[0]), 1)  # xyxy
+            new[:, [0, 2]] = new[:, [0, 2]].clamp(0, w)
+            new[:, [1, 3]] = new[:, [1, 3]].clamp(0, h)
+            i = box_candidates(box1=box.T * s[k[k >= 0]], box2=new.T)  # filter candidates
+            t = t[i]
+            t[:, 2:6] = xyxy2xywhn(new[i], w, h, clip=True, eps=1e-3).to(t.dtype)
+        return imgs, torch.cat((targets[k < 0], t), 0)
+
+    def hsv(self, imgs):
+        """Scales hue, saturation and value of each image by random gains as in augment_hsv()."""
+        hyp, b, device = self.hyp, imgs.shape[0], imgs.device
+        gains = imgs.new_tensor([hyp["hsv_h"], hyp["hsv_s"], hyp["hsv_v"]])
+        if not gains.any():
+            return imgs
+        r = ((torch.rand(b, 3, device=device) * 2 - 1) * gains + 1).view(b, 3, 1, 1)  # random gains
+
+        # RGB to HSV
+        maxc, minc = imgs.max(1)[0], imgs.min(1)[0]
+        delta = maxc - minc
+        rc, gc, bc = ((maxc.unsqueeze(1) - imgs) / delta.clamp(min=1e-8).unsqueeze(1)).unbind(1)
+        red, green = imgs[:, 0] == maxc, imgs[:, 1] == maxc
+        hue = torch.where(red, bc - gc, torch.where(green, 2 + rc - bc, 4 + gc - rc)) / 6 % 1
+        hue = (hue * r[:, 0]) % 1
+        sat = (delta / maxc.clamp(min=1e-8) * r[:, 1]).clamp(0, 1)
+        val = (maxc * r[:, 2]).clamp(0, 1)
+
+        # HSV to RGB
+        i = (hue * 6).floor()
+        f = hue * 6 - i
+        p, q, t = val * (1 - sat), val * (1 - sat * f), val * (1 - sat * (1 - f))
+        i = i.long().unsqueeze(1) % 6
+        rgb = (val, q, p, p, t, val), (t, val, val, q, p, p), (p, p, t, val, val, q)  # per hue sector
+        return torch.cat([torch.stack(x, 1).gather(1, i) for x in rgb], 1)
+
+    def flip(self, imgs, targets):
+        """Flips images up-down and left-right with probabilities flipud and fliplr."""
+        b, device = imgs.shape[0], imgs.device
+        for p, dim, col in (self.hyp["flipud"], 2, 3), (self.hyp["fliplr"], 3, 2):  # probability, image dim, label col
+            if p:
+                f = torch.rand(b, device=device) < p
+                imgs = torch.where(f.view(b, 1, 1, 1), imgs.flip(dim), imgs)
+                i = f[targets[:, 0].long()]
+                targets[i, col] = 1 - targets[i, col]
+        return imgs, targets
+
+    def mixup(self, imgs, targets, mask):
+        """Blends images selected by `mask` with mixup probability with a random partner image from the batch."""
+        b, device = imgs.shape[0], imgs.device
+        m = mask & (torch.rand(b, device=device) < self.hyp["mixup"])
+        if b < 2 or not m.any():  # no partner for a single image
+            return imgs, targets
+        partner = (torch.arange(b, device=device) + torch.randint(1, b, (b,), device=device)) % b  # never itself
+        r = torch.distributions.Beta(32.0, 32.0).sample((b,)).to(device).view(b, 1, 1, 1)  # mixup ratio
+        imgs = torch.where(m.view(b, 1, 1, 1), imgs * r + imgs[partner] * (1 - r), imgs)
+        i = m.nonzero()[:, 0]  # mixed images
+        a, t = (partner[i, None] == targets[None, :, 0].long()).nonzero().T  # (mixed image, partner target) pairs
+        extra = targets[t].clone()
+        extra[:, 0] = i[a].to(targets.dtype)
+        return imgs, torch.cat((targets, extra), 0)
+
+
 def classify_albumentations(
     augment=True,
     size=224,
@@ -28,9 +28,8 @@ def check_anchor_order(m):
 def check_anchors(dataset, model, thr=4.0, imgsz=640):
     """Evaluates anchor fit to dataset and adjusts if necessary, supporting customizable threshold and image size."""
     m = model.module.model[-1] if hasattr(model, "module") else model.model[-1]  # Detect()
-    shapes = imgsz * dataset.shapes / dataset.shapes.max(1, keepdims=True)
-    scale = np.random.uniform(0.9, 1.1, size=(shapes.shape[0], 1))  # augment scale
-    wh = torch.tensor(np.concatenate([l[:, 3:5] * s for s, l in zip(shapes * scale, dataset.labels)])).float()  # wh
+    scale = np.random.uniform(0.9, 1.1, size=(dataset.shapes.shape[0], 1))  # augment scale
+    wh = torch.tensor(label_wh(dataset.labels, dataset.shapes, imgsz, scale)).float()  # wh
 
     def metric(k):  # compute metric
         """Computes ratio metric, anchors above threshold, and best possible recall for YOLOv5 anchor evaluation."""
@@ -50,7 +49,7 @@ def check_anchors(dataset, model, thr=4.0, imgsz=640):
     else:
         LOGGER.info(f"{s}Anchors are a poor fit to dataset ⚠️, attempting to improve...")
         na = m.anchors.numel() // 2  # number of anchors
-        anchors = kmean_anchors(dataset, n=na, img_size=imgsz, thr=thr, gen=1000, verbose=False)
+        anchors = kmean_anchors(dataset, n=na, img_size=imgsz, thr=thr, gen=100, pop=10, verbose=False)
         new_bpr = metric(anchors)[0]
         if new_bpr > bpr:  # replace anchors
             anchors = torch.tensor(anchors, device=m.anchors.device).type_as(m.anchors)
@@ -63,7 +62,15 @@ def check_anchors(dataset, model, thr=4.0, imgsz=640):
         LOGGER.info(s)
 
 
-def kmean_anchors(dataset="./data/coco128.yaml", n=9, img_size=640, thr=4.0, gen=1000, verbose=True):
+def label_wh(labels, shapes, img_size=640, scale=1.0):
+    """Returns the (n, 2) pixel wh of all `labels` (RaggedArray of class, xywh rows) of images with wh `shapes` resized
+    to `img_size`, optionally scaled per image by `scale`.
+    """
+    shapes = img_size * shapes / shapes.max(1, keepdims=True) * scale
+    return labels.compact().data[:, 3:5] * np.repeat(shapes, labels.lengths(), 0)
+
+
+def kmean_anchors(dataset="./data/coco128.yaml", n=9, img_size=640, thr=4.0, gen=1000, verbose=True, pop=1, patience=0):
     """
     Creates kmeans-evolved anchors from training dataset.
 
@@ -74,6 +81,8 @@ def kmean_anchors(dataset="./data/coco128.yaml", n=9, img_size=640, thr=4.0, gen
         thr: anchor-label wh ratio threshold hyperparameter hyp['anchor_t'] used for training, default=4.0
         gen: generations to evolve anchors using genetic algorithm
         verbose: print all results
+        pop: mutated candidates evaluated together per generation
+        patience: stop after this many generations without improvement, 0 to run all generations
 
     Return:
         k: kmeans evolved anchors
@@ -94,9 +103,13 @@ def kmean_anchors(dataset="./data/coco128.yaml", n=9, img_size=640, thr=4.0, gen
         return x, x.max(1)[0]  # x, best_x
 
     def anchor_fitness(k):  # mutation fitness
-        """Evaluates fitness of YOLOv5 anchors by computing recall and ratio metrics for an anchor evolution process."""
-        _, best = metric(torch.tensor(k, dtype=torch.float32), wh)
-        return (best * (best > thr).float()).mean()  # fitness
+        """Evaluates fitness of YOLOv5 anchors (n, 2), or of a population of them (p, n, 2), in one batched op."""
+        k = torch.tensor(k, dtype=torch.float32).view(-1, n, 2).log()
+        f = torch.zeros(len(k))
+        for x in lwh.split(max(1, (1 << 20) // k.numel())):  # ~4MB per chunk
+            best = torch.exp(-(x[None, :, None] - k[:, None]).abs().amax(3).amin(2))  # best ratio metric min(r, 1/r)
+            f += (best * (best > thr)).sum(1)
+        return f / len(lwh)  # fitness
 
     def print_results(k, verbose=True):
         """Sorts and logs kmeans-evolved anchor metrics and best possible recall values for YOLOv5 anchor evaluation."""
@@ -119,11 +132,13 @@ def kmean_anchors(dataset="./data/coco128.yaml", n=9, img_size=640, thr=4.0, gen
             data_dict = yaml.safe_load(f)  # model dict
         from utils.dataloaders import LoadImagesAndLabels
 
-        dataset = LoadImagesAndLabels(data_dict["train"], augment=True, rect=True)
+        cache = LoadImagesAndLabels.read_label_cache(data_dict["train"])  # (labels, shapes), None if not cached yet
+        if cache is None:
+            dataset = LoadImagesAndLabels(data_dict["train"], augment=True, rect=True)
+    labels, shapes = cache if isinstance(dataset, str) else (dataset.labels, dataset.shapes)
 
     # Get label wh
-    shapes = img_size * dataset.shapes / dataset.shapes.max(1, keepdims=True)
-    wh0 = np.concatenate([l[:, 3:5] * s for s, l in zip(shapes, dataset.labels)])  # wh
+    wh0 = label_wh(labels, shapes, img_size)  # wh
 
     # Filter
     i = (wh0 < 3.0).any(1).sum()
@@ -133,16 +148,18 @@ def kmean_anchors(dataset="./data/coco128.yaml", n=9, img_size=640, thr=4.0, gen
     # wh = wh * (npr.rand(wh.shape[0], 1) * 0.9 + 0.1)  # multiply by random scale 0-1
 
     # Kmeans init
+    sub = wh[npr.choice(len(wh), 50000, replace=False)] if len(wh) > 50000 else wh  # subsample of large datasets
     try:
-        LOGGER.info(f"{PREFIX}Running kmeans for {n} anchors on {len(wh)} points...")
+        LOGGER.info(f"{PREFIX}Running kmeans for {n} anchors on {len(sub)} points...")
         assert n <= len(wh)  # apply overdetermined constraint
         s = wh.std(0)  # sigmas for whitening
-        k = kmeans(wh / s, n, iter=30)[0] * s  # points
+        k = kmeans(sub / s, n, iter=30)[0] * s  # points
         assert n == len(k)  # kmeans may return fewer points than requested if wh is insufficient or too similar
     except Exception:
         LOGGER.warning(f"{PREFIX}WARNING ⚠️ switching strategies from kmeans to random init")
         k = np.sort(npr.rand(n * 2)).reshape(n, 2) * img_size  # random init
-    wh, wh0 = (torch.tensor(x, dtype=torch.float32) for x in (wh, wh0))
+    wh0 = torch.tensor(wh0, dtype=torch.float32)
+    lwh = torch.tensor(sub, dtype=torch.float32).log()  # log wh to evolve on, min(r, 1/r) = exp(-|log wh - log k|)
     k = print_results(k, verbose=False)
 
     # Plot
@@ -158,18 +175,26 @@ def kmean_anchors(dataset="./data/coco128.yaml", n=9, img_size=640, thr=4.0, gen
     # fig.savefig('wh.png', dpi=200)
 
     # Evolve
-    f, sh, mp, s = anchor_fitness(k), k.shape, 0.9, 0.1  # fitness, generations, mutation prob, sigma
+    f, sh, mp, s = anchor_fitness(k)[0], (pop, *k.shape), 0.9, 0.1  # fitness, population, mutation prob, sigma
+    stale = 0  # generations without improvement
     pbar = tqdm(range(gen), bar_format=TQDM_BAR_FORMAT)  # progress bar
     for _ in pbar:
         v = np.ones(sh)
-        while (v == 1).all():  # mutate until a change occurs (prevent duplicates)
-            v = ((npr.random(sh) < mp) * random.random() * npr.randn(*sh) * s + 1).clip(0.3, 3.0)
-        kg = (k.copy() * v).clip(min=2.0)
+        while (v == 1).all((1, 2)).any():  # mutate until a change occurs (prevent duplicates)
+            i = (v == 1).all((1, 2))
+            r = np.array([random.random() for _ in range(pop)]).reshape(pop, 1, 1)  # mutation scale per candidate
+            v[i] = ((npr.random(sh) < mp) * r * npr.randn(*sh) * s + 1).clip(0.3, 3.0)[i]
+        kg = (k * v).clip(min=2.0)
         fg = anchor_fitness(kg)
-        if fg > f:
-            f, k = fg, kg.copy()
+        i = int(fg.argmax())
+        if fg[i] > f:
+            f, k, stale = fg[i], kg[i].copy(), 0
             pbar.desc = f"{PREFIX}Evolving anchors with Genetic Algorithm: fitness = {f:.4f}"
             if verbose:
                 print_results(k, verbose)
+        else:
+            stale += 1
+            if patience and stale >= patience:
+                break
 
     return print_results(k).astype(np.float32)
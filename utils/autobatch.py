@@ -1,18 +1,29 @@
 # Ultralytics YOLOv5 🚀, AGPL-3.0 license
 """Auto-batch utils."""
 
+import json
+import os
+import platform
+import threading
 from copy import deepcopy
 
 import numpy as np
+import psutil
 import torch
 
-from utils.general import LOGGER, colorstr
-from utils.torch_utils import profile
+from utils.general import CONFIG_DIR, LOGGER, colorstr, file_hash
+from utils.torch_utils import profile, time_sync
 
 
-def check_train_batch_size(model, imgsz=640, amp=True):
-    """Checks and computes optimal training batch size for YOLOv5 model, given image size and AMP setting."""
+def check_train_batch_size(model, imgsz=640, amp=True, mode=None):
+    """Checks and computes optimal training batch size for YOLOv5 model, given image size and AMP setting; `mode`
+    'memory' fills a fraction of CUDA memory, 'throughput' maximizes measured images/s (default on CPU).
+    """
+    device = next(model.parameters()).device
+    mode = mode or ("memory" if device.type == "cuda" else "throughput")
     with torch.cuda.amp.autocast(amp):
+        if mode == "throughput":
+            return autobatch_throughput(deepcopy(model).train(), imgsz, amp=amp)
         return autobatch(deepcopy(model).train(), imgsz)  # compute optimal batch size
 
 
@@ -68,3 +79,117 @@ def autobatch(model, imgsz=640, fraction=0.8, batch_size=16):
     fraction = (np.polyval(p, b) + r + a) / t  # actual fraction predicted
     LOGGER.info(f"{prefix}Using batch-size {b} for {d} {t * fraction:.2f}G/{t:.2f}G ({fraction * 100:.0f}%) ✅")
     return b
+
+
+class PeakMemory:
+    """Context manager measuring peak CUDA memory reserved on `device`, or peak process RSS on CPU by sampling."""
+
+    def __init__(self, device, interval=0.001):
+        """Initializes for `device`, sampling RSS every `interval` seconds on CPU."""
+        self.cuda, self.device, self.interval = device.type == "cuda", device, interval
+        self.process, self.peak, self.stop = psutil.Process(), 0, threading.Event()
+
+    def __enter__(self):
+        """Resets and starts the measurement."""
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        else:
+            self.peak, self.thread = self.process.memory_info().rss, threading.Thread(target=self.sample, daemon=True)
+            self.stop.clear()
+            self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        """Stops the measurement, leaving the peak in bytes in `self.peak`."""
+        if self.cuda:
+            self.peak = torch.cuda.max_memory_reserved(self.device)
+        else:
+            self.stop.set()
+            self.thread.join()
+
+    def sample(self):
+        """Samples process RSS until stopped."""
+        while not self.stop.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def autobatch_throughput(model, imgsz=640, fraction=0.8, batch_size=16, amp=True, max_batch=256, n=3, cache=True):
+    """
+    Returns the training batch size with the highest measured images/s whose peak memory stays within `fraction` of
+    free CUDA memory, or of available RAM on CPU.
+
+    Batch sizes 1, 2, 4, ... are timed over `n` forward/backward passes after a warmup pass until the budget, a linear
+    memory extrapolation or `max_batch` is exceeded, or throughput falls twice in a row. Of the sizes within 5% of the
+    best throughput the smallest is chosen. Results are cached in CONFIG_DIR/autobatch.json per model architecture,
+    `imgsz`, `amp` and device.
+    """
+    prefix = colorstr("AutoBatch: ")
+    device = next(model.parameters()).device  # get model device
+    gb = 1 << 30  # bytes to GiB (1024 ** 3)
+    if device.type == "cuda":
+        properties = torch.cuda.get_device_properties(device)  # device properties
+        name, total = properties.name, properties.total_memory
+        used = torch.cuda.memory_reserved(device)
+        budget = used + (total - used) * fraction  # bytes reserved at peak
+    else:
+        name, total = f"{platform.machine()} {torch.get_num_threads()}T", psutil.virtual_memory().total
+        used = psutil.Process().memory_info().rss
+        budget = used + psutil.virtual_memory().available * fraction  # bytes RSS at peak
+    name = f"{name} {total / gb:.0f}G"
+    key = file_hash(str(model), imgsz, fraction, amp, max_batch, name, torch.__version__)[:16]
+    file = CONFIG_DIR / "autobatch.json"
+    try:
+        results = json.loads(file.read_text()) if cache and file.exists() else {}
+    except Exception:  # unreadable cache
+        results = {}
+    if key in results:
+        LOGGER.info(f"{prefix}Using cached batch-size {results[key]} for --imgsz {imgsz} on {name}")
+        return results[key]
+
+    # Profile batch sizes
+    LOGGER.info(f"{prefix}Profiling training throughput for --imgsz {imgsz} on {name}, {budget / gb:.2f}G budget")
+    stats, b = [], 1  # (batch size, peak memory, images/s)
+    while b <= max_batch:
+        try:
+            x = torch.zeros(b, 3, imgsz, imgsz, device=device)
+            with PeakMemory(device) as m:
+                for i in range(n + 1):  # first pass is warmup
+                    if i == 1:
+                        t = time_sync()
+                    y = model(x)
+                    (sum(yi.sum() for yi in y) if isinstance(y, (list, tuple)) else y.sum()).backward()
+                t = time_sync() - t
+            model.zero_grad(set_to_none=True)
+            del x, y
+        except Exception as e:  # i.e. out of memory
+            LOGGER.warning(f"{prefix}WARNING ⚠️ batch-size {b} failed: {e}")
+            break
+        finally:
+            if device.type == "cuda":
+                torch.cuda.empty_cache()
+        stats.append((b, m.peak, b * n / t))
+        LOGGER.info(f"{prefix}batch-size {b:>4}: {m.peak / gb:.2f}G peak, {stats[-1][2]:.1f} img/s")
+        if m.peak > budget:
+            break
+        if len(stats) > 1 and 3 * m.peak - 2 * stats[-2][1] > budget:  # linear extrapolation to 2b
+            break
+        if len(stats) > 2 and stats[-1][2] < stats[-2][2] < stats[-3][2]:  # throughput falling
+            break
+        b *= 2
+
+    # Select
+    fit = [x for x in stats if x[1] <= budget]
+    if not fit:
+        LOGGER.warning(f"{prefix}WARNING ⚠️ no batch size fits the memory budget, using default batch-size {batch_size}")
+        return batch_size
+    best = max(x[2] for x in fit)
+    b = min(x[0] for x in fit if x[2] >= 0.95 * best)
+    LOGGER.info(f"{prefix}Using batch-size {b} for {name}, {dict((x[0], x[2]) for x in fit)[b]:.1f} img/s ✅")
+    if cache:
+        results[key] = b
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = file.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(results, indent=2))
+        os.replace(tmp, file)  # atomic, concurrent runs keep a readable file
+    return b
@@ -1,15 +1,20 @@
 # Ultralytics YOLOv5 🚀, AGPL-3.0 license
 """Dataloaders and dataset utils."""
 
+import atexit
 import contextlib
 import glob
 import hashlib
+import io
 import json
 import math
 import os
 import random
 import shutil
+import tarfile
+import tempfile
 import time
+from copy import copy
 from itertools import repeat
 from multiprocessing.pool import Pool, ThreadPool
 from pathlib import Path
@@ -23,7 +28,7 @@ import torch.nn.functional as F
 import torchvision
 import yaml
 from PIL import ExifTags, Image, ImageOps
-from torch.utils.data import DataLoader, Dataset, dataloader, distributed
+from torch.utils.data import DataLoader, Dataset, IterableDataset, RandomSampler, dataloader, distributed
 from tqdm import tqdm
 
 from utils.augmentations import (
@@ -35,6 +40,8 @@ from utils.augmentations import (
     letterbox,
     mixup,
     random_perspective,
+    random_perspective_matrix,
+    warp_labels,
 )
 from utils.general import (
     DATASETS_DIR,
@@ -43,6 +50,7 @@ from utils.general import (
     TQDM_BAR_FORMAT,
     check_dataset,
     check_requirements,
+    check_version,
     check_yaml,
     clean_str,
     cv2,
@@ -50,7 +58,6 @@ from utils.general import (
     is_kaggle,
     segments2boxes,
     unzip_file,
-    xyn2xy,
     xywh2xyxy,
     xywhn2xyxy,
     xyxy2xywhn,
@@ -65,6 +72,8 @@ LOCAL_RANK = int(os.getenv("LOCAL_RANK", -1))  # https://pytorch.org/docs/stable
 RANK = int(os.getenv("RANK", -1))
 WORLD_SIZE = int(os.getenv("WORLD_SIZE", 1))
 PIN_MEMORY = str(os.getenv("PIN_MEMORY", True)).lower() == "true"  # global pin_memory for dataloaders
+DECODERS = "cv2", "reduced", "torchvision"  # image decoders, see decode_image()
+TORCHVISION_EXIF = check_version(torchvision.__version__, "0.16.0")  # decode_jpeg() applies EXIF orientation
 
 # Get orientation exif tag
 for orientation in ExifTags.TAGS.keys():
@@ -80,6 +89,173 @@ def get_hash(paths):
     return h.hexdigest()  # return hash
 
 
+def file_stats(paths):
+    """Returns an (n, 2) float64 array of (mtime, size) per path, with (0, -1) for missing files."""
+    x = np.zeros((len(paths), 2))
+    x[:, 1] = -1
+    for i, p in enumerate(paths):
+        with contextlib.suppress(OSError):
+            s = os.stat(p)
+            x[i] = s.st_mtime, s.st_size
+    return x
+
+
+class RaggedArray:
+    """
+    Read-only list-like view over variable-length items packed into one array plus offsets, i.e. per-image labels.
+
+    `data` is an ndarray (optionally memory-mapped) or a nested RaggedArray (i.e. segments -> polygons -> points) and
+    `index` selects, orders and filters items without copying. Indexing with an int returns an array view (or a list of
+    views when nested), indexing with a slice or array returns a new RaggedArray.
+    """
+
+    def __init__(self, data, offsets, index=None):
+        """Initializes the view from packed `data`, `offsets` of shape (n + 1,) and optional item `index`."""
+        self.data = data
+        self.offsets = offsets
+        self.index = np.arange(len(offsets) - 1) if index is None else np.asarray(index)
+
+    @classmethod
+    def from_list(cls, items, shape=(0, 5), nested=False, dtype=np.float32):
+        """Packs a list of arrays (or a list of lists of arrays if `nested`, i.e. segments) into a new RaggedArray."""
+        if nested:
+            data = cls.from_list([y for x in items for y in x], shape, dtype=dtype)
+        else:
+            data = np.concatenate(items, 0).astype(dtype) if len(items) else np.zeros(shape, dtype=dtype)
+        offsets = np.zeros(len(items) + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in items], out=offsets[1:])
+        return cls(data, offsets)
+
+    def __len__(self):
+        """Returns the number of items in the view."""
+        return len(self.index)
+
+    def __iter__(self):
+        """Iterates over items in view order."""
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, i):
+        """Returns item `i` as an array view (list of views if nested), or a new view for slice/array indices."""
+        if isinstance(i, (slice, list, np.ndarray)):
+            return RaggedArray(self.data, self.offsets, self.index[i])
+        j = self.index[i]
+        a, b = int(self.offsets[j]), int(self.offsets[j + 1])
+        return [self.data[k] for k in range(a, b)] if isinstance(self.data, RaggedArray) else self.data[a:b]
+
+    def __getstate__(self):
+        """Pickles memory-mapped data by filename so spawned DataLoader workers re-map instead of copying."""
+        state = self.__dict__.copy()
+        for k in "data", "offsets":
+            if isinstance(state[k], np.memmap) and state[k].filename:
+                state[k] = ("mmap", state[k].filename)
+        return state
+
+    def __setstate__(self, state):
+        """Restores a pickled view, re-mapping memory-mapped arrays."""
+        for k in "data", "offsets":
+            if isinstance(state[k], tuple):
+                state[k] = np.load(state[k][1], mmap_mode="r")
+        self.__dict__.update(state)
+
+    def lengths(self):
+        """Returns the number of rows (or nested items) per item as an int array."""
+        return (self.offsets[1:] - self.offsets[:-1])[self.index]
+
+    def compact(self):
+        """Returns a new RaggedArray owning contiguous, writeable data in view order (flat data only)."""
+        n = self.lengths()
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(n, out=offsets[1:])
+        rows = np.arange(offsets[-1]) + np.repeat(self.offsets[self.index] - offsets[:-1], n)  # source row indices
+        return RaggedArray(np.array(self.data[rows]), offsets)
+
+
+class SharedImageCache:
+    """
+    Node-wide RAM image cache for LoadImagesAndLabels, packing resized uint8 images into one memory-mapped arena.
+
+    The first process on a node (LOCAL_RANK -1 or 0, see torch_distributed_zero_first) loads every image once into a
+    file in /dev/shm with an (offset, hw0, hw) index, all other DDP ranks and DataLoader workers attach read-only, so RAM
+    use scales with dataset size instead of world size. The arena is removed when the building process exits.
+    """
+
+    def __init__(self, dataset, file=None, prefix=""):
+        """Attaches to the arena `file` (default arena_file()) for `dataset` images at its `img_size`, building it first
+        if it does not exist yet.
+        """
+        self.file = file or self.arena_file(dataset)
+        self.index_file = self.file.with_suffix(".index.npy")
+        if not self.index_file.exists():
+            self._build(dataset, prefix)
+        self._attach()
+
+    @staticmethod
+    def arena_file(dataset):
+        """Returns the arena path for `dataset`, keyed by its image files and their (mtime, size) so that arenas left by
+        killed runs are not reused for changed images.
+        """
+        stats = file_stats(dataset.im_files).tolist()  # (mtime, size) per image
+        key = str((dataset.im_files, stats, dataset.img_size, dataset.augment, dataset.decoder))
+        key = hashlib.sha256(key.encode()).hexdigest()[:16]
+        shm = Path("/dev/shm")
+        root = shm if shm.is_dir() and os.access(shm, os.W_OK) else Path(tempfile.gettempdir())
+        return root / f"yolov5-{key}.bin"
+
+    def _attach(self):
+        """Maps the arena and its index read-only."""
+        x = np.load(self.index_file)  # (n, 5) offset, h0, w0, h, w
+        self.offsets, self.hw0, self.hw = x[:, 0], x[:, 1:3], x[:, 3:5]
+        self.data = np.memmap(self.file, dtype=np.uint8, mode="r")
+
+    def _build(self, dataset, prefix):
+        """Loads and resizes all `dataset` images into a new arena, writing the index last so readers see it complete."""
+        w0, h0 = dataset.shapes.T.astype(np.float64)  # original sizes
+        r = dataset.img_size / np.maximum(w0, h0)  # same resize as load_image()
+        hw = np.where((r != 1)[:, None], np.ceil(np.stack((h0 * r, w0 * r), 1)), np.stack((h0, w0), 1)).astype(int)
+        sizes = hw.prod(1) * 3  # expected bytes per image
+        index = np.full((len(sizes), 5), -1, dtype=np.int64)  # images that do not match their expected size stay -1
+        index[:, 0] = np.cumsum(sizes) - sizes
+        tmp = self.file.with_suffix(".tmp")
+        data = np.memmap(tmp, dtype=np.uint8, mode="w+", shape=(max(int(sizes.sum()), 1),))
+        b, gb = 0, 1 << 30  # bytes of cached images, bytes per gigabytes
+        results = ThreadPool(NUM_THREADS).imap(lambda i: (i, dataset.load_image(i)), range(len(sizes)))
+        pbar = tqdm(results, total=len(sizes), bar_format=TQDM_BAR_FORMAT, disable=LOCAL_RANK > 0)
+        for i, (im, hw_orig, hw_resized) in pbar:
+            if im.nbytes == sizes[i] and im.ndim == 3:
+                data[index[i, 0] : index[i, 0] + sizes[i]] = im.reshape(-1)
+                index[i, 1:] = *hw_orig, *hw_resized
+            b += im.nbytes
+            pbar.desc = f"{prefix}Caching images ({b / gb:.1f}GB shared ram)"
+        pbar.close()
+        data.flush()
+        del data
+        os.replace(tmp, self.file)
+        np.save(self.file.with_suffix(".index.tmp.npy"), index)
+        os.replace(self.file.with_suffix(".index.tmp.npy"), self.index_file)
+        atexit.register(lambda: [f.unlink(missing_ok=True) for f in (self.index_file, self.file)])
+
+    def __len__(self):
+        """Returns the number of images in the cache."""
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        """Returns image `i` as a read-only HWC uint8 view, or None if it is not cached."""
+        h, w = self.hw[i]
+        if h < 0:
+            return None
+        o = self.offsets[i]
+        return self.data[o : o + h * w * 3].reshape(h, w, 3)
+
+    def __getstate__(self):
+        """Pickles without the mapped arena so spawned DataLoader workers re-attach instead of copying it."""
+        return {k: v for k, v in self.__dict__.items() if k not in ("data", "offsets", "hw0", "hw")}
+
+    def __setstate__(self, state):
+        """Restores a pickled cache by re-attaching to the arena."""
+        self.__dict__.update(state)
+        self._attach()
+
+
 def exif_size(img):
     """Returns corrected PIL image size (width, height) considering EXIF orientation."""
     s = img.size  # (width, height)
@@ -117,6 +293,36 @@ def exif_transpose(image):
     return image
 
 
+def decode_image(f, img_size=None, decoder="cv2", shape=None):
+    """
+    Decodes image file or bytes `f` to BGR uint8, returning (im, hw_original) where `im` may be smaller than the original.
+
+    Decoders: 'cv2' full-size cv2.imdecode(), 'reduced' JPEG decoding at 1/2, 1/4 or 1/8 scale in the DCT domain
+    (libjpeg-turbo via cv2.IMREAD_REDUCED_COLOR_*) when the result stays >= `img_size` on its long side, and
+    'torchvision' torchvision.io.decode_jpeg(). `shape` is the original (w, h) if known, otherwise read from the header.
+    Non-JPEG images and unavailable decoders, including 'torchvision' < 0.16 without EXIF orientation, fall back to
+    'cv2'. All decoders apply EXIF orientation, so `im` and `hw_original` match EXIF-corrected label cache shapes.
+    """
+    buf = np.fromfile(f, np.uint8) if isinstance(f, (str, Path)) else np.frombuffer(f, np.uint8)
+    jpeg = buf[:2].tobytes() == b"\xff\xd8"  # JPEG SOI marker
+    if decoder == "reduced" and jpeg and img_size:
+        w0, h0 = shape if shape is not None else exif_size(Image.open(io.BytesIO(buf)))
+        k = next((k for k in (8, 4, 2) if max(w0, h0) >= k * img_size), 1)  # DCT scale factor
+        if k > 1:
+            flags = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}[k]
+            im = cv2.imdecode(buf, flags)
+            if im is not None:
+                return im, (int(h0), int(w0))
+    elif decoder == "torchvision" and jpeg and TORCHVISION_EXIF:
+        with contextlib.suppress(RuntimeError):  # i.e. CMYK or progressive JPEGs unsupported by this torchvision
+            x = torch.from_numpy(buf.copy())
+            x = torchvision.io.decode_jpeg(x, torchvision.io.ImageReadMode.RGB, apply_exif_orientation=True)
+            im = np.ascontiguousarray(x.permute(1, 2, 0).numpy()[..., ::-1])  # CHW RGB to HWC BGR
+            return im, im.shape[:2]
+    im = cv2.imdecode(buf, cv2.IMREAD_COLOR)  # BGR
+    return im, im.shape[:2] if im is not None else None
+
+
 def seed_worker(worker_id):
     """
     Sets the seed for a dataloader worker to ensure reproducibility, based on PyTorch's randomness notes.
@@ -157,6 +363,97 @@ class SmartDistributedSampler(distributed.DistributedSampler):
         return iter(idx)
 
 
+def rect_buckets(shapes, img_size=640, batch_size=16, stride=32, pad=0.0):
+    """
+    Returns (bucket index per image, bucket (h, w) shapes) grouping images of (w, h) `shapes` by their own rectangular
+    training shape, computed as LoadImagesAndLabels batch_shapes for a single image.
+
+    Buckets of fewer than `batch_size` images merge into the smallest bucket whose shape covers theirs, if any.
+    """
+    ar = shapes[:, 1] / shapes[:, 0]  # aspect ratio h / w
+    s = np.where((ar < 1)[:, None], np.stack((ar, np.ones_like(ar)), 1), np.stack((np.ones_like(ar), 1 / ar), 1))
+    s = np.ceil(s * img_size / stride + pad).astype(int) * stride
+    u, bucket, counts = np.unique(s, axis=0, return_inverse=True, return_counts=True)
+    bucket, parent = bucket.reshape(-1), np.arange(len(u))
+    order = np.argsort(u.prod(1), kind="stable")  # smallest area first, covering buckets are larger
+    for i in order:
+        if counts[i] < batch_size:
+            j = next((j for j in order if j != i and counts[j] and (u[j] >= u[i]).all()), None)
+            if j is not None:
+                counts[j], counts[i], parent[i] = counts[j] + counts[i], 0, j
+    for i in order[::-1]:  # resolve merge chains, parents come later in `order`
+        parent[i] = parent[parent[i]]
+    keep, parent = np.unique(parent, return_inverse=True)
+    return parent.reshape(-1)[bucket], u[keep]
+
+
+class AspectRatioBatchSampler:
+    """
+    Batch sampler for shuffled rectangular training, yielding batches of `sampler` indices from one aspect-ratio bucket
+    each (see rect_buckets()).
+
+    Images are batched in `sampler` order within their bucket and batch order is shuffled every epoch. Each epoch yields
+    ceil(len(sampler) / batch_size) batches, equal across DDP ranks, so the smallest partial bucket batches are skipped
+    when buckets leave more of them; they are reshuffled the next epoch.
+    """
+
+    def __init__(self, sampler, buckets, batch_size, seed=0):
+        """Initializes with `sampler` (i.e. RandomSampler or SmartDistributedSampler) and the bucket of each of its
+        indices.
+        """
+        self.sampler, self.buckets, self.batch_size, self.seed = sampler, buckets, batch_size, seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """Sets the epoch for shuffling, which otherwise advances on every iteration."""
+        self.epoch = epoch
+
+    def __len__(self):
+        """Returns the number of batches per epoch."""
+        return math.ceil(len(self.sampler) / self.batch_size)
+
+    def __iter__(self):
+        """Yields the shuffled batches of one epoch."""
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(self.epoch)  # DDP shuffle, same epoch on all ranks
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        groups = {}
+        for i in self.sampler:
+            groups.setdefault(self.buckets[i], []).append(i)
+        bs = self.batch_size
+        batches = [x[i : i + bs] for x in groups.values() for i in range(0, len(x), bs)]
+        batches = sorted(batches, key=len, reverse=True)[: len(self)]  # full batches first
+        for i in torch.randperm(len(batches), generator=g).tolist():
+            yield batches[i]
+
+
+class MultiScaleCollate:
+    """
+    Multi-scale training collate, resizing each batch from `collate_fn` in the DataLoader workers to a size drawn from a
+    fixed set.
+
+    Batches are resized so their longest side matches the drawn size, with both sides rounded up to multiples of
+    `stride`. Labels are normalized and need no change. A fixed set of sizes bounds the number of distinct input shapes
+    seen by the model, avoiding repeated cuDNN autotuning, allocator growth and graph recompilation at new shapes.
+    """
+
+    def __init__(self, collate_fn, sizes, stride=32):
+        """Initializes with the wrapped `collate_fn`, candidate `sizes` and model `stride`."""
+        self.collate_fn, self.sizes, self.stride = collate_fn, list(sizes), int(stride)
+
+    def __call__(self, batch):
+        """Collates `batch` and resizes its uint8 images to a randomly drawn size."""
+        im, *other = self.collate_fn(batch)
+        sf = random.choice(self.sizes) / max(im.shape[2:])  # scale factor
+        if sf != 1:
+            ns = [math.ceil(x * sf / self.stride) * self.stride for x in im.shape[2:]]  # new shape (stretched to gs)
+            im = F.interpolate(im.float(), size=ns, mode="bilinear", align_corners=False).round_().clamp_(0, 255)
+            im = im.to(torch.uint8)  # keep uint8 for 4x smaller host to device copies
+        return (im, *other)
+
+
 def create_dataloader(
     path,
     imgsz,
@@ -175,10 +472,37 @@ def create_dataloader(
     prefix="",
     shuffle=False,
     seed=0,
+    shards=False,
+    decoder="cv2",
+    batch_augment=False,
+    sizes=None,
 ):
-    """Creates and returns a configured DataLoader instance for loading and processing image datasets."""
-    if rect and shuffle:
-        LOGGER.warning("WARNING ⚠️ --rect is incompatible with DataLoader shuffle, setting shuffle=False")
+    """Creates and returns a configured DataLoader instance for loading and processing image datasets, resizing batches
+    in the workers to `sizes` for multi-scale training.
+    """
+    if shards:  # sequential reads from packed tar shards, see pack_dataset_shards()
+        if rect or cache or image_weights:
+            LOGGER.warning("WARNING ⚠️ --rect, --cache and --image-weights are incompatible with --shards, ignoring")
+        return create_shard_dataloader(
+            path,
+            imgsz,
+            batch_size,
+            stride,
+            single_cls,
+            hyp,
+            augment,
+            pad,
+            rank,
+            workers,
+            quad,
+            prefix,
+            seed,
+            decoder,
+            batch_augment,
+            sizes,
+        )
+    if rect and shuffle and quad:
+        LOGGER.warning("WARNING ⚠️ --rect is incompatible with --quad DataLoader shuffle, setting shuffle=False")
         shuffle = False
     with torch_distributed_zero_first(rank):  # init dataset *.cache only once if DDP
         dataset = LoadImagesAndLabels(
@@ -195,6 +519,9 @@ def create_dataloader(
             image_weights=image_weights,
             prefix=prefix,
             rank=rank,
+            decoder=decoder,
+            batch_augment=batch_augment,
+            buckets=shuffle,
         )
 
     batch_size = min(batch_size, len(dataset))
@@ -204,15 +531,98 @@ def create_dataloader(
     loader = DataLoader if image_weights else InfiniteDataLoader  # only DataLoader allows for attribute updates
     generator = torch.Generator()
     generator.manual_seed(6148914691236517205 + seed + RANK)
+    collate_fn = LoadImagesAndLabels.collate_fn4 if quad else LoadImagesAndLabels.collate_fn
+    if sizes:  # multi-scale resize in workers
+        collate_fn = MultiScaleCollate(collate_fn, sizes, stride)
+    batch_sampler = None
+    if dataset.rect and shuffle:  # shuffled rectangular batches
+        sampler = sampler or RandomSampler(dataset, generator=generator)
+        batch_sampler = AspectRatioBatchSampler(sampler, dataset.batch[dataset.indices], batch_size, seed)
+        sampler, batch_size, shuffle = None, 1, False
     return loader(
         dataset,
         batch_size=batch_size,
         shuffle=shuffle and sampler is None,
         num_workers=nw,
         sampler=sampler,
+        batch_sampler=batch_sampler,
+        drop_last=quad,
+        pin_memory=PIN_MEMORY,
+        collate_fn=collate_fn,
+        worker_init_fn=seed_worker,
+        generator=generator,
+    ), dataset
+
+
+def subset_dataloader(loader, fraction, seed=0):
+    """Returns a DataLoader over a fixed random `fraction` of the batches of non-shuffled `loader`, keeping whole batches
+    so that rectangular batch shapes stay valid.
+    """
+    n, bs = len(loader.dataset), loader.batch_size
+    batches = [list(range(i, min(i + bs, n))) for i in range(0, n, bs)]
+    k = max(round(len(batches) * fraction), 1)
+    batches = [batches[i] for i in sorted(random.Random(seed).sample(range(len(batches)), k))]
+    return DataLoader(
+        loader.dataset,
+        batch_sampler=batches,
+        num_workers=loader.num_workers,
+        pin_memory=loader.pin_memory,
+        collate_fn=loader.collate_fn,
+        worker_init_fn=seed_worker,
+    )
+
+
+def create_shard_dataloader(
+    path,
+    imgsz,
+    batch_size,
+    stride,
+    single_cls=False,
+    hyp=None,
+    augment=False,
+    pad=0.0,
+    rank=-1,
+    workers=8,
+    quad=False,
+    prefix="",
+    seed=0,
+    decoder="cv2",
+    batch_augment=False,
+    sizes=None,
+):
+    """Creates a DataLoader streaming packed shards of the dataset at `path`, packing them on first use."""
+    with torch_distributed_zero_first(rank):  # pack shards only once if DDP
+        dataset = LoadImagesAndLabelsShards(
+            path,
+            imgsz,
+            batch_size,
+            augment=augment,
+            hyp=hyp,
+            single_cls=single_cls,
+            stride=int(stride),
+            pad=pad,
+            prefix=prefix,
+            rank=rank,
+            seed=seed,
+            decoder=decoder,
+            batch_augment=batch_augment,
+        )
+
+    batch_size = min(batch_size, len(dataset))
+    nd = torch.cuda.device_count()  # number of CUDA devices
+    nw = min([os.cpu_count() // max(nd, 1), batch_size if batch_size > 1 else 0, workers])  # number of workers
+    generator = torch.Generator()
+    generator.manual_seed(6148914691236517205 + seed + RANK)
+    collate_fn = LoadImagesAndLabels.collate_fn4 if quad else LoadImagesAndLabels.collate_fn
+    if sizes:  # multi-scale resize in workers
+        collate_fn = MultiScaleCollate(collate_fn, sizes, stride)
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        num_workers=nw,
         drop_last=quad,
         pin_memory=PIN_MEMORY,
-        collate_fn=LoadImagesAndLabels.collate_fn4 if quad else LoadImagesAndLabels.collate_fn,
+        collate_fn=collate_fn,
         worker_init_fn=seed_worker,
         generator=generator,
     ), dataset
@@ -261,6 +671,42 @@ class _RepeatSampler:
             yield from iter(self.sampler)
 
 
+class BatchCache:
+    """
+    Holds all letterboxed batches of a dataloader in memory to iterate them repeatedly, e.g. across weights in a sweep.
+
+    Batches are only cached if their estimated uint8 size fits `max_bytes` (default half the available RAM), otherwise
+    every iteration reads the dataloader again.
+    Usage: dataloader = BatchCache(create_dataloader(path, imgsz, batch_size, stride, rect=True)[0])
+    """
+
+    def __init__(self, dataloader, max_bytes=None, prefix=""):
+        """Collects every (images, targets, paths, shapes) batch of `dataloader` once if they fit in `max_bytes`."""
+        self.dataloader = dataloader
+        self.dataset = d = dataloader.dataset
+        hw = d.batch_shapes[d.batch] if d.rect else np.full((d.n, 2), d.img_size)  # letterboxed image shapes
+        b, gb = int(hw.prod(1).sum()) * 3, 1 << 30  # bytes of cached batches, bytes per gigabytes
+        max_bytes = psutil.virtual_memory().available * 0.5 if max_bytes is None else max_bytes
+        self.batches = None
+        if b <= max_bytes:
+            LOGGER.info(f"{prefix}Caching {len(dataloader)} batches ({b / gb:.1f}GB ram)")
+            self.batches = list(dataloader)
+        else:
+            LOGGER.warning(f"{prefix}WARNING ⚠️ {b / gb:.1f}GB of batches exceed {max_bytes / gb:.1f}GB, not caching")
+
+    def __len__(self):
+        """Returns the number of batches."""
+        return len(self.dataloader)
+
+    def __iter__(self):
+        """Yields cached batches with fresh targets, which consumers such as val.run() may modify in place."""
+        if self.batches is None:
+            yield from self.dataloader
+            return
+        for im, targets, paths, shapes in self.batches:
+            yield im, targets.clone(), paths, shapes
+
+
 class LoadScreenshots:
     """Loads and processes screenshots for YOLOv5 detection from specified screen regions using mss."""
 
@@ -322,7 +768,7 @@ class LoadScreenshots:
 class LoadImages:
     """YOLOv5 image/video dataloader, i.e. `python detect.py --source image.jpg/vid.mp4`."""
 
-    def __init__(self, path, img_size=640, stride=32, auto=True, transforms=None, vid_stride=1):
+    def __init__(self, path, img_size=640, stride=32, auto=True, transforms=None, vid_stride=1, decoder="cv2"):
         """Initializes YOLOv5 loader for images/videos, supporting glob patterns, directories, and lists of paths."""
         if isinstance(path, str) and Path(path).suffix == ".txt":  # *.txt file with img/vid/dir on each line
             path = Path(path).read_text().rsplit()
@@ -351,6 +797,7 @@ class LoadImages:
         self.auto = auto
         self.transforms = transforms  # optional
         self.vid_stride = vid_stride  # video frame-rate stride
+        self.decoder = decoder  # image decoder, 'reduced' returns im0 at up to 1/8 of the original size
         if any(videos):
             self._new_video(videos[0])  # new video
         else:
@@ -393,7 +840,7 @@ class LoadImages:
         else:
             # Read image
             self.count += 1
-            im0 = cv2.imread(path)  # BGR
+            im0 = decode_image(path, int(np.max(self.img_size)), self.decoder)[0]  # BGR
             assert im0 is not None, f"Image Not Found {path}"
             s = f"image {self.count}/{self.nf} {path}: "
 
@@ -538,7 +985,7 @@ def img2label_paths(img_paths):
 class LoadImagesAndLabels(Dataset):
     """Loads images and their corresponding labels for training and validation in YOLOv5."""
 
-    cache_version = 0.6  # dataset labels *.cache version
+    cache_version = 0.7  # dataset labels *.cache version
     rand_interp_methods = [cv2.INTER_NEAREST, cv2.INTER_LINEAR, cv2.INTER_CUBIC, cv2.INTER_AREA, cv2.INTER_LANCZOS4]
 
     def __init__(
@@ -558,8 +1005,13 @@ class LoadImagesAndLabels(Dataset):
         prefix="",
         rank=-1,
         seed=0,
+        decoder="cv2",
+        batch_augment=False,
+        buckets=False,
     ):
-        """Initializes the YOLOv5 dataset loader, handling images and their labels, caching, and preprocessing."""
+        """Initializes the YOLOv5 dataset loader, handling images and their labels, caching, and preprocessing; with
+        `rect` and `buckets` rectangular shapes are per aspect-ratio bucket for AspectRatioBatchSampler.
+        """
         self.img_size = img_size
         self.augment = augment
         self.hyp = hyp
@@ -569,6 +1021,8 @@ class LoadImagesAndLabels(Dataset):
         self.mosaic_border = [-img_size // 2, -img_size // 2]
         self.stride = stride
         self.path = path
+        self.decoder = decoder  # image decoder, see decode_image()
+        self.batch_augment = batch_augment  # leave HSV, flips, mixup and non-mosaic warps to BatchAugmentations
         self.albumentations = Albumentations(size=img_size) if augment else None
 
         try:
@@ -595,40 +1049,43 @@ class LoadImagesAndLabels(Dataset):
         # Check cache
         self.label_files = img2label_paths(self.im_files)  # labels
         cache_path = (p if p.is_file() else Path(self.label_files[0]).parent).with_suffix(".cache")
-        try:
-            cache, exists = np.load(cache_path, allow_pickle=True).item(), True  # load dict
-            assert cache["version"] == self.cache_version  # matches current version
-            assert cache["hash"] == get_hash(self.label_files + self.im_files)  # identical hash
-        except Exception:
-            cache, exists = self.cache_labels(cache_path, prefix), False  # run cache ops
+        cache = self.load_label_cache(cache_path, self.cache_version)  # None if missing or outdated
+        stats = np.concatenate((file_stats(self.im_files), file_stats(self.label_files)), 1)  # per-file mtime, size
+        exists = (
+            cache is not None
+            and np.array_equal(cache["im_files"], self.im_files)
+            and np.array_equal(cache["stats"], stats)
+        )
+        if not exists:
+            cache = self.cache_labels(cache_path, prefix, cache, stats)  # rescan new or changed files only
 
         # Display cache
-        nf, nm, ne, nc, n = cache.pop("results")  # found, missing, empty, corrupt, total
+        nf, nm, ne, nc, n = cache["results"]  # found, missing, empty, corrupt, total
         if exists and LOCAL_RANK in {-1, 0}:
             d = f"Scanning {cache_path}... {nf} images, {nm + ne} backgrounds, {nc} corrupt"
             tqdm(None, desc=prefix + d, total=n, initial=n, bar_format=TQDM_BAR_FORMAT)  # display cache results
             if cache["msgs"]:
-                LOGGER.info("\n".join(cache["msgs"]))  # display warnings
+                LOGGER.info("\n".join(cache["msgs"].values()))  # display warnings
         assert nf > 0 or not augment, f"{prefix}No labels found in {cache_path}, can not start training. {HELP_URL}"
 
         # Read cache
-        [cache.pop(k) for k in ("hash", "version", "msgs")]  # remove items
-        labels, shapes, self.segments = zip(*cache.values())
-        nl = len(np.concatenate(labels, 0))  # number of labels
+        valid = cache["valid"].nonzero()[0]  # exclude corrupt images
+        self.labels = cache["labels"][valid]  # RaggedArray views of memory-mapped arrays, shared by all workers
+        self.segments = cache["segments"][valid]
+        nl = self.labels.lengths().sum()  # number of labels
         assert nl > 0 or not augment, f"{prefix}All labels empty in {cache_path}, can not start training. {HELP_URL}"
-        self.labels = list(labels)
-        self.shapes = np.array(shapes)
-        self.im_files = list(cache.keys())  # update
-        self.label_files = img2label_paths(cache.keys())  # update
+        self.shapes = np.array(cache["shapes"][valid])
+        self.im_files = [self.im_files[i] for i in valid]  # update
+        self.label_files = img2label_paths(self.im_files)  # update
 
         # Filter images
         if min_items:
-            include = np.array([len(x) >= min_items for x in self.labels]).nonzero()[0].astype(int)
+            include = (self.labels.lengths() >= min_items).nonzero()[0]
             LOGGER.info(f"{prefix}{n - len(include)}/{n} images filtered from dataset")
             self.im_files = [self.im_files[i] for i in include]
             self.label_files = [self.label_files[i] for i in include]
-            self.labels = [self.labels[i] for i in include]
-            self.segments = [self.segments[i] for i in include]
+            self.labels = self.labels[include]
+            self.segments = self.segments[include]
             self.shapes = self.shapes[include]  # wh
 
         # Create indices
@@ -644,27 +1101,27 @@ class LoadImagesAndLabels(Dataset):
 
         # Update labels
         include_class = []  # filter labels to include only these classes (optional)
-        self.segments = list(self.segments)
-        include_class_array = np.array(include_class).reshape(1, -1)
-        for i, (label, segment) in enumerate(zip(self.labels, self.segments)):
-            if include_class:
-                j = (label[:, 0:1] == include_class_array).any(1)
-                self.labels[i] = label[j]
-                if segment:
-                    self.segments[i] = [segment[idx] for idx, elem in enumerate(j) if elem]
-            if single_cls:  # single-class training, merge all classes into 0
-                self.labels[i][:, 0] = 0
+        if include_class:
+            j = [np.isin(label[:, 0], include_class) for label in self.labels]
+            segments = [[x[k] for k in m.nonzero()[0]] if x else x for x, m in zip(self.segments, j)]
+            self.segments = RaggedArray.from_list(segments, shape=(0, 2), nested=True)
+            self.labels = RaggedArray.from_list([label[m] for label, m in zip(self.labels, j)])
+        if single_cls:  # single-class training, merge all classes into 0
+            self.labels = self.labels.compact()  # writeable copy
+            self.labels.data[:, 0] = 0
 
         # Rectangular Training
-        if self.rect:
+        if self.rect and buckets:  # shuffled batches within aspect-ratio buckets, see AspectRatioBatchSampler
+            self.batch, self.batch_shapes = rect_buckets(self.shapes, img_size, batch_size, stride, pad)
+        elif self.rect:
             # Sort by aspect ratio
             s = self.shapes  # wh
             ar = s[:, 1] / s[:, 0]  # aspect ratio
             irect = ar.argsort()
             self.im_files = [self.im_files[i] for i in irect]
             self.label_files = [self.label_files[i] for i in irect]
-            self.labels = [self.labels[i] for i in irect]
-            self.segments = [self.segments[i] for i in irect]
+            self.labels = self.labels[irect]
+            self.segments = self.segments[irect]
             self.shapes = s[irect]  # wh
             ar = ar[irect]
 
@@ -681,22 +1138,21 @@ class LoadImagesAndLabels(Dataset):
             self.batch_shapes = np.ceil(np.array(shapes) * img_size / stride + pad).astype(int) * stride
 
         # Cache images into RAM/disk for faster training
-        if cache_images == "ram" and not self.check_cache_ram(prefix=prefix):
+        arena = SharedImageCache.arena_file(self) if cache_images == "ram" else None
+        built = arena and arena.with_suffix(".index.npy").exists()  # by another rank, its RAM is no longer available
+        if cache_images == "ram" and not built and not self.check_cache_ram(prefix=prefix):
             cache_images = False
         self.ims = [None] * n
         self.npy_files = [Path(f).with_suffix(".npy") for f in self.im_files]
-        if cache_images:
+        if cache_images == "ram":  # one copy per node, shared by all DDP ranks and DataLoader workers
+            self.ims = SharedImageCache(self, arena, prefix)
+            self.im_hw0, self.im_hw = self.ims.hw0, self.ims.hw
+        elif cache_images:
             b, gb = 0, 1 << 30  # bytes of cached images, bytes per gigabytes
-            self.im_hw0, self.im_hw = [None] * n, [None] * n
-            fcn = self.cache_images_to_disk if cache_images == "disk" else self.load_image
-            results = ThreadPool(NUM_THREADS).imap(lambda i: (i, fcn(i)), self.indices)
+            results = ThreadPool(NUM_THREADS).imap(lambda i: (i, self.cache_images_to_disk(i)), self.indices)
             pbar = tqdm(results, total=len(self.indices), bar_format=TQDM_BAR_FORMAT, disable=LOCAL_RANK > 0)
-            for i, x in pbar:
-                if cache_images == "disk":
-                    b += self.npy_files[i].stat().st_size
-                else:  # 'ram'
-                    self.ims[i], self.im_hw0[i], self.im_hw[i] = x  # im, hw_orig, hw_resized = load_image(self, i)
-                    b += self.ims[i].nbytes * WORLD_SIZE
+            for i, _ in pbar:
+                b += self.npy_files[i].stat().st_size
                 pbar.desc = f"{prefix}Caching images ({b / gb:.1f}GB {cache_images})"
             pbar.close()
 
@@ -719,46 +1175,156 @@ class LoadImagesAndLabels(Dataset):
             )
         return cache
 
-    def cache_labels(self, path=Path("./labels.cache"), prefix=""):
-        """Caches dataset labels, verifies images, reads shapes, and tracks dataset integrity."""
-        x = {}  # dict
-        nm, nf, ne, nc, msgs = 0, 0, 0, 0, []  # number missing, found, empty, corrupt, messages
+    def cache_labels(self, path=Path("./labels.cache"), prefix="", cache=None, stats=None):
+        """
+        Caches dataset labels, verifies images, reads shapes, and tracks dataset integrity.
+
+        Only images whose image or label file is new or changed (by mtime and size) since `cache` are re-verified, all
+        others are carried over. Labels and segments are packed into columnar arrays, see save_label_cache().
+        """
+        n = len(self.im_files)
+        if stats is None:
+            stats = np.concatenate((file_stats(self.im_files), file_stats(self.label_files)), 1)
+        reuse = np.full(n, -1)  # cached row per image, -1 to (re)scan
+        if cache is not None and len(cache["im_files"]):
+            rows = {f: i for i, f in enumerate(cache["im_files"].tolist())}
+            reuse = np.array([rows.get(f, -1) for f in self.im_files])
+            reuse[(reuse >= 0) & ~(cache["stats"][reuse] == stats).all(1)] = -1  # changed files
+
+        labels, segments, msgs = [None] * n, [None] * n, {}
+        shapes, counts, valid = np.zeros((n, 2), dtype=np.int32), np.zeros((n, 4), dtype=np.int32), np.zeros(n, bool)
+        for j in (reuse >= 0).nonzero()[0]:
+            i = reuse[j]
+            labels[j], segments[j] = cache["labels"][i], cache["segments"][i]
+            shapes[j], counts[j], valid[j] = cache["shapes"][i], cache["counts"][i], cache["valid"][i]
+            if self.im_files[j] in cache["msgs"]:
+                msgs[self.im_files[j]] = cache["msgs"][self.im_files[j]]
+
+        scan = (reuse < 0).nonzero()[0]
+        nm, nf, ne, nc = counts.sum(0)  # number missing, found, empty, corrupt
         desc = f"{prefix}Scanning {path.parent / path.stem}..."
         with Pool(NUM_THREADS) as pool:
+            args = zip([self.im_files[j] for j in scan], [self.label_files[j] for j in scan], repeat(prefix))
             pbar = tqdm(
-                pool.imap(verify_image_label, zip(self.im_files, self.label_files, repeat(prefix))),
+                pool.imap(verify_image_label, args),
                 desc=desc,
-                total=len(self.im_files),
+                total=len(scan),
                 bar_format=TQDM_BAR_FORMAT,
             )
-            for im_file, lb, shape, segments, nm_f, nf_f, ne_f, nc_f, msg in pbar:
+            for j, (im_file, lb, shape, segs, nm_f, nf_f, ne_f, nc_f, msg) in zip(scan, pbar):
                 nm += nm_f
                 nf += nf_f
                 ne += ne_f
                 nc += nc_f
+                counts[j] = nm_f, nf_f, ne_f, nc_f
                 if im_file:
-                    x[im_file] = [lb, shape, segments]
+                    labels[j], shapes[j], segments[j], valid[j] = lb, shape, segs, True
+                else:
+                    labels[j], segments[j] = np.zeros((0, 5), dtype=np.float32), []
                 if msg:
-                    msgs.append(msg)
+                    msgs[self.im_files[j]] = msg
                 pbar.desc = f"{desc} {nf} images, {nm + ne} backgrounds, {nc} corrupt"
 
         pbar.close()
         if msgs:
-            LOGGER.info("\n".join(msgs))
+            LOGGER.info("\n".join(msgs.values()))
         if nf == 0:
             LOGGER.warning(f"{prefix}WARNING ⚠️ No labels found in {path}. {HELP_URL}")
-        x["hash"] = get_hash(self.label_files + self.im_files)
-        x["results"] = nf, nm, ne, nc, len(self.im_files)
-        x["msgs"] = msgs  # warnings
-        x["version"] = self.cache_version  # cache version
+        if len(scan):  # stat after verifying, corrupt JPEGs may have been restored
+            stats[scan] = np.concatenate(
+                (file_stats([self.im_files[j] for j in scan]), file_stats([self.label_files[j] for j in scan])), 1
+            )
+        x = {
+            "im_files": np.array(self.im_files),
+            "stats": stats,
+            "valid": valid,
+            "counts": counts,
+            "shapes": shapes,
+            "labels": RaggedArray.from_list(labels),
+            "segments": RaggedArray.from_list(segments, shape=(0, 2), nested=True),
+            "results": (nf, nm, ne, nc, n),
+            "msgs": msgs,  # warnings
+            "version": self.cache_version,  # cache version
+        }
         try:
-            np.save(path, x)  # save cache for next time
-            path.with_suffix(".cache.npy").rename(path)  # remove .npy suffix
-            LOGGER.info(f"{prefix}New cache created: {path}")
+            self.save_label_cache(path, x)  # save cache for next time
+            LOGGER.info(f"{prefix}{'Updated' if cache else 'New'} cache created: {path} ({len(scan)}/{n} scanned)")
         except Exception as e:
             LOGGER.warning(f"{prefix}WARNING ⚠️ Cache directory {path.parent} is not writeable: {e}")  # not writeable
         return x
 
+    @staticmethod
+    def save_label_cache(path, x):
+        """
+        Saves label cache dict `x` as a small pickled *.cache file plus memory-mappable *.npy arrays.
+
+        Labels are one (N, 5) float32 array with (n + 1,) offsets per image, segments are one (P, 2) float32 points array
+        with polygon and per-image offsets. Array files are replaced atomically and the *.cache file is written last, so
+        a partially written cache is never loaded.
+        """
+        path.unlink(missing_ok=True)
+        arrays = {
+            "labels": x["labels"].data,
+            "label_offsets": x["labels"].offsets,
+            "points": x["segments"].data.data,
+            "polygon_offsets": x["segments"].data.offsets,
+            "segment_offsets": x["segments"].offsets,
+            **{k: x[k] for k in ("stats", "valid", "counts", "shapes")},
+        }
+        for k, v in arrays.items():
+            f = Path(f"{path}.{k}.npy")
+            np.save(f.with_suffix(".tmp.npy"), v)
+            os.replace(f.with_suffix(".tmp.npy"), f)  # keeps files mapped by running processes intact
+        np.save(path, {k: v for k, v in x.items() if k not in arrays and k not in ("labels", "segments")})
+        path.with_suffix(".cache.npy").rename(path)  # remove .npy suffix
+
+    @classmethod
+    def read_label_cache(cls, path):
+        """Returns (labels, shapes) of the valid images of dataset `path` (a directory or *.txt file) from its label
+        cache without listing images or building a dataset, or None if there is no current cache, i.e. one of its image
+        or label files changed (by mtime and size) since. Images added to `path` since are not detected.
+        """
+        if not isinstance(path, (str, Path)):  # i.e. a list of directories, build the dataset instead
+            return None
+        p = Path(path)
+        cache_path = (p if p.is_file() else Path(img2label_paths([str(p / "x.jpg")])[0]).parent).with_suffix(".cache")
+        cache = cls.load_label_cache(cache_path, cls.cache_version)
+        if cache is None:
+            return None
+        im_files = cache["im_files"].tolist()
+        stats = np.concatenate((file_stats(im_files), file_stats(img2label_paths(im_files))), 1)  # as in __init__()
+        if not np.array_equal(cache["stats"], stats):
+            return None
+        valid = cache["valid"].nonzero()[0]  # exclude corrupt images
+        return cache["labels"][valid], np.array(cache["shapes"][valid])
+
+    @staticmethod
+    def load_label_cache(path, version):
+        """Loads a label cache saved by save_label_cache() with memory-mapped arrays, returns None if unusable."""
+        try:
+            x = np.load(path, allow_pickle=True).item()  # load dict
+            assert x["version"] == version  # matches current version
+            a = {
+                k: np.load(f"{path}.{k}.npy", mmap_mode="r")
+                for k in (
+                    "labels",
+                    "label_offsets",
+                    "points",
+                    "polygon_offsets",
+                    "segment_offsets",
+                    "stats",
+                    "valid",
+                    "counts",
+                    "shapes",
+                )
+            }
+        except Exception:
+            return None
+        x["labels"] = RaggedArray(a.pop("labels"), a.pop("label_offsets"))
+        x["segments"] = RaggedArray(RaggedArray(a.pop("points"), a.pop("polygon_offsets")), a.pop("segment_offsets"))
+        x.update(a)
+        return x
+
     def __len__(self):
         """Returns the number of images in the dataset."""
         return len(self.im_files)
@@ -781,7 +1347,7 @@ class LoadImagesAndLabels(Dataset):
             shapes = None
 
             # MixUp augmentation
-            if random.random() < hyp["mixup"]:
+            if random.random() < hyp["mixup"] and not self.batch_augment:
                 img, labels = mixup(img, labels, *self.load_mosaic(random.choice(self.indices)))
 
         else:
@@ -797,7 +1363,7 @@ class LoadImagesAndLabels(Dataset):
             if labels.size:  # normalized xywh to pixel xyxy format
                 labels[:, 1:] = xywhn2xyxy(labels[:, 1:], ratio[0] * w, ratio[1] * h, padw=pad[0], padh=pad[1])
 
-            if self.augment:
+            if self.augment and not self.batch_augment:
                 img, labels = random_perspective(
                     img,
                     labels,
@@ -817,6 +1383,7 @@ class LoadImagesAndLabels(Dataset):
             img, labels = self.albumentations(img, labels)
             nl = len(labels)  # update after albumentations
 
+        if self.augment and not self.batch_augment:
             # HSV color-space
             augment_hsv(img, hgain=hyp["hsv_h"], sgain=hyp["hsv_s"], vgain=hyp["hsv_v"])
 
@@ -860,16 +1427,23 @@ class LoadImagesAndLabels(Dataset):
         if im is None:  # not cached in RAM
             if fn.exists():  # load npy
                 im = np.load(fn)
+                hw0 = im.shape[:2]
             else:  # read image
-                im = cv2.imread(f)  # BGR
+                im, hw0 = decode_image(f, self.img_size, self.decoder, self.shapes[i])  # BGR
                 assert im is not None, f"Image Not Found {f}"
-            h0, w0 = im.shape[:2]  # orig hw
-            r = self.img_size / max(h0, w0)  # ratio
-            if r != 1:  # if sizes are not equal
-                interp = cv2.INTER_LINEAR if (self.augment or r > 1) else cv2.INTER_AREA
-                im = cv2.resize(im, (math.ceil(w0 * r), math.ceil(h0 * r)), interpolation=interp)
-            return im, (h0, w0), im.shape[:2]  # im, hw_original, hw_resized
-        return self.ims[i], self.im_hw0[i], self.im_hw[i]  # im, hw_original, hw_resized
+            return self.resize_image(im, hw0)
+        return im, tuple(self.im_hw0[i].tolist()), tuple(self.im_hw[i].tolist())  # im, hw_original, hw_resized
+
+    def resize_image(self, im, hw0):
+        """Resizes `im` of EXIF-corrected original size `hw0` (possibly decoded at reduced scale) to `img_size` on its
+        long side.
+        """
+        h0, w0 = hw0  # orig hw
+        r = self.img_size / max(h0, w0)  # ratio
+        if r != 1 or im.shape[:2] != (h0, w0):  # if sizes are not equal
+            interp = cv2.INTER_LINEAR if (self.augment or r > 1) else cv2.INTER_AREA
+            im = cv2.resize(im, (math.ceil(w0 * r), math.ceil(h0 * r)), interpolation=interp)
+        return im, (h0, w0), im.shape[:2]  # im, hw_original, hw_resized
 
     def cache_images_to_disk(self, i):
         """Saves an image to disk as an *.npy file for quicker loading, identified by index `i`."""
@@ -879,7 +1453,7 @@ class LoadImagesAndLabels(Dataset):
 
     def load_mosaic(self, index):
         """Loads a 4-image mosaic for YOLOv5, combining 1 selected and 3 random images, with labels and segments."""
-        labels4, segments4 = [], []
+        tiles = []
         s = self.img_size
         yc, xc = (int(random.uniform(-x, 2 * s + x)) for x in self.mosaic_border)  # mosaic center x, y
         indices = [index] + random.choices(self.indices, k=3)  # 3 additional image indices
@@ -890,58 +1464,27 @@ class LoadImagesAndLabels(Dataset):
 
             # place img in img4
             if i == 0:  # top left
-                img4 = np.full((s * 2, s * 2, img.shape[2]), 114, dtype=np.uint8)  # base image with 4 tiles
                 x1a, y1a, x2a, y2a = max(xc - w, 0), max(yc - h, 0), xc, yc  # xmin, ymin, xmax, ymax (large image)
-                x1b, y1b, x2b, y2b = w - (x2a - x1a), h - (y2a - y1a), w, h  # xmin, ymin, xmax, ymax (small image)
+                x1b, y1b = w - (x2a - x1a), h - (y2a - y1a)  # xmin, ymin (small image)
             elif i == 1:  # top right
                 x1a, y1a, x2a, y2a = xc, max(yc - h, 0), min(xc + w, s * 2), yc
-                x1b, y1b, x2b, y2b = 0, h - (y2a - y1a), min(w, x2a - x1a), h
+                x1b, y1b = 0, h - (y2a - y1a)
             elif i == 2:  # bottom left
                 x1a, y1a, x2a, y2a = max(xc - w, 0), yc, xc, min(s * 2, yc + h)
-                x1b, y1b, x2b, y2b = w - (x2a - x1a), 0, w, min(y2a - y1a, h)
+                x1b, y1b = w - (x2a - x1a), 0
             elif i == 3:  # bottom right
                 x1a, y1a, x2a, y2a = xc, yc, min(xc + w, s * 2), min(s * 2, yc + h)
-                x1b, y1b, x2b, y2b = 0, 0, min(w, x2a - x1a), min(y2a - y1a, h)
-
-            img4[y1a:y2a, x1a:x2a] = img[y1b:y2b, x1b:x2b]  # img4[ymin:ymax, xmin:xmax]
-            padw = x1a - x1b
-            padh = y1a - y1b
-
-            # Labels
-            labels, segments = self.labels[index].copy(), self.segments[index].copy()
-            if labels.size:
-                labels[:, 1:] = xywhn2xyxy(labels[:, 1:], w, h, padw, padh)  # normalized xywh to pixel xyxy format
-                segments = [xyn2xy(x, w, h, padw, padh) for x in segments]
-            labels4.append(labels)
-            segments4.extend(segments)
-
-        # Concat/clip labels
-        labels4 = np.concatenate(labels4, 0)
-        for x in (labels4[:, 1:], *segments4):
-            np.clip(x, 0, 2 * s, out=x)  # clip when using random_perspective()
-        # img4, labels4 = replicate(img4, labels4)  # replicate
+                x1b, y1b = 0, 0
 
-        # Augment
-        img4, labels4, segments4 = copy_paste(img4, labels4, segments4, p=self.hyp["copy_paste"])
-        img4, labels4 = random_perspective(
-            img4,
-            labels4,
-            segments4,
-            degrees=self.hyp["degrees"],
-            translate=self.hyp["translate"],
-            scale=self.hyp["scale"],
-            shear=self.hyp["shear"],
-            perspective=self.hyp["perspective"],
-            border=self.mosaic_border,
-        )  # border to remove
-
-        return img4, labels4
+            tiles.append((index, img, (x1a, y1a, x2a, y2a), (x1a - x1b, y1a - y1b)))  # index, img, xyxy (large), pad
+
+        return self.warp_mosaic(tiles)
 
     def load_mosaic9(self, index):
         """Loads 1 image + 8 random images into a 9-image mosaic for augmented YOLOv5 training, returning labels and
         segments.
         """
-        labels9, segments9 = [], []
+        tiles = []
         s = self.img_size
         indices = [index] + random.choices(self.indices, k=8)  # 8 additional image indices
         random.shuffle(indices)
@@ -952,7 +1495,6 @@ class LoadImagesAndLabels(Dataset):
 
             # place img in img9
             if i == 0:  # center
-                img9 = np.full((s * 3, s * 3, img.shape[2]), 114, dtype=np.uint8)  # base image with 4 tiles
                 h0, w0 = h, w
                 c = s, s, s + w, s + h  # xmin, ymin, xmax, ymax (base) coordinates
             elif i == 1:  # top
@@ -972,51 +1514,85 @@ class LoadImagesAndLabels(Dataset):
             elif i == 8:  # top left
                 c = s - w, s + h0 - hp - h, s, s + h0 - hp
 
-            padx, pady = c[:2]
-            x1, y1, x2, y2 = (max(x, 0) for x in c)  # allocate coords
-
-            # Labels
-            labels, segments = self.labels[index].copy(), self.segments[index].copy()
-            if labels.size:
-                labels[:, 1:] = xywhn2xyxy(labels[:, 1:], w, h, padx, pady)  # normalized xywh to pixel xyxy format
-                segments = [xyn2xy(x, w, h, padx, pady) for x in segments]
-            labels9.append(labels)
-            segments9.extend(segments)
-
-            # Image
-            img9[y1:y2, x1:x2] = img[y1 - pady :, x1 - padx :]  # img9[ymin:ymax, xmin:xmax]
+            tiles.append((index, img, c))
             hp, wp = h, w  # height, width previous
 
         # Offset
         yc, xc = (int(random.uniform(0, s)) for _ in self.mosaic_border)  # mosaic center x, y
-        img9 = img9[yc : yc + 2 * s, xc : xc + 2 * s]
+        for i, (index, img, c) in enumerate(tiles):  # crop the 3s x 3s layout to the 2s x 2s mosaic at xc, yc
+            x1, y1, x2, y2 = (min(max(x, 0) - o, 2 * s) for x, o in zip(c, (xc, yc, xc, yc)))
+            tiles[i] = index, img, (max(x1, 0), max(y1, 0), x2, y2), (c[0] - xc, c[1] - yc)
+
+        return self.warp_mosaic(tiles)
 
-        # Concat/clip labels
-        labels9 = np.concatenate(labels9, 0)
-        labels9[:, [1, 3]] -= xc
-        labels9[:, [2, 4]] -= yc
-        c = np.array([xc, yc])  # centers
-        segments9 = [x - c for x in segments9]
+    def mosaic_labels(self, tiles):
+        """Returns labels [cls, xyxy] and segments of all mosaic `tiles` in mosaic pixels, transformed as one array
+        each.
+        """
+        s = self.img_size
+        labels = [self.labels[t[0]] for t in tiles]
+        wh = np.array([(t[1].shape[1], t[1].shape[0]) for t in tiles])  # tile sizes
+        pad = np.array([t[3] for t in tiles])
+        n = [len(x) for x in labels]
+        labels = np.concatenate(labels, 0)  # copy
+        labels[:, 1:] = xywhn2xyxy(labels[:, 1:], *np.repeat(wh, n, 0).T, *np.repeat(pad, n, 0).T)
+        np.clip(labels[:, 1:], 0, 2 * s, out=labels[:, 1:])  # clip when using random_perspective()
+
+        polygons = [self.segments[t[0]] if k else [] for t, k in zip(tiles, n)]
+        segments = [x for p in polygons for x in p]
+        if segments:
+            m = [len(x) for x in segments]  # points per polygon
+            k = np.repeat(np.repeat(np.arange(len(tiles)), [len(p) for p in polygons]), m)  # tile of each point
+            xy = np.concatenate(segments, 0) * wh[k] + pad[k]
+            np.clip(xy, 0, 2 * s, out=xy)
+            segments = np.split(xy, np.cumsum(m)[:-1])
+        return labels, segments
+
+    def mosaic_canvas(self, tiles):
+        """Copies mosaic `tiles` into this worker's reused 2s x 2s canvas and returns it."""
+        s = self.img_size
+        if getattr(self, "canvas", None) is None or self.canvas.shape[0] != 2 * s:
+            self.canvas = np.empty((2 * s, 2 * s, 3), dtype=np.uint8)
+        img = self.canvas
+        img.fill(114)
+        for _, im, (x1, y1, x2, y2), (padw, padh) in tiles:
+            if x2 > x1 and y2 > y1:
+                img[y1:y2, x1:x2] = im[y1 - padh : y2 - padh, x1 - padw : x2 - padw]  # img[ymin:ymax, xmin:xmax]
+        return img
+
+    def warp_mosaic(self, tiles):
+        """
+        Assembles mosaic `tiles` of (index, img, xyxy in mosaic, pad) and applies copy_paste() and random_perspective().
 
-        for x in (labels9[:, 1:], *segments9):
-            np.clip(x, 0, 2 * s, out=x)  # clip when using random_perspective()
-        # img9, labels9 = replicate(img9, labels9)  # replicate
+        Scale and translation (the default hyperparameters) are warped tile by tile straight into the output, each
+        output pixel taking its nearest tile, so the 2s x 2s mosaic is never materialized. Rotation, shear, perspective
+        and copy-paste warp a reused canvas instead.
+        """
+        hyp, s = self.hyp, self.img_size
+        labels, segments = self.mosaic_labels(tiles)
+        # img4, labels4 = replicate(img4, labels4)  # replicate
 
         # Augment
-        img9, labels9, segments9 = copy_paste(img9, labels9, segments9, p=self.hyp["copy_paste"])
-        img9, labels9 = random_perspective(
-            img9,
-            labels9,
-            segments9,
-            degrees=self.hyp["degrees"],
-            translate=self.hyp["translate"],
-            scale=self.hyp["scale"],
-            shear=self.hyp["shear"],
-            perspective=self.hyp["perspective"],
-            border=self.mosaic_border,
-        )  # border to remove
-
-        return img9, labels9
+        kw = {k: hyp[k] for k in ("degrees", "translate", "scale", "shear", "perspective")}
+        if hyp["copy_paste"] and segments:
+            img, labels, segments = copy_paste(self.mosaic_canvas(tiles), labels, segments, p=hyp["copy_paste"])
+            return random_perspective(img, labels, segments, **kw, border=self.mosaic_border)  # border to remove
+
+        M, scale, (h, w) = random_perspective_matrix((2 * s, 2 * s), **kw, border=self.mosaic_border)
+        if kw["perspective"]:
+            img = cv2.warpPerspective(self.mosaic_canvas(tiles), M, dsize=(w, h), borderValue=(114, 114, 114))
+        elif M[0, 1] or M[1, 0]:  # rotation or shear
+            img = cv2.warpAffine(self.mosaic_canvas(tiles), M[:2], dsize=(w, h), borderValue=(114, 114, 114))
+        else:
+            img = np.full((h, w, 3), 114, dtype=np.uint8)
+            (sx, _, tx), (_, sy, ty) = M[:2]
+            for _, im, (x1, y1, x2, y2), (padw, padh) in tiles:
+                x1, x2 = (min(max(math.ceil(sx * (x - 0.5) + tx), 0), w) for x in (x1, x2))  # output pixels
+                y1, y2 = (min(max(math.ceil(sy * (y - 0.5) + ty), 0), h) for y in (y1, y2))
+                if x2 > x1 and y2 > y1:
+                    A = np.array([[sx, 0, sx * padw + tx - x1], [0, sy, sy * padh + ty - y1]])
+                    cv2.warpAffine(im, A, (x2 - x1, y2 - y1), dst=img[y1:y2, x1:x2], borderMode=cv2.BORDER_REPLICATE)
+        return img, warp_labels(labels, segments, M, scale, (h, w), kw["perspective"])
 
     @staticmethod
     def collate_fn(batch):
@@ -1055,7 +1631,179 @@ class LoadImagesAndLabels(Dataset):
         return torch.stack(im4, 0), torch.cat(label4, 0), path4, shapes4
 
 
+class LoadImagesAndLabelsShards(LoadImagesAndLabels, IterableDataset):
+    """
+    Streams a dataset packed by pack_dataset_shards() with sequential reads, for network filesystems and spinning disks.
+
+    Each epoch the shard order is shuffled (identically on all ranks via set_epoch()) and every DDP rank and DataLoader
+    worker reads one contiguous slice of the resulting image sequence, so each image is used exactly once per epoch
+    (except up to WORLD_SIZE - 1 dropped to keep ranks equal). Worker slices are whole batches, with the remainder in
+    one worker only, so a rank yields len(DataLoader) batches. Samples pass through a per-worker shuffle buffer of
+    encoded images that also provides the partner images for mosaic and mixup. Labels and shapes come from the
+    memory-mapped shard index, so `labels`, `shapes` and `n` are available for AutoAnchor and class weights as with
+    LoadImagesAndLabels.
+    """
+
+    def __init__(
+        self,
+        path,
+        img_size=640,
+        batch_size=16,
+        augment=False,
+        hyp=None,
+        single_cls=False,
+        stride=32,
+        pad=0.0,
+        prefix="",
+        rank=-1,
+        seed=0,
+        decoder="cv2",
+        batch_augment=False,
+        buffer_size=1000,
+    ):
+        """Initializes the shard stream for images at `path`, packing shards next to them if not yet present."""
+        self.path = shards_dir(path)
+        if not (self.path / "index.cache").exists():
+            pack_dataset_shards(path, self.path, prefix=prefix)
+        x = self.load_label_cache(self.path / "index.cache", self.cache_version)
+        assert x is not None and "shard_sizes" in x, f"{prefix}Invalid shard index in {self.path}, delete it to re-pack"
+        self.shards, self.shard_sizes = x["shards"], x["shard_sizes"]
+        self.im_files = x["im_files"].tolist()
+        self.labels, self.segments, self.shapes = x["labels"], x["segments"], np.array(x["shapes"])
+        if single_cls:  # single-class training, merge all classes into 0
+            self.labels = self.labels.compact()
+            self.labels.data[:, 0] = 0
+        self.n = len(self.im_files)
+        self.indices = np.arange(self.n)
+        self.img_size = img_size
+        self.batch_size = batch_size
+        self.augment = augment
+        self.hyp = hyp
+        self.image_weights = False
+        self.rect = False
+        self.mosaic = self.augment  # load 4 images at a time into a mosaic (only during training)
+        self.mosaic_border = [-img_size // 2, -img_size // 2]
+        self.stride = stride
+        self.decoder = decoder
+        self.batch_augment = batch_augment
+        self.albumentations = Albumentations(size=img_size) if augment else None
+        self.rank = max(rank, 0)
+        self.world_size = WORLD_SIZE if rank != -1 else 1
+        self.seed = seed
+        self.epoch = 0
+        self.buffer_size = buffer_size
+        LOGGER.info(f"{prefix}Streaming {self.n} images from {len(self.shards)} shards in {self.path}")
+
+    def __len__(self):
+        """Returns the number of samples per epoch on this rank (equal on all ranks)."""
+        return self.n // self.world_size
+
+    def set_epoch(self, epoch):
+        """Sets the epoch used to seed the shard order, call before iterating each epoch."""
+        self.epoch = epoch
+
+    def __iter__(self):
+        """Yields this worker's contiguous slice of the epoch's shuffled shard sequence through a shuffle buffer."""
+        info = torch.utils.data.get_worker_info()
+        wid, nw = (info.id, info.num_workers) if info else (0, 1)
+        order = random.Random(self.seed + self.epoch).sample(range(len(self.shards)), len(self.shards))  # all ranks
+        n = len(self)  # samples per rank
+        nb, r = divmod(n, self.batch_size)  # full batches per rank, samples of the partial batch
+        quotas = [(nb // nw + (w < nb % nw)) * self.batch_size + (w == nb % nw) * r for w in range(nw)]  # per worker
+        quota = quotas[wid]
+        start = self.rank * n + sum(quotas[:wid])  # first sample of this worker in the epoch sequence
+        rng = random.Random((self.seed + self.epoch) * 1000 + self.rank * nw + wid)
+
+        def stream():
+            """Yields this worker's slice of the epoch as (index, encoded image) from sequential tar reads."""
+            p = 0  # position in the epoch sequence
+            for j in order:
+                if p < start + quota and p + self.shard_sizes[j] > start:  # shard overlaps this worker's slice
+                    with tarfile.open(self.path / self.shards[j]) as tar:  # seeks past records before the slice
+                        for q, m in enumerate(tar, p):
+                            if q >= start + quota:
+                                break
+                            if q >= start:
+                                yield int(m.name.split(".")[0]), tar.extractfile(m).read()
+                p += self.shard_sizes[j]
+
+        size = min(self.buffer_size, quota)
+        buffer = copy(self)  # LoadImagesAndLabels.__getitem__() view over buffered samples
+        buffer.ims, buffer.labels, buffer.segments, buffer.im_files = ([None] * size for _ in range(4))
+        buffer.shapes = np.zeros((size, 2), dtype=self.shapes.dtype)
+        buffer.indices = np.arange(size)
+        records = stream()
+
+        def put(s, record):
+            """Stores an (index, encoded image) `record` in buffer slot `s`."""
+            i, buffer.ims[s] = record
+            buffer.labels[s], buffer.segments[s] = self.labels[i], self.segments[i]
+            buffer.im_files[s], buffer.shapes[s] = self.im_files[i], self.shapes[i]
+
+        for s in range(size):  # fill
+            put(s, next(records))
+        for _ in range(quota - size):  # yield a random slot, then refill it from the stream
+            s = rng.randrange(size)
+            yield buffer[s]
+            put(s, next(records))
+        for s in rng.sample(range(size), size):  # drain
+            yield buffer[s]
+
+    def load_image(self, i):
+        """Decodes buffered image `i`, returning (im, hw_original, hw_resized) like LoadImagesAndLabels.load_image()."""
+        im, hw0 = decode_image(self.ims[i], self.img_size, self.decoder, self.shapes[i])  # BGR
+        assert im is not None, f"Image Not Decoded {self.im_files[i]}"
+        return self.resize_image(im, hw0)
+
+
+def shards_dir(path):
+    """Returns the packed shards directory for a dataset `path`, i.e. 'images/train2017' -> 'images/train2017_shards'."""
+    p = Path(path[0] if isinstance(path, list) else path)
+    return p.with_name(f"{p.stem}_shards")
+
+
 # Ancillary functions --------------------------------------------------------------------------------------------------
+def pack_dataset_shards(path=DATASETS_DIR / "coco128/images/train2017", save_dir=None, shard_size=1 << 30, prefix=""):
+    """
+    Packs a YOLO-format dataset into tar shards of encoded images (~`shard_size` bytes each) plus a label index.
+
+    Images keep their original encoding and are named by dataset index ('00000042.jpg'), the index (index.cache) is a
+    label cache as written by LoadImagesAndLabels.save_label_cache() with the shard list added.
+    Usage: from utils.dataloaders import *; pack_dataset_shards('../datasets/coco128/images/train2017')
+    """
+    dataset = LoadImagesAndLabels(path, prefix=prefix)  # verified labels and shapes
+    save_dir = Path(save_dir or shards_dir(path))
+    save_dir.mkdir(parents=True, exist_ok=True)
+    shards, sizes, tar, b = [], [], None, 0
+    pbar = tqdm(dataset.im_files, desc=f"{prefix}Packing shards to {save_dir}", bar_format=TQDM_BAR_FORMAT)
+    for i, f in enumerate(pbar):
+        if tar is None or b >= shard_size:  # start a new shard
+            if tar:
+                tar.close()
+            shards.append(f"shard-{len(shards):05d}.tar")
+            sizes.append(0)
+            tar, b = tarfile.open(save_dir / shards[-1], "w"), 0
+        info = tar.gettarinfo(f, arcname=f"{i:08d}{Path(f).suffix.lower()}")
+        with open(f, "rb") as fi:
+            tar.addfile(info, fi)
+        b += info.size
+        sizes[-1] += 1
+    tar.close()
+    x = {
+        "im_files": np.array(dataset.im_files),
+        "shapes": dataset.shapes,
+        "labels": RaggedArray.from_list(list(dataset.labels)),
+        "segments": RaggedArray.from_list(list(dataset.segments), shape=(0, 2), nested=True),
+        "shards": shards,
+        "shard_sizes": sizes,  # images per shard
+        "version": dataset.cache_version,
+        **{k: np.zeros(0) for k in ("stats", "valid", "counts")},  # label cache fields unused by shards
+    }
+    LoadImagesAndLabels.save_label_cache(save_dir / "index.cache", x)
+    LOGGER.info(f"{prefix}Packed {len(dataset.im_files)} images into {len(shards)} shards in {save_dir}")
+    return save_dir
+
+
 def flatten_recursive(path=DATASETS_DIR / "coco128"):
     """Flattens a directory by copying all files from subdirectories to a new top-level directory, preserving
     filenames.
@@ -3,6 +3,7 @@
 
 import contextlib
 import glob
+import hashlib
 import inspect
 import logging
 import logging.config
@@ -185,6 +186,7 @@ def user_config_dir(dir="Ultralytics", env_var="YOLOV5_CONFIG_DIR"):
 
 
 CONFIG_DIR = user_config_dir()  # Ultralytics settings dir
+BACKEND_CACHE_DIR = Path(os.getenv("YOLOv5_BACKEND_CACHE_DIR", CONFIG_DIR / "backend_cache"))  # optimized model cache
 
 
 class Profile(contextlib.ContextDecorator):
@@ -339,6 +341,16 @@ def file_size(path):
         return 0.0
 
 
+def file_hash(*args, path=None):
+    """Returns a SHA-256 hex digest of file `path` contents (if given) combined with the string form of `args`."""
+    h = hashlib.sha256(str(args).encode())
+    if path:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):  # 1 MiB chunks
+                h.update(chunk)
+    return h.hexdigest()
+
+
 def check_online():
     """Checks internet connectivity by attempting to create a connection to "1.1.1.1" on port 443, retries once if the
     first attempt fails.
@@ -447,6 +459,11 @@ def check_img_size(imgsz, s=32, floor=0):
     return new_size
 
 
+def multi_scale_sizes(imgsz, s=32, n=5):
+    """Returns up to `n` image sizes evenly spaced over `imgsz` +/- 50%, rounded to multiples of stride `s`."""
+    return sorted({max(round(x / s) * s, int(s)) for x in np.linspace(imgsz * 0.5, imgsz * 1.5, n)})
+
+
 def check_imshow(warn=False):
     """Checks environment support for image display; warns on failure if `warn=True`."""
     try:
@@ -1018,6 +1035,7 @@ def non_max_suppression(
     labels=(),
     max_det=300,
     nm=0,  # number of masks
+    time_limit=None,  # seconds to quit after, default 0.5 + 0.05 * batch size
 ):
     """
     Non-Maximum Suppression (NMS) on inference results to reject overlapping detections.
@@ -1043,7 +1061,7 @@ def non_max_suppression(
     # min_wh = 2  # (pixels) minimum box width and height
     max_wh = 7680  # (pixels) maximum box width and height
     max_nms = 30000  # maximum number of boxes into torchvision.ops.nms()
-    time_limit = 0.5 + 0.05 * bs  # seconds to quit after
+    time_limit = 0.5 + 0.05 * bs if time_limit is None else time_limit  # seconds to quit after
     redundant = True  # require redundant detections
     multi_label &= nc > 1  # multiple labels per box (adds 0.5ms/img)
     merge = False  # use merge-NMS
@@ -1142,8 +1160,10 @@ def strip_optimizer(f="best.pt", s=""):
     LOGGER.info(f"Optimizer stripped from {f},{f' saved as {s},' if s else ''} {mb:.1f}MB")
 
 
-def print_mutation(keys, results, hyp, save_dir, bucket, prefix=colorstr("evolve: ")):
-    """Logs evolution results and saves to CSV and YAML in `save_dir`, optionally syncs with `bucket`."""
+def print_mutation(keys, results, hyp, save_dir, bucket, prefix=colorstr("evolve: "), data=None):
+    """Logs evolution results and saves to CSV and YAML in `save_dir`, optionally syncs with `bucket`; `data` is an
+    optional list of all evolve.csv rows so far, appended to and used instead of re-reading evolve.csv.
+    """
     evolve_csv = save_dir / "evolve.csv"
     evolve_yaml = save_dir / "hyp_evolve.yaml"
     keys = tuple(keys) + tuple(hyp.keys())  # [results + hyps]
@@ -1163,11 +1183,17 @@ def print_mutation(keys, results, hyp, save_dir, bucket, prefix=colorstr("evolve
         f.write(s + ("%20.5g," * n % vals).rstrip(",") + "\n")
 
     # Save yaml
+    if data is None or bucket:  # bucket may add rows from other machines
+        rows = pd.read_csv(evolve_csv, skipinitialspace=True).values.tolist()
+        if data is not None:
+            data[:] = rows
+    else:
+        data.append([float(f"{x:.5g}") for x in vals])  # as written to evolve.csv
+        rows = data
     with open(evolve_yaml, "w") as f:
-        data = pd.read_csv(evolve_csv, skipinitialspace=True)
-        data = data.rename(columns=lambda x: x.strip())  # strip keys
-        i = np.argmax(fitness(data.values[:, :4]))  #
-        generations = len(data)
+        rows = np.array(rows)
+        i = np.argmax(fitness(rows[:, :4]))  #
+        generations = len(rows)
         f.write(
             "# YOLOv5 Hyperparameter Evolution Results\n"
             + f"# Best generation: {i}\n"
@@ -1176,10 +1202,10 @@ def print_mutation(keys, results, hyp, save_dir, bucket, prefix=colorstr("evolve
             + ", ".join(f"{x.strip():>20s}" for x in keys[:7])
             + "\n"
             + "# "
-            + ", ".join(f"{x:>20.5g}" for x in data.values[i, :7])
+            + ", ".join(f"{x:>20.5g}" for x in rows[i, :7])
             + "\n\n"
         )
-        yaml.safe_dump(data.loc[i][7:].to_dict(), f, sort_keys=False)
+        yaml.safe_dump({k: float(v) for k, v in zip(keys[7:], rows[i, 7:])}, f, sort_keys=False)
 
     # Print to screen
     LOGGER.info(
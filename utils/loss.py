@@ -135,6 +135,9 @@ class ComputeLoss:
         self.nl = m.nl  # number of layers
         self.anchors = m.anchors
         self.device = device
+        self.g = 0.5  # bias
+        self.off = torch.tensor([[0, 0], [1, 0], [0, 1], [-1, 0], [0, -1]], device=device).float() * self.g  # j,k,l,m
+        self.grids = {}  # grid wh per feature map shapes
 
     def __call__(self, p, targets):  # predictions, targets
         """Performs forward pass, calculating class, box, and object loss for given predictions and targets."""
@@ -197,63 +200,46 @@ class ComputeLoss:
         """Prepares model targets from input targets (image,class,x,y,w,h) for loss computation, returning class, box,
         indices, and anchors.
         """
-        na, nt = self.na, targets.shape[0]  # number of anchors, targets
-        tcls, tbox, indices, anch = [], [], [], []
-        gain = torch.ones(7, device=self.device)  # normalized to gridspace gain
-        ai = torch.arange(na, device=self.device).float().view(na, 1).repeat(1, nt)  # same as .repeat_interleave(nt)
-        targets = torch.cat((targets.repeat(na, 1, 1), ai[..., None]), 2)  # append anchor indices
-
-        g = 0.5  # bias
-        off = (
-            torch.tensor(
-                [
-                    [0, 0],
-                    [1, 0],
-                    [0, 1],
-                    [-1, 0],
-                    [0, -1],  # j,k,l,m
-                    # [1, 1], [1, -1], [-1, 1], [-1, -1],  # jk,jm,lk,lm
-                ],
-                device=self.device,
-            ).float()
-            * g
-        )  # offsets
-
-        for i in range(self.nl):
-            anchors, shape = self.anchors[i], p[i].shape
-            gain[2:6] = torch.tensor(shape)[[3, 2, 3, 2]]  # xyxy gain
-
-            # Match targets to anchors
-            t = targets * gain  # shape(3,n,7)
-            if nt:
-                # Matches
-                r = t[..., 4:6] / anchors[:, None]  # wh ratio
-                j = torch.max(r, 1 / r).max(2)[0] < self.hyp["anchor_t"]  # compare
-                # j = wh_iou(anchors, t[:, 4:6]) > model.hyp['iou_t']  # iou(3,n)=wh_iou(anchors(3,2), gwh(n,2))
-                t = t[j]  # filter
-
-                # Offsets
-                gxy = t[:, 2:4]  # grid xy
-                gxi = gain[[2, 3]] - gxy  # inverse
-                j, k = ((gxy % 1 < g) & (gxy > 1)).T
-                l, m = ((gxi % 1 < g) & (gxi > 1)).T
-                j = torch.stack((torch.ones_like(j), j, k, l, m))
-                t = t.repeat((5, 1, 1))[j]
-                offsets = (torch.zeros_like(gxy)[None] + off[:, None])[j]
-            else:
-                t = targets[0]
-                offsets = 0
-
-            # Define
-            bc, gxy, gwh, a = t.chunk(4, 1)  # (image, class), grid xy, grid wh, anchors
-            a, (b, c) = a.long().view(-1), bc.long().T  # anchors, image, class
-            gij = (gxy - offsets).long()
-            gi, gj = gij.T  # grid indices
-
-            # Append
-            indices.append((b, a, gj.clamp_(0, shape[2] - 1), gi.clamp_(0, shape[3] - 1)))  # image, anchor, grid
-            tbox.append(torch.cat((gxy - gij, gwh), 1))  # box
-            anch.append(anchors[a])  # anchors
-            tcls.append(c)  # class
-
+        na, nt, nl = self.na, targets.shape[0], self.nl  # number of anchors, targets, layers
+        shapes = tuple(x.shape[2:4] for x in p)
+        if shapes not in self.grids:  # (nl, 2) grid wh of each layer, reused while input size stays the same
+            self.grids[shapes] = torch.tensor([[s[1], s[0]] for s in shapes], device=self.device).float()
+        wh = self.grids[shapes]
+
+        # Match targets to anchors and neighbour cells of all layers at once, (layer, offset, anchor, target) order
+        gxy = targets[:, 2:4] * wh[:, None]  # (nl, nt, 2) grid xy
+        gwh = targets[:, 4:6] * wh[:, None]  # grid wh
+        r = gwh[:, None] / self.anchors[:, :, None]  # (nl, na, nt, 2) wh ratio
+        j = torch.max(r, 1 / r).max(3)[0] < self.hyp["anchor_t"]  # compare
+        # j = wh_iou(anchors, t[:, 4:6]) > model.hyp['iou_t']  # iou(3,n)=wh_iou(anchors(3,2), gwh(n,2))
+        gxi = wh[:, None] - gxy  # inverse
+        jk = (gxy % 1 < self.g) & (gxy > 1)
+        lm = (gxi % 1 < self.g) & (gxi > 1)
+        o = torch.cat((torch.ones_like(jk[..., :1]), jk, lm), 2).permute(0, 2, 1)  # (nl, 5, nt) j,k,l,m
+        mask = j[:, None] & o[:, :, None]  # (nl, 5, na, nt)
+
+        # Indices of matches
+        if mask.device.type == "cpu":
+            li, oi, a, t = mask.nonzero().T  # layer, offset, anchor, target
+            n = torch.bincount(li, minlength=nl).tolist()  # targets per layer
+        else:  # without a host sync besides the per-layer counts
+            mask = mask.reshape(-1)
+            n = mask.view(nl, -1).sum(1).tolist()  # targets per layer
+            pos = (mask.cumsum(0) - 1).masked_fill_(~mask, sum(n))  # output position, sum(n) for discarded rows
+            i = torch.empty(sum(n) + 1, dtype=torch.long, device=self.device)
+            i = i.scatter_(0, pos, torch.arange(len(mask), device=self.device))[:-1]
+            i, t = i.div(nt, rounding_mode="floor"), i % nt  # (layer, offset, anchor), target
+            i, a = i.div(na, rounding_mode="floor"), i % na  # (layer, offset), anchor
+            li, oi = i.div(5, rounding_mode="floor"), i % 5  # layer, offset
+
+        # Define
+        b, c = targets[t, :2].long().T  # image, class
+        gxy, gwh = gxy[li, t], gwh[li, t]  # grid xy, grid wh
+        gij = torch.minimum((gxy - self.off[oi]).long(), wh[li].long() - 1).clamp_(0)
+        gi, gj = gij.T  # grid indices
+
+        tcls = c.split(n)  # class
+        tbox = torch.cat((gxy - gij, gwh), 1).split(n)  # box
+        indices = list(zip(*(x.split(n) for x in (b, a, gj, gi))))  # image, anchor, grid
+        anch = self.anchors[li, a].split(n)  # anchors
         return tcls, tbox, indices, anch
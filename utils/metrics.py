@@ -1,6 +1,7 @@
 # Ultralytics YOLOv5 🚀, AGPL-3.0 license
 """Model validation metrics."""
 
+import json
 import math
 import warnings
 from pathlib import Path
@@ -8,6 +9,7 @@ from pathlib import Path
 import matplotlib.pyplot as plt
 import numpy as np
 import torch
+import torch.distributed as dist
 
 from utils import TryExcept, threaded
 
@@ -41,41 +43,57 @@ def ap_per_class(tp, conf, pred_cls, target_cls, plot=False, save_dir=".", names
     # Returns
         The average precision as computed in py-faster-rcnn.
     """
-    # Sort by objectness
-    i = np.argsort(-conf)
-    tp, conf, pred_cls = tp[i], conf[i], pred_cls[i]
-
     # Find unique classes
     unique_classes, nt = np.unique(target_cls, return_counts=True)
-    nc = unique_classes.shape[0]  # number of classes, number of detections
 
-    # Create Precision-Recall curve and compute AP for each class
+    # Sort by class and objectness, dropping predictions of classes without labels
+    i = np.isin(pred_cls, unique_classes)
+    tp, conf, pred_cls = tp[i], conf[i], pred_cls[i]
+    i = np.lexsort((-conf, pred_cls))
+    ci = np.searchsorted(unique_classes, pred_cls[i])  # class index of each prediction
+    n = np.ones(len(i), dtype=int)  # one prediction per point
+    return ap_per_class_sorted(tp[i], n, conf[i], ci, nt, unique_classes, plot, save_dir, names, eps, prefix)
+
+
+def ap_per_class_sorted(tp, n, conf, ci, nt, unique_classes, plot=False, save_dir=".", names=(), eps=1e-16, prefix=""):
+    """
+    Computes ap_per_class() metrics for all classes at once from PR points sorted by class index and descending conf.
+
+    Each point adds `n` predictions of class `unique_classes[ci]` with `tp` (nx10) true positives at objectness `conf`:
+    one point per prediction for ap_per_class(), one per nonempty confidence bin for APStats histograms. `nt` counts
+    labels per class in `unique_classes`.
+    """
+    nc, niou = len(unique_classes), tp.shape[1]  # number of classes, IoU thresholds
     px, py = np.linspace(0, 1, 1000), []  # for plotting
-    ap, p, r = np.zeros((nc, tp.shape[1])), np.zeros((nc, 1000)), np.zeros((nc, 1000))
-    for ci, c in enumerate(unique_classes):
-        i = pred_cls == c
-        n_l = nt[ci]  # number of labels
-        n_p = i.sum()  # number of predictions
-        if n_p == 0 or n_l == 0:
-            continue
-
-        # Accumulate FPs and TPs
-        fpc = (1 - tp[i]).cumsum(0)
-        tpc = tp[i].cumsum(0)
-
-        # Recall
-        recall = tpc / (n_l + eps)  # recall curve
-        r[ci] = np.interp(-px, -conf[i], recall[:, 0], left=0)  # negative x, xp because xp decreases
-
-        # Precision
-        precision = tpc / (tpc + fpc)  # precision curve
-        p[ci] = np.interp(-px, -conf[i], precision[:, 0], left=1)  # p at pr_score
-
-        # AP from recall-precision curve
-        for j in range(tp.shape[1]):
-            ap[ci, j], mpre, mrec = compute_ap(recall[:, j], precision[:, j])
-            if plot and j == 0:
-                py.append(np.interp(px, mrec, mpre))  # precision at mAP@0.5
+    ap, p, r = np.zeros((nc, niou)), np.zeros((nc, 1000)), np.zeros((nc, 1000))
+    if len(ci):
+        # Accumulate TPs and predictions per class
+        first = np.r_[0, np.flatnonzero(np.diff(ci)) + 1]  # first point of each class with predictions
+        counts = np.diff(np.r_[first, len(ci)])  # points per class
+        c = ci[first]  # classes with predictions
+        tpc, npc = tp.cumsum(0), n.cumsum(0)
+        tpc = tpc - np.repeat(tpc[first] - tp[first], counts, 0)
+        npc = npc - np.repeat(npc[first] - n[first], counts, 0)
+
+        # Recall and precision curves
+        recall = tpc / (nt[ci, None] + eps)  # recall curve
+        precision = tpc / npc[:, None]  # precision curve
+        r[c] = interp_grouped(-px, -conf, recall[:, 0], first, left=0)  # negative x, xp because xp decreases
+        p[c] = interp_grouped(-px, -conf, precision[:, 0], first, left=1)  # p at pr_score
+
+        # AP from recall-precision curves of all classes and IoU thresholds, with sentinel values around each curve
+        i = np.r_[first[1:], len(ci), first]  # ends before starts where they coincide (stable insert order)
+        mrec = np.insert(recall.T, i, np.r_[np.ones(len(c)), np.zeros(len(c))], axis=1)
+        mpre = np.insert(precision.T, i, np.r_[np.zeros(len(c)), np.ones(len(c))], axis=1)
+        g = np.arange(niou * len(c)).repeat(np.tile(counts + 2, niou))  # curve index of every point
+        v, k = np.unique(mpre, return_inverse=True)  # exact integer ranks of precision values
+        k = k.ravel() + (g[-1] - g) * len(v)  # rank offsets make the reversed running max restart at each curve
+        mpre = v[np.flip(np.maximum.accumulate(np.flip(k))) - (g[-1] - g) * len(v)]  # precision envelope
+        first = np.r_[0, np.flatnonzero(np.diff(g)) + 1]
+        x = np.linspace(0, 1, 101)  # 101-point interp (COCO)
+        ap[c] = np.trapz(interp_grouped(x, mrec.ravel(), mpre, first), x).reshape(niou, -1).T  # integrate
+        if plot:
+            py = list(interp_grouped(px, mrec[0], mpre[: mrec.shape[1]], first[: len(c)]))  # precision at mAP@0.5
 
     # Compute F1 (harmonic mean of precision and recall)
     f1 = 2 * p * r / (p + r + eps)
@@ -94,6 +112,106 @@ def ap_per_class(tp, conf, pred_cls, target_cls, plot=False, save_dir=".", names
     return tp, fp, p, r, f1, ap, unique_classes.astype(int)
 
 
+def interp_grouped(x, xp, fp, first, left=None):
+    """
+    Returns np.interp(x, xp, fp, left) for each curve of the concatenated `xp`, `fp` curves starting at indices `first`.
+
+    Curves are shifted apart in exact integer ranks of x values so that a single np.searchsorted() locates all queries,
+    shape (len(first), len(x)).
+    """
+    last = np.r_[first[1:], len(xp)] - 1
+    v, k = np.unique(np.r_[xp, x], return_inverse=True)  # exact integer ranks of x values
+    offset = np.arange(len(first)) * len(v)
+    j = np.searchsorted(k[: len(xp)] + np.repeat(offset, last - first + 1), k[len(xp) :] + offset[:, None], "right")
+    j = np.clip(j - 1, first[:, None], last[:, None] - 1)  # segment of each query
+    x0, x1, y0, y1 = xp[j], xp[j + 1], fp[j], fp[j + 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        y = np.where(x == x0, y0, (y1 - y0) / (x1 - x0) * (x - x0) + y0)
+    y = np.where(x < xp[first, None], fp[first, None] if left is None else left, y)  # before each curve
+    return np.where(x >= xp[last, None], fp[last, None], y)  # at or after each curve end
+
+
+class APStats:
+    """
+    Accumulates ap_per_class() inputs batch by batch, with results mergeable across processes and DDP ranks.
+
+    By default predictions are kept on the CPU and metrics equal ap_per_class() on all of them. With `bins`, predictions
+    stream into fixed per-class confidence histograms instead, for val sets too large to keep: memory stays at nc x bins
+    x niou counters however many predictions are added. Each nonempty bin is then one PR point, so histogram metrics
+    approximate ap_per_class() and are not comparable with exact ones. Predictions and labels of classes >= `nc` have
+    no effect on the metrics.
+    """
+
+    def __init__(self, nc, niou=10, bins=0, device=None):
+        """Initializes empty stats for `nc` classes and `niou` IoU thresholds, as histograms of `bins` confidence bins
+        if nonzero.
+        """
+        self.nc, self.bins = nc, bins
+        self.nt = torch.zeros(nc, dtype=torch.int32, device=device)  # labels per class
+        if bins:
+            self.tp = torch.zeros((nc, bins, niou), dtype=torch.int32, device=device)  # TPs per class, bin, IoU
+            self.n = torch.zeros((nc, bins), dtype=torch.int32, device=device)  # predictions per class, bin
+        else:
+            self.preds = []  # (tp, conf, pred_cls) arrays per update
+
+    def update(self, tp, conf, pred_cls, target_cls):
+        """Adds predictions with `tp` (nx10) true positives, `conf` and `pred_cls`, and labels of `target_cls`."""
+        t = target_cls.long().clamp(0, self.nc)  # classes >= nc counted in a dropped extra bin
+        self.nt += torch.bincount(t, minlength=self.nc + 1)[: self.nc].to(self.nt.dtype)
+        if not self.bins:
+            self.preds.append(tuple(x.cpu().numpy() for x in (tp, conf, pred_cls)))
+            return
+        c = pred_cls.long()
+        w = c < self.nc  # in-range predictions, others are added with zero weight
+        i = c.clamp(0, self.nc - 1) * self.bins + (conf * self.bins).long().clamp_(0, self.bins - 1)  # histogram index
+        self.n.view(-1).index_add_(0, i, w.to(self.n.dtype))
+        self.tp.view(-1, self.tp.shape[2]).index_add_(0, i, (tp & w[:, None]).to(self.tp.dtype))
+
+    def any(self):
+        """Returns True if any prediction is a true positive at any IoU threshold."""
+        return bool(self.tp.any()) if self.bins else any(x[0].any() for x in self.preds)
+
+    def merge(self, other):
+        """Adds the stats of another APStats of the same kind, e.g. from a different process, returning self."""
+        assert self.bins == other.bins, "can only merge APStats of equal bins"
+        self.nt += other.nt.to(self.nt.device)
+        if self.bins:
+            self.tp += other.tp.to(self.tp.device)
+            self.n += other.n.to(self.n.device)
+        else:
+            self.preds += other.preds
+        return self
+
+    def all_reduce(self):
+        """Combines the stats of all DDP ranks in place, returning self."""
+        if dist.is_available() and dist.is_initialized():
+            dist.all_reduce(self.nt)
+            if self.bins:
+                dist.all_reduce(self.tp)
+                dist.all_reduce(self.n)
+            else:
+                preds = [None] * dist.get_world_size()
+                dist.all_gather_object(preds, self.preds)
+                self.preds = [x for rank in preds for x in rank]
+        return self
+
+    def ap_per_class(self, plot=False, save_dir=".", names=(), eps=1e-16, prefix=""):
+        """Returns ap_per_class() results (tp, fp, p, r, f1, ap, unique_classes) from the accumulated stats."""
+        nt = self.nt.cpu().numpy()
+        if not self.bins:
+            tp, conf, pred_cls = (np.concatenate(x, 0) for x in zip(*self.preds))
+            target_cls = np.repeat(np.arange(self.nc), nt)
+            return ap_per_class(tp, conf, pred_cls, target_cls, plot, save_dir, names, eps, prefix)
+        tp, n = (x.cpu().numpy() for x in (self.tp, self.n))
+        unique_classes = np.flatnonzero(nt)
+        tp, n = tp[unique_classes, ::-1], n[unique_classes, ::-1]  # classes with labels, descending confidence
+        ci, b = np.nonzero(n)  # nonempty bins
+        conf = (self.bins - 1 - b) / self.bins  # bin lower edges
+        return ap_per_class_sorted(
+            tp[ci, b], n[ci, b], conf, ci, nt[unique_classes], unique_classes, plot, save_dir, names, eps, prefix
+        )
+
+
 def compute_ap(recall, precision):
     """Compute the average precision, given the recall and precision curves
     # Arguments
@@ -121,6 +239,156 @@ def compute_ap(recall, precision):
     return ap, mpre, mrec
 
 
+COCO_SUMMARY = (  # COCOeval.summarize() rows (AP=1 / AR=0, IoU threshold index, area range index, maxDets index)
+    (1, None, 0, 2),
+    (1, 0, 0, 2),
+    (1, 5, 0, 2),
+    (1, None, 1, 2),
+    (1, None, 2, 2),
+    (1, None, 3, 2),
+    (0, None, 0, 0),
+    (0, None, 0, 1),
+    (0, None, 0, 2),
+    (0, None, 1, 2),
+    (0, None, 2, 2),
+    (0, None, 3, 2),
+)
+
+
+def coco_evaluate(anno, image_id, category_id, bbox, score, img_ids=None):
+    """
+    Returns the 12 COCOeval bbox summary stats of detections `bbox` (n, 4 xywh) with `score`, `image_id` and
+    `category_id` against the COCO annotations `anno` (JSON path or dict), optionally restricted to `img_ids`.
+
+    Mirrors pycocotools evaluate() and accumulate() in numpy: greedy matching runs once per detection rank for all
+    images, categories, IoU thresholds and area ranges at once, and the results match COCOeval to float precision.
+    """
+    if not isinstance(anno, dict):
+        with open(anno) as f:
+            anno = json.load(f)
+    images = {x["id"] for x in anno["images"]}
+    if not images.issuperset(image_id):
+        raise ValueError("Results do not correspond to current coco set")
+    imgs = sorted(images if img_ids is None else set(img_ids))
+    cats = sorted(x["id"] for x in anno["categories"])
+    imap, cmap = {x: i for i, x in enumerate(imgs)}, {x: i for i, x in enumerate(cats)}
+    iou_thres = np.linspace(0.5, 0.95, 10)
+    rec_thres = np.linspace(0.0, 1.00, 101)
+    area_rng = np.array([[0, 1e5**2], [0, 32**2], [32**2, 96**2], [96**2, 1e5**2]])  # all, small, medium, large
+    max_dets = (1, 10, 100)
+    nt, na, nk = len(iou_thres), len(area_rng), len(cats)
+
+    # Labels, in image and category groups of annotation order
+    gt = [x for x in anno["annotations"] if x["image_id"] in imap and x["category_id"] in cmap]
+    gg = np.array([imap[x["image_id"]] * nk + cmap[x["category_id"]] for x in gt], dtype=np.int64)  # group
+    gb = np.array([x["bbox"] for x in gt], dtype=np.float64).reshape(-1, 4)
+    garea = np.array([x["area"] for x in gt], dtype=np.float64)
+    crowd = np.array([bool(x.get("iscrowd", 0)) for x in gt], dtype=bool)
+    i = np.argsort(gg, kind="stable")
+    gg, gb, garea, crowd = gg[i], gb[i], garea[i], crowd[i]
+    gign = crowd | (garea < area_rng[:, :1]) | (garea > area_rng[:, 1:])  # (na, ng) ignored labels
+
+    # Detections, in image and category groups of descending score, top max_dets[-1] of each group
+    keep = np.array([x in imap and y in cmap for x, y in zip(image_id, category_id)], dtype=bool)
+    dg = np.array(
+        [imap[x] * nk + cmap[y] for x, y in zip(image_id, category_id) if x in imap and y in cmap], dtype=np.int64
+    )
+    db = np.asarray(bbox, dtype=np.float64).reshape(-1, 4)[keep]
+    ds = np.asarray(score, dtype=np.float64)[keep]
+    i = np.lexsort((-ds, dg))
+    dg, db, ds = dg[i], db[i], ds[i]
+    first = np.r_[0, np.flatnonzero(np.diff(dg)) + 1]
+    rank = np.arange(len(dg)) - np.repeat(first, np.diff(np.r_[first, len(dg)]))  # rank in group
+    i = rank < max_dets[-1]
+    dg, db, ds, rank = dg[i], db[i], ds[i], rank[i]
+    dout = (db[:, 2] * db[:, 3] < area_rng[:, :1]) | (db[:, 2] * db[:, 3] > area_rng[:, 1:])  # (na, nd) outside area
+
+    # Detection-label pairs of the same group, in (rank, detection, label) order
+    start, end = np.searchsorted(gg, dg), np.searchsorted(gg, dg, "right")
+    n = end - start
+    pd = np.repeat(np.arange(len(dg)), n)
+    pos = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)  # label index in group
+    pg = start[pd] + pos
+    i = np.lexsort((pos, pd, rank[pd]))
+    pd, pg, pos = pd[i], pg[i], pos[i]
+    b1, b2 = db[pd], gb[pg]  # pycocotools bbIou()
+    w = np.minimum(b1[:, 0] + b1[:, 2], b2[:, 0] + b2[:, 2]) - np.maximum(b1[:, 0], b2[:, 0])
+    h = np.minimum(b1[:, 1] + b1[:, 3], b2[:, 1] + b2[:, 3]) - np.maximum(b1[:, 1], b2[:, 1])
+    inter = w * h
+    union = np.where(crowd[pg], b1[:, 2] * b1[:, 3], b1[:, 2] * b1[:, 3] + b2[:, 2] * b2[:, 3] - inter)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iou = np.where((w > 0) & (h > 0), inter / union, 0.0)
+
+    # Greedy matching, one detection rank at a time: best unmatched non-ignored label, ties to the last label
+    v, key = np.unique(iou, return_inverse=True)  # exact integer ranks of IoUs
+    npos = pos.max(initial=0) + 1
+    key = ((~gign[:, pg] * len(v) + key.reshape(-1)) * npos + pos + 1).astype(np.int64)  # (na, np) non-ignored first
+    thres = np.minimum(iou_thres, 1 - 1e-10)[:, None]
+    gtm = np.zeros((na, nt, len(gg)), dtype=bool)  # matched labels
+    dtm = np.zeros((na, nt, len(dg)), dtype=bool)  # matched detections
+    dtig = np.zeros((na, nt, len(dg)), dtype=bool)  # detections matched to ignored labels
+    bounds = np.searchsorted(rank[pd], np.arange(max_dets[-1] + 1))
+    for r in range(max_dets[-1]):
+        s = slice(*bounds[r : r + 2])
+        if s.start == s.stop:
+            break
+        d, g = pd[s], pg[s]
+        j = np.r_[0, np.flatnonzero(np.diff(d)) + 1]  # pairs of each detection
+        free = ~gtm[:, :, g] | crowd[g]
+        best = np.maximum.reduceat(np.where(free & (iou[s] >= thres), key[:, None, s], 0), j, axis=2)  # (na, nt, nd)
+        a, t, k = np.nonzero(best)
+        m = start[d[j[k]]] + (best[a, t, k] - 1) % npos  # matched labels
+        gtm[a, t, m] = True
+        dtm[a, t, d[j[k]]] = True
+        dtig[a, t, d[j[k]]] = gign[a, m]
+    dtig |= ~dtm & dout[:, None]
+
+    # Precision and recall of each category, area range and max detections as in COCOeval.accumulate()
+    precision = -np.ones((nt, len(rec_thres), nk, na, len(max_dets)))
+    recall = -np.ones((nt, nk, na, len(max_dets)))
+    npig = np.zeros((na, nk), dtype=np.int64)
+    np.add.at(npig, (np.nonzero(~gign)[0], gg[np.nonzero(~gign)[1]] % nk), 1)
+    dk, di = dg % nk, dg // nk
+    for mi, md in enumerate(max_dets):
+        i = np.flatnonzero(rank < md)
+        i = i[np.lexsort((rank[i], di[i], -ds[i], dk[i]))]  # stable descending score of each category
+        bounds = np.searchsorted(dk[i], np.arange(nk + 1))
+        for k in range(nk):
+            ik = i[bounds[k] : bounds[k + 1]]
+            for a in range(na):
+                if npig[a, k] == 0:
+                    continue
+                tps = dtm[a][:, ik] & ~dtig[a][:, ik]
+                fps = ~dtm[a][:, ik] & ~dtig[a][:, ik]
+                tp, fp = np.cumsum(tps, axis=1).astype(float), np.cumsum(fps, axis=1).astype(float)
+                rc = tp / npig[a, k]
+                pr = np.flip(np.maximum.accumulate(np.flip(tp / (fp + tp + np.spacing(1)), 1), 1), 1)  # envelope
+                recall[:, k, a, mi] = rc[:, -1] if len(ik) else 0
+                for t in range(nt):
+                    q = np.zeros(len(rec_thres))
+                    j = np.searchsorted(rc[t], rec_thres, side="left")
+                    q[j < len(ik)] = pr[t, j[j < len(ik)]]
+                    precision[t, :, k, a, mi] = q
+
+    # Summary
+    stats = np.zeros(len(COCO_SUMMARY))
+    for i, (ap, t, a, m) in enumerate(COCO_SUMMARY):
+        s = (precision[:, :, :, a, m] if ap else recall[:, :, a, m]) if t is None else precision[[t], :, :, a, m]
+        stats[i] = np.mean(s[s > -1]) if (s > -1).any() else -1
+    return stats
+
+
+def coco_summary(stats):
+    """Returns the COCOeval.summarize() printout of the 12 coco_evaluate() `stats`."""
+    s = []
+    for (ap, t, a, m), x in zip(COCO_SUMMARY, stats):
+        iou = "0.50:0.95" if t is None else f"{0.5 + 0.05 * t:0.2f}"
+        title, short = ("Average Precision", "(AP)") if ap else ("Average Recall", "(AR)")
+        area = ("all", "small", "medium", "large")[a]
+        s.append(f" {title:<18} {short} @[ IoU={iou:<9} | area={area:>6s} | maxDets={(1, 10, 100)[m]:>3d} ] = {x:0.3f}")
+    return "\n".join(s)
+
+
 class ConfusionMatrix:
     """Generates and visualizes a confusion matrix for evaluating object detection classification performance."""
 
@@ -131,7 +399,7 @@ class ConfusionMatrix:
         self.conf = conf
         self.iou_thres = iou_thres
 
-    def process_batch(self, detections, labels):
+    def process_batch(self, detections, labels, det_images=None, label_images=None):
         """
         Return intersection-over-union (Jaccard index) of boxes.
 
@@ -140,44 +408,44 @@ class ConfusionMatrix:
         Arguments:
             detections (Array[N, 6]), x1, y1, x2, y2, conf, class
             labels (Array[M, 5]), class, x1, y1, x2, y2
+            det_images (Array[N]), optional image index of each detection, to accumulate a whole batch at once
+            label_images (Array[M]), image index of each label, required with det_images
         Returns:
             None, updates confusion matrix accordingly
         """
+        nc = self.nc  # background index
         if detections is None:
-            gt_classes = labels.int()
-            for gc in gt_classes:
-                self.matrix[self.nc, gc] += 1  # background FN
+            self.matrix[nc] += np.bincount(labels.int().cpu().numpy(), minlength=nc + 1)  # background FN
             return
 
-        detections = detections[detections[:, 4] > self.conf]
-        gt_classes = labels[:, 0].int()
-        detection_classes = detections[:, 5].int()
+        i = detections[:, 4] > self.conf
+        detections = detections[i]
         iou = box_iou(labels[:, 1:], detections[:, :4])
-
-        x = torch.where(iou > self.iou_thres)
-        if x[0].shape[0]:
-            matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).cpu().numpy()
-            if x[0].shape[0] > 1:
-                matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
-                matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+        if det_images is None:  # single image
+            det_images = torch.zeros(len(detections), dtype=torch.long)
         else:
-            matches = np.zeros((0, 3))
-
-        n = matches.shape[0] > 0
-        m0, m1, _ = matches.transpose().astype(int)
-        for i, gc in enumerate(gt_classes):
-            j = m0 == i
-            if n and sum(j) == 1:
-                self.matrix[detection_classes[m1[j]], gc] += 1  # correct
-            else:
-                self.matrix[self.nc, gc] += 1  # true background
-
-        if n:
-            for i, dc in enumerate(detection_classes):
-                if not any(m1 == i):
-                    self.matrix[dc, self.nc] += 1  # predicted background
+            det_images = det_images[i]
+            iou *= label_images[:, None] == det_images  # labels only match detections of their own image
+        m0, m1 = torch.where(iou > self.iou_thres)
+        iou = iou[m0, m1]
+        gc, dc, images, m0, m1, iou = (
+            x.cpu().numpy() for x in (labels[:, 0].int(), detections[:, 5].int(), det_images, m0, m1, iou)
+        )
+
+        # Matches in descending IoU, keeping the best label of each detection, then the best detection of each label
+        k = np.argsort(iou, kind="stable")[::-1]
+        k = k[np.unique(m1[k], return_index=True)[1]]
+        k = k[np.argsort(iou[k], kind="stable")[::-1]]
+        k = k[np.unique(m0[k], return_index=True)[1]]
+        m0, m1 = m0[k], m1[k]
+
+        fn = np.ones(len(gc), dtype=bool)
+        fn[m0] = False  # unmatched labels
+        fp = np.isin(images, images[m1])  # predicted background is only counted in images with matches
+        fp[m1] = False  # unmatched detections
+        row = np.concatenate((dc[m1], np.full(fn.sum(), nc), dc[fp]))  # correct, true background, predicted background
+        col = np.concatenate((gc[m0], gc[fn], np.full(fp.sum(), nc)))
+        self.matrix += np.bincount(row * (nc + 1) + col, minlength=(nc + 1) ** 2).reshape(nc + 1, nc + 1)
 
     def tp_fp(self):
         """Calculates true positives (tp) and false positives (fp) excluding the background class from the confusion
@@ -7,10 +7,16 @@ import random
 import cv2
 import numpy as np
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, RandomSampler
 
 from ..augmentations import augment_hsv, copy_paste, letterbox
-from ..dataloaders import InfiniteDataLoader, LoadImagesAndLabels, SmartDistributedSampler, seed_worker
+from ..dataloaders import (
+    AspectRatioBatchSampler,
+    InfiniteDataLoader,
+    LoadImagesAndLabels,
+    SmartDistributedSampler,
+    seed_worker,
+)
 from ..general import LOGGER, xyn2xy, xywhn2xyxy, xyxy2xywhn
 from ..torch_utils import torch_distributed_zero_first
 from .augmentations import mixup, random_perspective
@@ -40,8 +46,8 @@ def create_dataloader(
     seed=0,
 ):
     """Creates a dataloader for training, validating, or testing YOLO models with various dataset options."""
-    if rect and shuffle:
-        LOGGER.warning("WARNING ⚠️ --rect is incompatible with DataLoader shuffle, setting shuffle=False")
+    if rect and shuffle and quad:
+        LOGGER.warning("WARNING ⚠️ --rect is incompatible with --quad DataLoader shuffle, setting shuffle=False")
         shuffle = False
     with torch_distributed_zero_first(rank):  # init dataset *.cache only once if DDP
         dataset = LoadImagesAndLabelsAndMasks(
@@ -60,6 +66,7 @@ def create_dataloader(
             downsample_ratio=mask_downsample_ratio,
             overlap=overlap_mask,
             rank=rank,
+            buckets=shuffle,
         )
 
     batch_size = min(batch_size, len(dataset))
@@ -69,12 +76,18 @@ def create_dataloader(
     loader = DataLoader if image_weights else InfiniteDataLoader  # only DataLoader allows for attribute updates
     generator = torch.Generator()
     generator.manual_seed(6148914691236517205 + seed + RANK)
+    batch_sampler = None
+    if dataset.rect and shuffle:  # shuffled rectangular batches
+        sampler = sampler or RandomSampler(dataset, generator=generator)
+        batch_sampler = AspectRatioBatchSampler(sampler, dataset.batch[dataset.indices], batch_size, seed)
+        sampler, batch_size, shuffle = None, 1, False
     return loader(
         dataset,
         batch_size=batch_size,
         shuffle=shuffle and sampler is None,
         num_workers=nw,
         sampler=sampler,
+        batch_sampler=batch_sampler,
         drop_last=quad,
         pin_memory=True,
         collate_fn=LoadImagesAndLabelsAndMasks.collate_fn4 if quad else LoadImagesAndLabelsAndMasks.collate_fn,
@@ -105,6 +118,7 @@ class LoadImagesAndLabelsAndMasks(LoadImagesAndLabels):  # for training/testing
         overlap=False,
         rank=-1,
         seed=0,
+        buckets=False,
     ):
         """Initializes the dataset with image, label, and mask loading capabilities for training/testing."""
         super().__init__(
@@ -123,6 +137,7 @@ class LoadImagesAndLabelsAndMasks(LoadImagesAndLabels):  # for training/testing
             prefix,
             rank,
             seed,
+            buckets=buckets,
         )
         self.downsample_ratio = downsample_ratio
         self.overlap = overlap
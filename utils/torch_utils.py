@@ -1,10 +1,12 @@
 # Ultralytics YOLOv5 🚀, AGPL-3.0 license
 """PyTorch utils."""
 
+import io
 import math
 import os
 import platform
 import subprocess
+import threading
 import time
 import warnings
 from contextlib import contextmanager
@@ -43,6 +45,25 @@ def smart_inference_mode(torch_1_9=check_version(torch.__version__, "1.9.0")):
     return decorate
 
 
+def is_compiling():
+    """Returns True while torch.compile() traces the caller, for skipping Python-only code that breaks the graph."""
+    compiler = getattr(torch, "compiler", None)
+    if compiler is not None and hasattr(compiler, "is_compiling"):  # torch>=2.3
+        return compiler.is_compiling()
+    dynamo = getattr(torch, "_dynamo", None)  # torch>=2.0, imported by torch.compile() before tracing
+    return bool(dynamo is not None and hasattr(dynamo, "is_compiling") and dynamo.is_compiling())
+
+
+def smart_compile(model, **kwargs):
+    """Returns torch.compile(model) for torch>=2.0, else warns and returns `model`; the compiled wrapper shares
+    parameters with `model`, which should still be used for state_dict(), EMA and checkpoints.
+    """
+    if not hasattr(torch, "compile"):
+        LOGGER.warning(f"WARNING ⚠️ --compile requires torch>=2.0, running torch-{torch.__version__} eagerly")
+        return model
+    return torch.compile(model, **kwargs)
+
+
 def smartCrossEntropyLoss(label_smoothing=0.0):
     """Returns a CrossEntropyLoss with optional label smoothing for torch>=1.10.0; warns if smoothing on lower
     versions.
@@ -339,6 +360,22 @@ def scale_img(img, ratio=1.0, same_shape=False, gs=32):  # img(16,3,256,416)
     return F.pad(img, [0, w - s[1], 0, h - s[0]], value=0.447)  # value = imagenet mean
 
 
+def prewarm(model, sizes, batch_size, device, amp=True):
+    """Runs a training forward and backward pass of `model` at each of `sizes` so that cuDNN autotuning, allocator growth
+    and graph compilation for every multi-scale shape happen before training, restoring BatchNorm statistics after.
+    """
+    buffers = [b.clone() for b in model.buffers()]
+    for sz in sizes:
+        im = torch.zeros(batch_size, 3, sz, sz, device=device)
+        with torch.cuda.amp.autocast(amp):
+            pred = model(im)  # list of Detect layer outputs
+        sum(x.float().sum() for x in pred).backward()
+    model.zero_grad(set_to_none=True)
+    with torch.no_grad():
+        for b, x in zip(model.buffers(), buffers):
+            b.copy_(x)
+
+
 def copy_attr(a, b, include=(), exclude=()):
     """Copies attributes from object b to a, optionally filtering with include and exclude lists."""
     for k, v in b.__dict__.items():
@@ -453,30 +490,122 @@ class ModelEMA:
     For EMA details see https://www.tensorflow.org/api_docs/python/tf/train/ExponentialMovingAverage.
     """
 
-    def __init__(self, model, decay=0.9999, tau=2000, updates=0):
-        """Initializes EMA with model parameters, decay rate, tau for decay adjustment, and update count; sets model to
-        evaluation mode.
+    def __init__(self, model, decay=0.9999, tau=2000, updates=0, every=1):
+        """Initializes EMA with model parameters, decay rate, tau for decay adjustment, update count and `every` N updates
+        to apply at once; sets model to evaluation mode.
         """
         self.ema = deepcopy(de_parallel(model)).eval()  # FP32 EMA
         self.updates = updates  # number of EMA updates
         self.decay = lambda x: decay * (1 - math.exp(-x / tau))  # decay exponential ramp (to help early epochs)
+        self.every = every  # apply updates every N calls with their combined decay
+        self.pending = 1.0  # combined decay of updates not applied yet
+        self.refs = None  # (model, [(ema dict, model dict, key)]) of floating point state_dict tensors
         for p in self.ema.parameters():
             p.requires_grad_(False)
 
     def update(self, model):
         """Updates the Exponential Moving Average (EMA) parameters based on the current model's parameters."""
         self.updates += 1
-        d = self.decay(self.updates)
-
-        msd = de_parallel(model).state_dict()  # model state_dict
-        for k, v in self.ema.state_dict().items():
-            if v.dtype.is_floating_point:  # true for FP16 and FP32
-                v *= d
-                v += (1 - d) * msd[k].detach()
-        # assert v.dtype == msd[k].dtype == torch.float32, f'{k}: EMA {v.dtype} and model {msd[k].dtype} must be FP32'
+        self.pending *= self.decay(self.updates)
+        if self.updates % self.every == 0:
+            self.flush(model)
+
+    def flush(self, model):
+        """Applies updates pending from `every` > 1 so that the EMA includes the current model's parameters."""
+        if self.pending == 1.0:
+            return
+        d, self.pending = self.pending, 1.0  # N skipped updates of decays d_i combine to decay prod(d_i)
+        model = de_parallel(model)
+        if self.refs is None or self.refs[0] is not model:
+            modules = dict(model.named_modules())
+            self.refs = model, [
+                (getattr(a, x), getattr(modules[name], x), k)
+                for name, a in self.ema.named_modules()
+                for x in ("_parameters", "_buffers")
+                for k, v in getattr(a, x).items()
+                if v is not None and v.dtype.is_floating_point and k not in a._non_persistent_buffers_set
+            ]
+        e, m = zip(*[(a[k], b[k]) for a, b, k in self.refs[1]])  # dict lookups follow .half()/.to() replacements
+        with torch.no_grad():
+            torch._foreach_mul_(e, d)
+            torch._foreach_add_(e, m, alpha=1 - d)
 
     def update_attr(self, model, include=(), exclude=("process_group", "reducer")):
         """Updates EMA attributes by copying specified attributes from model to EMA, excluding certain attributes by
         default.
         """
         copy_attr(self.ema, model, include, exclude)
+
+
+def cpu_snapshot(x):
+    """Returns `x` with its tensors copied to CPU (pinned memory for CUDA) and nn.Modules moved to CPU in place with
+    their gradients dropped; nested dicts, lists and tuples are followed.
+    """
+    if isinstance(x, nn.Module):
+        for p in x.parameters():
+            p.grad = None  # partially accumulated gradients are not part of the training state
+        return x.cpu()
+    if isinstance(x, torch.Tensor):
+        if x.device.type == "cuda":
+            return torch.empty_like(x, device="cpu", pin_memory=True).copy_(x.detach(), non_blocking=True)
+        return x.detach().clone()
+    if isinstance(x, dict):
+        return {k: cpu_snapshot(v) for k, v in x.items()}
+    if isinstance(x, (list, tuple)):
+        return type(x)(cpu_snapshot(v) for v in x)
+    return x
+
+
+class CheckpointWriter:
+    """Saves checkpoints in a background thread so training continues while they are serialized and written."""
+
+    def __init__(self):
+        """Initializes with no write in flight."""
+        self.thread, self.error = None, None
+
+    def save(self, ckpt, files, callback=None, copies=()):
+        """Snapshots `ckpt` to CPU, then serializes it once and writes it atomically to every path in `files` in the
+        background, calling `callback` when done; existing (src, dst) `copies` are made first, and the previous write is
+        waited for.
+        """
+        self.wait()
+        ckpt = cpu_snapshot(ckpt)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()  # complete non_blocking copies before training modifies the sources
+        self.thread = threading.Thread(target=self._write, args=(ckpt, files, callback, copies))
+        self.thread.start()
+
+    def _write(self, ckpt, files, callback, copies):
+        """Makes `copies`, then serializes `ckpt` and writes each file via a fsynced temporary file and rename."""
+        try:
+            for src, dst in copies:
+                if src.exists():
+                    self._replace(dst, src.read_bytes())
+            buffer = io.BytesIO()
+            torch.save(ckpt, buffer)
+            del ckpt
+            for f in files:
+                self._replace(f, buffer.getbuffer())
+            if callback:
+                callback()
+        except Exception as e:
+            self.error = e
+
+    @staticmethod
+    def _replace(f, data):
+        """Atomically replaces file `f` with bytes `data`, readers never see a partially written file."""
+        tmp = f.with_name(f".{f.name}.tmp")
+        with open(tmp, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, f)
+
+    def wait(self):
+        """Blocks until the write in flight has finished, re-raising its exception if it failed."""
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.error:
+            e, self.error = self.error, None
+            raise e
@@ -5,6 +5,9 @@ Validate a trained YOLOv5 detection model on a detection dataset.
 Usage:
     $ python val.py --weights yolov5s.pt --data coco128.yaml --img 640
 
+Usage - sweep (weights x image sizes, one results table):
+    $ python val.py --task sweep --weights yolov5n.pt yolov5s.pt --data coco128.yaml --sweep-imgsz 320 640 --device 0,1
+
 Usage - formats:
     $ python val.py --weights yolov5s.pt                 # PyTorch
                               yolov5s.torchscript        # TorchScript
@@ -20,13 +23,20 @@ Usage - formats:
 """
 
 import argparse
+import itertools
 import json
+import multiprocessing as mp
 import os
+import queue
 import subprocess
 import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
+import pandas as pd
+import psutil
 import torch
 from tqdm import tqdm
 
@@ -37,8 +47,9 @@ if str(ROOT) not in sys.path:
 ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 from models.common import DetectMultiBackend
+from models.experimental import attempt_load
 from utils.callbacks import Callbacks
-from utils.dataloaders import create_dataloader
+from utils.dataloaders import BatchCache, create_dataloader, subset_dataloader
 from utils.general import (
     LOGGER,
     TQDM_BAR_FORMAT,
@@ -56,7 +67,8 @@ from utils.general import (
     xywh2xyxy,
     xyxy2xywh,
 )
-from utils.metrics import ConfusionMatrix, ap_per_class, box_iou
+from utils.loss import ComputeLoss
+from utils.metrics import APStats, ConfusionMatrix, coco_evaluate, coco_summary
 from utils.plots import output_to_target, plot_images, plot_val_study
 from utils.torch_utils import select_device, smart_inference_mode
 
@@ -94,94 +106,175 @@ def save_one_txt(predn, save_conf, shape, file):
             f.write(("%g " * len(line)).rstrip() % line + "\n")
 
 
-def save_one_json(predn, jdict, path, class_map):
+class COCOJSONWriter:
     """
-    Saves a single JSON detection result, including image ID, category ID, bounding box, and confidence score.
-
-    Args:
-        predn (torch.Tensor): Predicted detections in xyxy format with shape (n, 6) where n is the number of detections.
-                              The tensor should contain [x_min, y_min, x_max, y_max, confidence, class_id] for each detection.
-        jdict (list[dict]): List to collect JSON formatted detection results.
-        path (pathlib.Path): Path object of the image file, used to extract image_id.
-        class_map (dict[int, int]): Mapping from model class indices to dataset-specific category IDs.
-
-    Returns:
-        None: Appends detection results as dictionaries to `jdict` list in-place.
+    Streams COCO-JSON detections to a file image by image instead of collecting one dict per box until the end, and
+    keeps the rounded (image_id, category_id, bbox, score) values as compact arrays for coco_evaluate().
 
     Example:
         ```python
-        predn = torch.tensor([[100, 50, 200, 150, 0.9, 0], [50, 30, 100, 80, 0.8, 1]])
-        jdict = []
-        path = Path("42.jpg")
-        class_map = {0: 18, 1: 19}
-        save_one_json(predn, jdict, path, class_map)
+        writer = COCOJSONWriter("predictions.json", class_map=[18, 19])
+        writer.add(torch.tensor([[100, 50, 200, 150, 0.9, 0], [50, 30, 100, 80, 0.8, 1]]), Path("42.jpg"))
+        writer.close()  # [{"image_id": 42, "category_id": 18, "bbox": [100.0, 50.0, 100.0, 100.0], "score": 0.9}, ...]
         ```
-        This will append to `jdict`:
-        ```
-        [
-            {'image_id': 42, 'category_id': 18, 'bbox': [125.0, 75.0, 100.0, 100.0], 'score': 0.9},
-            {'image_id': 42, 'category_id': 19, 'bbox': [75.0, 55.0, 50.0, 50.0], 'score': 0.8}
+    """
+
+    def __init__(self, file, class_map):
+        """Opens JSON `file` for writing detections with model classes mapped to dataset category IDs by `class_map`."""
+        self.file = open(file, "w")
+        self.file.write("[")
+        self.class_map = np.asarray(class_map)
+        self.n = 0  # detections written
+        self.image_ids, self.dets = [], []  # per image: image_id, (n, 6) x, y, w, h, score, category_id
+
+    def add(self, predn, path):
+        """Writes native-space detections `predn` (n, 6) xyxy, conf, cls of image `path`, whose stem is the image_id."""
+        if not len(predn):
+            return
+        image_id = int(path.stem) if path.stem.isnumeric() else path.stem
+        box = xyxy2xywh(predn[:, :4])  # xywh
+        box[:, :2] -= box[:, 2:] / 2  # xy center to top-left corner
+        box, x = box.cpu().double().numpy().round(3), predn[:, 4:].cpu().double().numpy()
+        score, cat = x[:, 0].round(5), self.class_map[x[:, 1].astype(int)]
+        d = [
+            {"image_id": image_id, "category_id": c, "bbox": b, "score": s}
+            for c, b, s in zip(cat.tolist(), box.tolist(), score.tolist())
         ]
-        ```
+        self.file.write((", " if self.n else "") + json.dumps(d)[1:-1])
+        self.n += len(d)
+        self.image_ids.append(image_id)
+        self.dets.append(np.concatenate((box, score[:, None], cat[:, None]), 1))
 
-    Notes:
-        The `bbox` values are formatted as [x, y, width, height], where x and y represent the top-left corner of the box.
-    """
-    image_id = int(path.stem) if path.stem.isnumeric() else path.stem
-    box = xyxy2xywh(predn[:, :4])  # xywh
-    box[:, :2] -= box[:, 2:] / 2  # xy center to top-left corner
-    for p, b in zip(predn.tolist(), box.tolist()):
-        jdict.append(
-            {
-                "image_id": image_id,
-                "category_id": class_map[int(p[5])],
-                "bbox": [round(x, 3) for x in b],
-                "score": round(p[4], 5),
-            }
-        )
+    def close(self):
+        """Finishes and closes the JSON file."""
+        self.file.write("]")
+        self.file.close()
+
+    def results(self):
+        """Returns per-detection image_id, category_id, bbox (n, 4) xywh and score, the arguments of coco_evaluate()."""
+        x = np.concatenate(self.dets) if self.dets else np.zeros((0, 6))
+        image_id = [y for y, d in zip(self.image_ids, self.dets) for _ in range(len(d))]
+        return image_id, x[:, 5].astype(int).tolist(), x[:, :4], x[:, 4]
 
 
-def process_batch(detections, labels, iouv):
+def process_batch(detections, labels, iouv, det_images=None, label_images=None):
     """
     Return a correct prediction matrix given detections and labels at various IoU thresholds.
 
     Args:
-        detections (np.ndarray): Array of shape (N, 6) where each row corresponds to a detection with format
+        detections (torch.Tensor): Tensor of shape (N, 6) where each row corresponds to a detection with format
             [x1, y1, x2, y2, conf, class].
-        labels (np.ndarray): Array of shape (M, 5) where each row corresponds to a ground truth label with format
+        labels (torch.Tensor): Tensor of shape (M, 5) where each row corresponds to a ground truth label with format
             [class, x1, y1, x2, y2].
-        iouv (np.ndarray): Array of IoU thresholds to evaluate at.
+        iouv (torch.Tensor): Tensor of IoU thresholds to evaluate at.
+        det_images (torch.Tensor, optional): Image index of each detection, to match a whole batch of images at once.
+        label_images (torch.Tensor, optional): Image index of each label, required with `det_images`.
 
     Returns:
-        correct (np.ndarray): A binary array of shape (N, len(iouv)) indicating whether each detection is a true positive
-            for each IoU threshold. There are 10 IoU levels used in the evaluation.
+        correct (torch.Tensor): A boolean tensor of shape (N, len(iouv)) indicating whether each detection is a true
+            positive for each IoU threshold. There are 10 IoU levels used in the evaluation.
 
     Example:
         ```python
-        detections = np.array([[50, 50, 200, 200, 0.9, 1], [30, 30, 150, 150, 0.7, 0]])
-        labels = np.array([[1, 50, 50, 200, 200]])
-        iouv = np.linspace(0.5, 0.95, 10)
+        detections = torch.tensor([[50, 50, 200, 200, 0.9, 1], [30, 30, 150, 150, 0.7, 0]])
+        labels = torch.tensor([[1, 50, 50, 200, 200]])
+        iouv = torch.linspace(0.5, 0.95, 10)
         correct = process_batch(detections, labels, iouv)
         ```
 
     Notes:
         - This function is used as part of the evaluation pipeline for object detection models.
         - IoU (Intersection over Union) is a common evaluation metric for object detection performance.
+        - Each detection is matched to its highest-IoU label of the same class, and each label keeps its first matching
+          detection in input (i.e. confidence) order. Both choices are the same at every threshold apart from the
+          IoU >= threshold test, so all thresholds are resolved in one pass without leaving the device.
+    """
+    n, m, device = detections.shape[0], labels.shape[0], iouv.device
+    if not n or not m:
+        return torch.zeros((n, iouv.shape[0]), dtype=torch.bool, device=device)
+    if det_images is None:  # single image
+        det_images = torch.zeros(n, dtype=torch.long, device=device)
+        label_images = torch.zeros(m, dtype=torch.long, device=device)
+
+    # Labels padded per image (B, max labels, 5), so each detection is only compared with labels of its own image
+    i = label_images.long().sort(stable=True)[1]  # labels grouped by image
+    counts = torch.bincount(label_images.long(), minlength=int(det_images.max()) + 1)
+    first = counts.cumsum(0) - counts  # index of the first label of each image
+    k = torch.arange(m, device=device) - first[label_images[i].long()]  # label index within its image
+    padded = torch.full((len(counts), int(counts.max()), 5), -1.0, device=device)  # class -1 never matches
+    padded[label_images[i].long(), k] = labels[i].to(padded.dtype)
+    index = torch.full(padded.shape[:2], -1, dtype=torch.long, device=device)
+    index[label_images[i].long(), k] = i  # original label index
+    lb = padded[det_images.long()]  # (N, max labels, 5) labels of each detection's image
+
+    # IoU as in box_iou(), valid for the same class only
+    (a1, a2), (b1, b2) = lb[..., 1:].chunk(2, 2), detections[:, None, :4].chunk(2, 2)
+    inter = (torch.min(a2, b2) - torch.max(a1, b1)).clamp(0).prod(2)
+    iou = inter / ((a2 - a1).prod(2) + (b2 - b1).prod(2) - inter + 1e-7)
+    best, j = (iou * (lb[..., 0] == detections[:, 5:6])).max(1)  # best label per detection
+    j = index[det_images.long(), j]  # original label index
+    candidates = best[:, None] >= iouv  # (N, len(iouv)) detection matches its best label
+
+    # First candidate detection per label, with detections grouped by label (stable in detection order)
+    order = (j * n + torch.arange(n, device=device)).argsort()
+    c = candidates[order].int()
+    cs = c.cumsum(0)
+    g = j[order]
+    start = torch.ones(n, dtype=torch.bool, device=device)
+    start[1:] = g[1:] != g[:-1]  # first detection of each label group
+    within = cs - (cs - c)[start][start.cumsum(0) - 1]  # candidates so far within the group
+    correct = torch.zeros_like(candidates)
+    correct[order] = (c == 1) & (within == 1)
+    return correct
+
+
+class RawPredictions:
+    """
+    Saves the top-k pre-NMS candidates of every image as fp16 rows of one memory-mapped file, with labels and letterbox
+    shapes in an index, so that rescore() can replay NMS and metrics without running the model again.
     """
-    correct = np.zeros((detections.shape[0], iouv.shape[0])).astype(bool)
-    iou = box_iou(labels[:, 1:], detections[:, :4])
-    correct_class = labels[:, 0:1] == detections[:, 5]
-    for i in range(len(iouv)):
-        x = torch.where((iou >= iouv[i]) & correct_class)  # IoU > threshold and classes match
-        if x[0].shape[0]:
-            matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).cpu().numpy()  # [label, detect, iou]
-            if x[0].shape[0] > 1:
-                matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
-                # matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
-            correct[matches[:, 1].astype(int), i] = True
-    return torch.tensor(correct, dtype=torch.bool, device=iouv.device)
+
+    def __init__(self, path, k=1000):
+        """Opens `path`/predictions.bin for writing up to `k` candidates per image."""
+        self.path, self.k = Path(path), k
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path / "predictions.bin", "wb")
+        self.no, self.images = None, []  # outputs per candidate, per-image (labels, im shape, shape0, ratio_pad)
+
+    def add(self, preds, targets, im_shape, shapes):
+        """Appends a batch of raw model outputs (bs, n, no) with normalized `targets`, `im_shape` and loader `shapes`."""
+        preds = preds[0] if isinstance(preds, (list, tuple)) else preds
+        bs, n, self.no = preds.shape
+        i = (preds[..., 4] * preds[..., 5:].amax(2)).topk(min(n, self.k), 1)[1]  # best candidates by max conf
+        x = torch.zeros((bs, self.k, self.no), dtype=torch.float16, device=preds.device)  # zero rows are filtered
+        x[:, : i.shape[1]] = preds.gather(1, i[..., None].expand(-1, -1, self.no))
+        self.file.write(x.cpu().numpy().tobytes())
+        targets = targets.cpu().numpy()
+        for si, (shape0, ((rh, rw), (pw, ph))) in enumerate(shapes):
+            self.images.append((targets[targets[:, 0] == si, 1:], im_shape, shape0, (rh, rw, pw, ph)))
+
+    def close(self, nc, single_cls=False):
+        """Closes the predictions file and writes index.npz, required before load()."""
+        self.file.close()
+        labels, im_shapes, shapes0, ratio_pads = zip(*self.images)
+        np.savez(
+            self.path / "index.npz",
+            shape=(len(self.images), self.k, self.no),
+            labels=np.concatenate(labels).astype(np.float32),  # class, x, y, w, h normalized
+            nl=[len(x) for x in labels],
+            im_shapes=im_shapes,
+            shapes0=shapes0,
+            ratio_pads=ratio_pads,
+            nc=nc,
+            single_cls=single_cls,
+        )
+
+    @staticmethod
+    def load(path):
+        """Returns saved candidates as a read-only memmap (images, k, no) and the index of `path`."""
+        index = dict(np.load(Path(path) / "index.npz"))
+        preds = np.memmap(Path(path) / "predictions.bin", dtype=np.float16, mode="r", shape=tuple(index["shape"]))
+        return preds, index
 
 
 @smart_inference_mode()
@@ -203,11 +296,14 @@ def run(
     save_hybrid=False,  # save label+prediction hybrid results to *.txt
     save_conf=False,  # save confidences in --save-txt labels
     save_json=False,  # save a COCO-JSON results file
+    save_raw=0,  # save top-k pre-NMS candidates per image for --task rescore
+    ap_bins=0,  # approximate metrics from this many confidence bins per class, bounded memory for very large val sets
     project=ROOT / "runs/val",  # save to project/name
     name="exp",  # save to project/name
     exist_ok=False,  # existing project/name ok, do not increment
     half=True,  # use FP16 half-precision inference
     dnn=False,  # use OpenCV DNN for ONNX inference
+    torch_compile=False,  # torch.compile() PyTorch models
     model=None,
     dataloader=None,
     save_dir=Path(""),
@@ -238,13 +334,20 @@ def run(
         save_hybrid (bool, optional): Save label and prediction hybrid results to *.txt files. Default is False.
         save_conf (bool, optional): Save confidences in --save-txt labels. Default is False.
         save_json (bool, optional): Save a COCO-JSON results file. Default is False.
+        save_raw (int, optional): Save this many top pre-NMS candidates per image to save_dir/raw for --task rescore.
+            Default is 0.
+        ap_bins (int, optional): Compute approximate metrics from per-class histograms of this many confidence bins,
+            with memory bounded however many predictions a very large val set has. Default is 0, exact metrics.
         project (str | Path, optional): Directory to save results. Default is ROOT/'runs/val'.
         name (str, optional): Name of the run. Default is 'exp'.
         exist_ok (bool, optional): Overwrite existing project/name without incrementing. Default is False.
         half (bool, optional): Use FP16 half-precision inference. Default is True.
         dnn (bool, optional): Use OpenCV DNN for ONNX inference. Default is False.
+        torch_compile (bool, optional): Compile PyTorch models with torch.compile(), not used for `model` during
+            training. Default is False.
         model (torch.nn.Module, optional): Model object for training. Default is None.
-        dataloader (torch.utils.data.DataLoader, optional): Dataloader object. Default is None.
+        dataloader (torch.utils.data.DataLoader, optional): Dataloader object, also reused when called directly, e.g. a
+            sweep BatchCache built for `imgsz`. Default is None.
         save_dir (Path, optional): Directory to save results. Default is Path('').
         plots (bool, optional): Plot validation images and metrics. Default is True.
         callbacks (utils.callbacks.Callbacks, optional): Callbacks for logging and monitoring. Default is Callbacks().
@@ -267,7 +370,7 @@ def run(
         (save_dir / "labels" if save_txt else save_dir).mkdir(parents=True, exist_ok=True)  # make dir
 
         # Load model
-        model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data, fp16=half)
+        model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data, fp16=half, torch_compile=torch_compile)
         stride, pt, jit, engine = model.stride, model.pt, model.jit, model.engine
         imgsz = check_img_size(imgsz, s=stride)  # check image size
         half = model.fp16  # FP16 supported on limited backends with CUDA
@@ -275,7 +378,9 @@ def run(
             batch_size = model.batch_size
         else:
             device = model.device
-            if not (pt or jit):
+            if model.xml:  # batches are split over OpenVINO parallel infer requests
+                LOGGER.info(f"Forcing square inference ({batch_size},3,{imgsz},{imgsz}) for OpenVINO models")
+            elif not (pt or jit):
                 batch_size = 1  # export.py models default to batch-size 1
                 LOGGER.info(f"Forcing --batch-size 1 square inference (1,3,{imgsz},{imgsz}) for non-PyTorch models")
 
@@ -301,17 +406,18 @@ def run(
         model.warmup(imgsz=(1 if pt else batch_size, 3, imgsz, imgsz))  # warmup
         pad, rect = (0.0, False) if task == "speed" else (0.5, pt)  # square inference for benchmarks
         task = task if task in ("train", "val", "test") else "val"  # path to train/val/test images
-        dataloader = create_dataloader(
-            data[task],
-            imgsz,
-            batch_size,
-            stride,
-            single_cls,
-            pad=pad,
-            rect=rect,
-            workers=workers,
-            prefix=colorstr(f"{task}: "),
-        )[0]
+        if dataloader is None:  # else reuse the given dataloader, i.e. a sweep BatchCache
+            dataloader = create_dataloader(
+                data[task],
+                imgsz,
+                batch_size,
+                stride,
+                single_cls,
+                pad=pad,
+                rect=rect,
+                workers=workers,
+                prefix=colorstr(f"{task}: "),
+            )[0]
 
     seen = 0
     confusion_matrix = ConfusionMatrix(nc=nc)
@@ -323,7 +429,12 @@ def run(
     tp, fp, p, r, f1, mp, mr, map50, ap50, map = 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
     dt = Profile(device=device), Profile(device=device), Profile(device=device)  # profiling times
     loss = torch.zeros(3, device=device)
-    jdict, stats, ap, ap_class = [], [], [], []
+    ap, ap_class = [], []
+    if save_json:
+        w = Path(weights[0] if isinstance(weights, list) else weights).stem if weights is not None else ""  # weights
+        coco_json = COCOJSONWriter(save_dir / f"{w}_predictions.json", class_map)  # streamed predictions
+    ap_stats = APStats(nc, niou, ap_bins, device)  # streaming (correct, conf, pcls, tcls) statistics
+    raw = RawPredictions(save_dir / "raw", save_raw) if save_raw else None
     callbacks.run("on_val_start")
     pbar = tqdm(dataloader, desc=s, bar_format=TQDM_BAR_FORMAT)  # progress bar
     for batch_i, (im, targets, paths, shapes) in enumerate(pbar):
@@ -343,6 +454,8 @@ def run(
         # Loss
         if compute_loss:
             loss += compute_loss(train_out, targets)[1]  # box, obj, cls
+        if raw:
+            raw.add(preds, targets, (height, width), shapes)
 
         # NMS
         targets[:, 2:] *= torch.tensor((width, height, width, height), device=device)  # to pixels
@@ -353,6 +466,8 @@ def run(
             )
 
         # Metrics
+        stats = []  # per-image (correct, conf, pcls, tcls) of this batch
+        matches = []  # (stats index, native-space predictions, native-space labels) matched in one pass below
         for si, pred in enumerate(preds):
             labels = targets[targets[:, 0] == si, 1:]
             nl, npr = labels.shape[0], pred.shape[0]  # number of labels, predictions
@@ -378,9 +493,7 @@ def run(
                 tbox = xywh2xyxy(labels[:, 1:5])  # target boxes
                 scale_boxes(im[si].shape[1:], tbox, shape, shapes[si][1])  # native-space labels
                 labelsn = torch.cat((labels[:, 0:1], tbox), 1)  # native-space labels
-                correct = process_batch(predn, labelsn, iouv)
-                if plots:
-                    confusion_matrix.process_batch(predn, labelsn)
+                matches.append((len(stats), predn, labelsn))
             stats.append((correct, pred[:, 4], pred[:, 5], labels[:, 0]))  # (correct, conf, pcls, tcls)
 
             # Save/log
@@ -388,9 +501,24 @@ def run(
                 (save_dir / "labels").mkdir(parents=True, exist_ok=True)
                 save_one_txt(predn, save_conf, shape, file=save_dir / "labels" / f"{path.stem}.txt")
             if save_json:
-                save_one_json(predn, jdict, path, class_map)  # append to COCO-JSON dictionary
+                coco_json.add(predn, path)  # append to COCO-JSON file
             callbacks.run("on_val_image_end", pred, predn, path, names, im[si])
 
+        if matches:  # all images of the batch at once
+            k, p, lb = zip(*matches)
+            n = torch.tensor([len(x) for x in p], device=device)
+            images = torch.arange(len(k), device=device)
+            p_images = images.repeat_interleave(n)
+            lb_images = images.repeat_interleave(torch.tensor([len(x) for x in lb], device=device))
+            p, lb = torch.cat(p), torch.cat(lb)
+            correct = process_batch(p, lb, iouv, p_images, lb_images)
+            for i, c in zip(k, correct.split(n.tolist())):
+                stats[i] = (c, *stats[i][1:])
+            if plots:
+                confusion_matrix.process_batch(p, lb, p_images, lb_images)
+        if stats:
+            ap_stats.update(*(torch.cat(x, 0) for x in zip(*stats)))
+
         # Plot images
         if plots and batch_i < 3:
             plot_images(im, targets, paths, save_dir / f"val_batch{batch_i}_labels.jpg", names)  # labels
@@ -399,12 +527,11 @@ def run(
         callbacks.run("on_val_batch_end", batch_i, im, targets, paths, shapes, preds)
 
     # Compute metrics
-    stats = [torch.cat(x, 0).cpu().numpy() for x in zip(*stats)]  # to numpy
-    if len(stats) and stats[0].any():
-        tp, fp, p, r, f1, ap, ap_class = ap_per_class(*stats, plot=plots, save_dir=save_dir, names=names)
+    if ap_stats.any():
+        tp, fp, p, r, f1, ap, ap_class = ap_stats.ap_per_class(plot=plots, save_dir=save_dir, names=names)
         ap50, ap = ap[:, 0], ap.mean(1)  # AP@0.5, AP@0.5:0.95
         mp, mr, map50, map = p.mean(), r.mean(), ap50.mean(), ap.mean()
-    nt = np.bincount(stats[3].astype(int), minlength=nc)  # number of targets per class
+    nt = ap_stats.nt.cpu().numpy()  # number of targets per class
 
     # Print results
     pf = "%22s" + "%11i" * 2 + "%11.3g" * 4  # print format
@@ -413,7 +540,7 @@ def run(
         LOGGER.warning(f"WARNING ⚠️ no labels found in {task} set, can not compute metrics without labels")
 
     # Print results per class
-    if (verbose or (nc < 50 and not training)) and nc > 1 and len(stats):
+    if (verbose or (nc < 50 and not training)) and nc > 1 and len(ap_class):
         for i, c in enumerate(ap_class):
             LOGGER.info(pf % (names[c], seen, nt[c], p[i], r[i], ap50[i], ap[i]))
 
@@ -429,34 +556,25 @@ def run(
         callbacks.run("on_val_end", nt, tp, fp, p, r, f1, ap, ap50, ap_class, confusion_matrix)
 
     # Save JSON
-    if save_json and len(jdict):
-        w = Path(weights[0] if isinstance(weights, list) else weights).stem if weights is not None else ""  # weights
+    if save_json:
+        coco_json.close()
+    if save_json and coco_json.n:
         anno_json = str(Path("../datasets/coco/annotations/instances_val2017.json"))  # annotations
         if not os.path.exists(anno_json):
             anno_json = os.path.join(data["path"], "annotations", "instances_val2017.json")
-        pred_json = str(save_dir / f"{w}_predictions.json")  # predictions
-        LOGGER.info(f"\nEvaluating pycocotools mAP... saving {pred_json}...")
-        with open(pred_json, "w") as f:
-            json.dump(jdict, f)
-
-        try:  # https://github.com/cocodataset/cocoapi/blob/master/PythonAPI/pycocoEvalDemo.ipynb
-            check_requirements("pycocotools>=2.0.6")
-            from pycocotools.coco import COCO
-            from pycocotools.cocoeval import COCOeval
-
-            anno = COCO(anno_json)  # init annotations api
-            pred = anno.loadRes(pred_json)  # init predictions api
-            eval = COCOeval(anno, pred, "bbox")
-            if is_coco:
-                eval.params.imgIds = [int(Path(x).stem) for x in dataloader.dataset.im_files]  # image IDs to evaluate
-            eval.evaluate()
-            eval.accumulate()
-            eval.summarize()
-            map, map50 = eval.stats[:2]  # update results (mAP@0.5:0.95, mAP@0.5)
+        LOGGER.info(f"\nEvaluating COCO mAP... saved {coco_json.file.name}")
+        try:  # COCOeval-equivalent metrics, https://github.com/cocodataset/cocoapi/blob/master/PythonAPI/pycocotools
+            img_ids = [int(Path(x).stem) for x in dataloader.dataset.im_files] if is_coco else None  # IDs to evaluate
+            stats = coco_evaluate(anno_json, *coco_json.results(), img_ids=img_ids)
+            LOGGER.info(coco_summary(stats))
+            map, map50 = stats[:2]  # update results (mAP@0.5:0.95, mAP@0.5)
         except Exception as e:
-            LOGGER.info(f"pycocotools unable to run: {e}")
+            LOGGER.info(f"COCO evaluation unable to run: {e}")
 
     # Return results
+    if raw:
+        raw.close(nc, single_cls)
+        LOGGER.info(f"Raw predictions saved to {colorstr('bold', raw.path)}, replay with --task rescore")
     model.float()  # for training
     if not training:
         s = f"\n{len(list(save_dir.glob('labels/*.txt')))} labels saved to {save_dir / 'labels'}" if save_txt else ""
@@ -467,6 +585,216 @@ def run(
     return (mp, mr, map50, map, *(loss.cpu() / len(dataloader)).tolist()), maps, t
 
 
+class BackgroundValidator:
+    """Validates model snapshots in a separate process so that training continues while they are evaluated."""
+
+    def __init__(self, loader_args, subset=1.0, device="cpu", **kwargs):
+        """Starts the process, which builds its val dataloader from create_dataloader() `loader_args` and a fixed random
+        `subset` fraction of it; other arguments are those of run().
+        """
+        ctx = mp.get_context("spawn")
+        self.tasks, self.results, self.n = ctx.Queue(), ctx.Queue(), 0
+        args = (self.tasks, self.results, loader_args, subset, str(device), kwargs)
+        self.process = ctx.Process(target=background_validate, args=args)  # not daemonic, dataloader workers allowed
+        tqdm_disable = os.environ.get("TQDM_DISABLE")
+        os.environ["TQDM_DISABLE"] = "1"  # no progress bars over the training progress bar, inherited by the process
+        try:
+            self.process.start()
+        finally:
+            if tqdm_disable is None:
+                del os.environ["TQDM_DISABLE"]
+            else:
+                os.environ["TQDM_DISABLE"] = tqdm_disable
+
+    def submit(self, epoch, model, full=True):
+        """Queues CPU `model` of `epoch` for validation on the full val set, or on the subset if not `full`."""
+        self.tasks.put((epoch, model, full))
+        self.n += 1
+
+    def collect(self):
+        """Waits for all queued validations, returning their (epoch, results, maps) in submission order."""
+        out = []
+        while self.n:
+            try:
+                x = self.results.get(timeout=1)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"background validation exited with code {self.process.exitcode}") from None
+                continue
+            self.n -= 1
+            if isinstance(x, Exception):
+                raise x
+            out.append(x)
+        return out
+
+    def close(self):
+        """Stops the process after the queued validations, discarding their results."""
+        if self.process.is_alive():
+            self.tasks.put(None)
+            self.process.join()
+
+
+def background_validate(tasks, results, loader_args, subset, device, kwargs):
+    """BackgroundValidator process: validates (epoch, model, full) from `tasks` until None, putting (epoch, results,
+    maps) or the exception raised, with its traceback, on `results`.
+    """
+    LOGGER.setLevel("WARNING")  # results are reported by the training process
+    try:
+        loader = create_dataloader(**loader_args)[0]
+        loaders = {True: loader, False: subset_dataloader(loader, subset) if subset < 1 else loader}
+    except Exception:
+        results.put(RuntimeError(f"background validation dataloader failed:\n{traceback.format_exc()}"))
+        return
+    while True:
+        try:
+            task = tasks.get(timeout=10)
+        except queue.Empty:
+            if mp.parent_process().is_alive():
+                continue
+            break  # training process is gone
+        if task is None:
+            break
+        epoch, model, full = task
+        try:
+            model = model.to(device)
+            r, maps, _ = run(model=model, dataloader=loaders[full], compute_loss=ComputeLoss(model), **kwargs)
+            results.put((epoch, r, maps))
+        except Exception:
+            results.put(RuntimeError(f"background validation of epoch {epoch} failed:\n{traceback.format_exc()}"))
+
+
+def sweep(weights, imgsz=640, sweep_imgsz=None, device="", jobs=1, project=ROOT / "runs/val", name="exp", **kwargs):
+    """
+    Evaluates every combination of `weights` and `sweep_imgsz` sizes, saving and returning one results table.
+
+    Weights are split over the comma-separated CUDA `device` list with one process per device. Each process builds the
+    dataloader once per size, caches its letterboxed batches for all PyTorch weights if they fit in its share of half the
+    available RAM, and evaluates `jobs` weights at a time on it. Use jobs=1 for comparable speed columns. Other arguments
+    are those of run().
+    """
+    save_dir = increment_path(Path(project) / name, exist_ok=kwargs.pop("exist_ok", False))
+    save_dir.mkdir(parents=True, exist_ok=True)
+    kwargs["data"] = check_dataset(kwargs["data"])  # download once
+    kwargs.pop("task", None)
+    sizes, devices = sweep_imgsz or [imgsz], [d.strip() for d in str(device).split(",") if d.strip()] or [""]
+    kwargs["cache_bytes"] = psutil.virtual_memory().available * 0.5 / len(devices)  # BatchCache RAM per process
+    if len(devices) > 1:  # one process per device
+        with ProcessPoolExecutor(len(devices), mp_context=mp.get_context("spawn")) as pool:
+            futures = [
+                pool.submit(sweep_device, weights[i :: len(devices)], sizes, d, jobs, save_dir, **kwargs)
+                for i, d in enumerate(devices)
+            ]
+            rows = [x for f in futures for x in f.result()]
+    else:
+        rows = sweep_device(weights, sizes, devices[0], jobs, save_dir, **kwargs)
+
+    c = ["Weights", "Size", "P", "R", "mAP50", "mAP50-95", "Pre-process (ms)", "Inference (ms)", "NMS (ms)"]
+    py = pd.DataFrame(rows, columns=c).sort_values(["Weights", "Size"], ignore_index=True)
+    py.to_csv(save_dir / "sweep.csv", index=False)
+    LOGGER.info(f"\nSweep complete, results saved to {colorstr('bold', save_dir / 'sweep.csv')}\n{py}")
+    return py
+
+
+def sweep_device(
+    weights, sizes, device, jobs, save_dir, data, batch_size=32, workers=8, single_cls=False, cache_bytes=None, **kwargs
+):
+    """Returns sweep() rows of `weights` at `sizes` on one device, sharing one dataloader per size, with batches cached
+    in up to `cache_bytes` of RAM.
+    """
+    select_device(device, batch_size=batch_size)  # before any CUDA use, sets CUDA_VISIBLE_DEVICES in spawned processes
+    pt = [w for w in weights if str(w).endswith(".pt")]  # PyTorch weights share cached batches
+    stride = max((int(attempt_load(w, device="cpu", fuse=False).stride.max()) for w in pt), default=32)
+    rows = []
+    for imgsz in sizes:
+        imgsz = check_img_size(imgsz, s=stride)
+        dataloader = None
+        if pt:
+            dataloader = create_dataloader(
+                data["val"], imgsz, batch_size, stride, single_cls, pad=0.5, rect=True, workers=workers, prefix="val: "
+            )[0]
+            dataloader = BatchCache(dataloader, cache_bytes, prefix="val: ")
+
+        def evaluate(w):
+            """Evaluates weights `w` at `imgsz`, returning a sweep() row."""
+            r, _, t = run(
+                data,
+                weights=w,
+                batch_size=batch_size,
+                imgsz=imgsz,
+                device=device,
+                workers=workers,
+                single_cls=single_cls,
+                project=save_dir,
+                name=f"{Path(w).stem}_{imgsz}",
+                exist_ok=True,
+                dataloader=dataloader if w in pt else None,
+                plots=False,
+                **kwargs,
+            )
+            return [str(w), imgsz, *r[:4], *t]
+
+        with ThreadPoolExecutor(jobs) as pool:
+            rows.extend(pool.map(evaluate, weights))
+    return rows
+
+
+def rescore(raw, conf_thres=0.001, iou_thres=0.6, max_det=300, agnostic_nms=False, batch_size=32, ap_bins=0):
+    """Replays NMS and metrics on RawPredictions saved by run(save_raw=k), returning (P, R, mAP50, mAP50-95)."""
+    preds, index = RawPredictions.load(raw)
+    nc, single_cls = int(index["nc"]), bool(index["single_cls"])
+    first = np.r_[0, index["nl"].cumsum()]  # first label of each image
+    iouv = torch.linspace(0.5, 0.95, 10)  # iou vector for mAP@0.5:0.95
+    ap_stats = APStats(nc, len(iouv), ap_bins)
+    for b in range(0, len(preds), batch_size):
+        out = non_max_suppression(
+            torch.from_numpy(preds[b : b + batch_size].astype(np.float32)),
+            conf_thres,
+            iou_thres,
+            multi_label=True,
+            agnostic=agnostic_nms or single_cls,
+            max_det=max_det,
+            time_limit=float("inf"),  # replays must not depend on speed
+        )
+        p, lb = [], []
+        for si, pred in enumerate(out, b):
+            labels = torch.from_numpy(index["labels"][first[si] : first[si + 1]])
+            (h, w), shape0, ratio_pad = index["im_shapes"][si], index["shapes0"][si], index["ratio_pads"][si]
+            if single_cls:
+                pred[:, 5] = 0
+            tbox = xywh2xyxy(labels[:, 1:5] * torch.tensor((w, h, w, h)))  # target boxes
+            for x in pred[:, :4], tbox:
+                scale_boxes((h, w), x, shape0, ratio_pad.reshape(2, 2))  # native-space pred and labels
+            p.append(pred)
+            lb.append(torch.cat((labels[:, :1], tbox), 1))
+
+        images = torch.arange(len(p))
+        p_images = images.repeat_interleave(torch.tensor([len(x) for x in p]))
+        lb_images = images.repeat_interleave(torch.tensor([len(x) for x in lb]))
+        p, lb = torch.cat(p), torch.cat(lb)
+        ap_stats.update(process_batch(p, lb, iouv, p_images, lb_images), p[:, 4], p[:, 5], lb[:, 0])
+
+    mp = mr = map50 = map = 0.0
+    if ap_stats.any():
+        _, _, p, r, _, ap, _ = ap_stats.ap_per_class(names={})
+        mp, mr, map50, map = p.mean(), r.mean(), ap[:, 0].mean(), ap.mean()
+    return mp, mr, map50, map
+
+
+def rescore_grid(raw, grid, workers=8, **kwargs):
+    """Runs rescore() for every combination of `grid` {argument: values} in parallel processes, returning a DataFrame."""
+    combos = [dict(zip(grid, x)) for x in itertools.product(*grid.values())]
+    n = max(1, min(workers, len(combos)))  # number of processes
+    with ProcessPoolExecutor(n, initializer=torch.set_num_threads, initargs=(1,)) as pool:
+        futures = [pool.submit(rescore, raw, **x, **kwargs) for x in combos]
+        rows = [[*x.values(), *f.result()] for x, f in zip(combos, futures)]
+
+    py = pd.DataFrame(rows, columns=[*grid, "P", "R", "mAP50", "mAP50-95"])
+    py = py.sort_values("mAP50-95", ascending=False, ignore_index=True)
+    py.to_csv(Path(raw) / "rescore.csv", index=False)
+    LOGGER.info(f"\nRescore complete, results saved to {colorstr('bold', Path(raw) / 'rescore.csv')}\n{py}")
+    return py
+
+
 def parse_opt():
     """
     Parse command-line options for configuring YOLOv5 model inference.
@@ -479,7 +807,8 @@ def parse_opt():
         conf_thres (float, optional): Confidence threshold for predictions. Default is 0.001.
         iou_thres (float, optional): IoU threshold for Non-Max Suppression (NMS). Default is 0.6.
         max_det (int, optional): Maximum number of detections per image. Default is 300.
-        task (str, optional): Task type - options are 'train', 'val', 'test', 'speed', or 'study'. Default is 'val'.
+        task (str, optional): Task type - options are 'train', 'val', 'test', 'speed', 'study', 'sweep' or 'rescore'.
+            Default is 'val'.
         device (str, optional): Device to run the model on. e.g., '0' or '0,1,2,3' or 'cpu'. Default is empty to let the system choose automatically.
         workers (int, optional): Maximum number of dataloader workers per rank in DDP mode. Default is 8.
         single_cls (bool, optional): If set, treats the dataset as a single-class dataset. Default is False.
@@ -489,11 +818,23 @@ def parse_opt():
         save_hybrid (bool, optional): If set, saves label+prediction hybrid results to *.txt files. Default is False.
         save_conf (bool, optional): If set, saves confidences in --save-txt labels. Default is False.
         save_json (bool, optional): If set, saves results to a COCO-JSON file. Default is False.
+        save_raw (int, optional): If set, saves this many (default 1000) top pre-NMS candidates per image for --task
+            rescore. Default is 0.
+        ap_bins (int, optional): If set, computes approximate metrics from this many confidence bins per class with
+            bounded memory, also for --task rescore. Default is 0.
         project (str, optional): Project directory to save results to. Default is 'runs/val'.
         name (str, optional): Name of the directory to save results to. Default is 'exp'.
         exist_ok (bool, optional): If set, existing directory will not be incremented. Default is False.
         half (bool, optional): If set, uses FP16 half-precision inference. Default is False.
         dnn (bool, optional): If set, uses OpenCV DNN for ONNX inference. Default is False.
+        torch_compile (bool, optional): If set by --compile, compiles PyTorch models with torch.compile(). Default is
+            False.
+        sweep_imgsz (list[int], optional): Inference sizes evaluated for every weight with --task sweep. Default is
+            --imgsz.
+        jobs (int, optional): Number of weights evaluated concurrently per device with --task sweep. Default is 1.
+        raw (str, optional): Directory of --save-raw predictions replayed by --task rescore. Default is None.
+        grid (list[str], optional): --task rescore values to try as 'name=v1,v2' for conf_thres, iou_thres, max_det and
+            agnostic_nms (0 or 1), others fixed at their --conf-thres, --iou-thres and --max-det. Default is [].
 
     Returns:
         argparse.Namespace: Parsed command-line options.
@@ -522,7 +863,7 @@ def parse_opt():
     parser.add_argument("--conf-thres", type=float, default=0.001, help="confidence threshold")
     parser.add_argument("--iou-thres", type=float, default=0.6, help="NMS IoU threshold")
     parser.add_argument("--max-det", type=int, default=300, help="maximum detections per image")
-    parser.add_argument("--task", default="val", help="train, val, test, speed or study")
+    parser.add_argument("--task", default="val", help="train, val, test, speed, study, sweep or rescore")
     parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
     parser.add_argument("--workers", type=int, default=8, help="max dataloader workers (per RANK in DDP mode)")
     parser.add_argument("--single-cls", action="store_true", help="treat as single-class dataset")
@@ -532,11 +873,18 @@ def parse_opt():
     parser.add_argument("--save-hybrid", action="store_true", help="save label+prediction hybrid results to *.txt")
     parser.add_argument("--save-conf", action="store_true", help="save confidences in --save-txt labels")
     parser.add_argument("--save-json", action="store_true", help="save a COCO-JSON results file")
+    parser.add_argument("--save-raw", nargs="?", const=1000, default=0, type=int, help="save top-k preds for rescore")
+    parser.add_argument("--ap-bins", type=int, default=0, help="approximate metrics from per-class confidence bins")
     parser.add_argument("--project", default=ROOT / "runs/val", help="save to project/name")
     parser.add_argument("--name", default="exp", help="save to project/name")
     parser.add_argument("--exist-ok", action="store_true", help="existing project/name ok, do not increment")
     parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
     parser.add_argument("--dnn", action="store_true", help="use OpenCV DNN for ONNX inference")
+    parser.add_argument("--compile", action="store_true", dest="torch_compile", help="torch.compile() PyTorch models")
+    parser.add_argument("--sweep-imgsz", nargs="+", type=int, help="--task sweep inference sizes, default --imgsz")
+    parser.add_argument("--jobs", type=int, default=1, help="--task sweep concurrent evaluations per device")
+    parser.add_argument("--raw", type=str, help="--task rescore raw predictions dir, i.e. runs/val/exp/raw")
+    parser.add_argument("--grid", nargs="+", default=[], help="--task rescore grid, i.e. iou_thres=0.5,0.6 max_det=100")
     opt = parser.parse_args()
     opt.data = check_yaml(opt.data)  # check YAML
     opt.save_json |= opt.data.endswith("coco.yaml")
@@ -566,6 +914,7 @@ def main(opt):
         ```
     """
     check_requirements(ROOT / "requirements.txt", exclude=("tensorboard", "thop"))
+    task_opt = {k: vars(opt).pop(k, None) for k in ("sweep_imgsz", "jobs", "raw", "grid")}  # --task sweep, rescore
 
     if opt.task in ("train", "val", "test"):  # run normally
         if opt.conf_thres > 0.001:  # https://github.com/ultralytics/yolov5/issues/1466
@@ -595,8 +944,24 @@ def main(opt):
                 np.savetxt(f, y, fmt="%10.4g")  # save
             subprocess.run(["zip", "-r", "study.zip", "study_*.txt"])
             plot_val_study(x=x)  # plot
+
+        elif opt.task == "sweep":  # weights x image sizes, one results table
+            # python val.py --task sweep --data coco.yaml --weights w1.pt w2.pt... --sweep-imgsz 320 640 --device 0,1
+            opt.weights = weights
+            sweep(**vars(opt), sweep_imgsz=task_opt["sweep_imgsz"], jobs=task_opt["jobs"])
+
+        elif opt.task == "rescore":  # NMS and threshold settings on --save-raw predictions, without inference
+            # python val.py --task rescore --raw runs/val/exp/raw --grid conf_thres=0.001,0.25 iou_thres=0.5,0.6,0.7
+            grid = {"conf_thres": [opt.conf_thres], "iou_thres": [opt.iou_thres], "max_det": [opt.max_det]}
+            grid["agnostic_nms"] = [False]
+            for x in task_opt["grid"]:
+                k, v = x.split("=")
+                assert k in grid, f"--grid {x} not one of {list(grid)}"
+                grid[k] = [type(grid[k][0])(float(y)) for y in v.split(",")]
+            rescore_grid(task_opt["raw"], grid, workers=opt.workers, batch_size=opt.batch_size, ap_bins=opt.ap_bins)
         else:
-            raise NotImplementedError(f'--task {opt.task} not in ("train", "val", "test", "speed", "study")')
+            tasks = ("train", "val", "test", "speed", "study", "sweep", "rescore")
+            raise NotImplementedError(f"--task {opt.task} not in {tasks}")
 
 
 if __name__ == "__main__":